@@ -0,0 +1,112 @@
+"""
+Бенчмарк задержки обработчиков при одновременной записи множества пользователей.
+
+Сравнивает синхронные вызовы хранилища прямо в event loop с асинхронным API,
+который выносит файловые операции в ограниченный пул потоков.
+
+Запуск из корня репозитория:
+    python -m benchmarks.async_storage_bench --users 500 --rounds 5
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.corpus import make_character
+from storage.character_storage import CharacterStorage
+
+class SlowDiskStorage(CharacterStorage):
+    """Хранилище с искусственной задержкой записи, имитирующей медленный диск"""
+    
+    def __init__(self, base_dir: str, disk_delay: float, max_workers: int):
+        super().__init__(base_dir, max_workers=max_workers)
+        self.disk_delay = disk_delay
+    
+    def save_character(self, user_id, character_data):
+        time.sleep(self.disk_delay)
+        return super().save_character(user_id, character_data)
+
+def percentile(values: list, fraction: float) -> float:
+    """Перцентиль по отсортированной выборке"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * fraction))
+    return ordered[index]
+
+async def money_handler(storage: CharacterStorage, user_id: int, character_id: str, use_async: bool):
+    """Упрощенный обработчик /set_money: загрузить, изменить, сохранить"""
+    if use_async:
+        character = await storage.load(user_id, character_id)
+        character["equipment"]["money"]["gold"] += 1
+        await storage.save(user_id, character)
+    else:
+        character = storage.load_character(user_id, character_id)
+        character["equipment"]["money"]["gold"] += 1
+        storage.save_character(user_id, character)
+
+async def simulate_user(storage, user_id, character_id, rounds, use_async, latencies, rng):
+    for _ in range(rounds):
+        await asyncio.sleep(rng.uniform(0, 0.05))
+        started = time.perf_counter()
+        await money_handler(storage, user_id, character_id, use_async)
+        latencies.append(time.perf_counter() - started)
+
+async def probe(stop: asyncio.Event, latencies: list, interval: float = 0.005):
+    """Легкий обработчик (например, /help), не трогающий диск: измеряет задержку event loop"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies.append(time.perf_counter() - started - interval)
+
+async def run_mode(args, use_async: bool) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as base_dir:
+        storage = SlowDiskStorage(base_dir, args.disk_delay_ms / 1000, args.workers)
+        character_ids = {}
+        for user_id in range(1, args.users + 1):
+            character = make_character(f"Герой {user_id}", rng)
+            storage.save_character(user_id, character)
+            character_ids[user_id] = character["id"]
+        
+        handler_latencies, probe_latencies = [], []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(stop, probe_latencies))
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(storage, user_id, character_id, args.rounds, use_async, handler_latencies, random.Random(user_id))
+            for user_id, character_id in character_ids.items()
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+        storage.close()
+    
+    return {
+        "mode": "async" if use_async else "sync",
+        "operations": len(handler_latencies),
+        "throughput": len(handler_latencies) / elapsed,
+        "handler_p50_ms": statistics.median(handler_latencies) * 1000,
+        "handler_p99_ms": percentile(handler_latencies, 0.99) * 1000,
+        "probe_p99_ms": percentile(probe_latencies, 0.99) * 1000 if probe_latencies else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=8, help="размер пула потоков хранилища")
+    parser.add_argument("--disk-delay-ms", type=float, default=2.0, help="искусственная задержка записи")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    print(f"{'режим':<8}{'операций':>10}{'оп/с':>10}{'p50, мс':>10}{'p99, мс':>10}{'probe p99, мс':>16}")
+    for use_async in (False, True):
+        result = asyncio.run(run_mode(args, use_async))
+        print(
+            f"{result['mode']:<8}{result['operations']:>10}{result['throughput']:>10.0f}"
+            f"{result['handler_p50_ms']:>10.1f}{result['handler_p99_ms']:>10.1f}{result['probe_p99_ms']:>16.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Сравнение бэкендов хранилища: JSON-файлы и SQLite.
+
+Измеряет задержку save, load и list (краткие записи для клавиатур) с отключенным
+кэшем документов, чтобы сравнивались именно бэкенды.
+
+Запуск из корня репозитория:
+    python -m benchmarks.backend_bench --users 200 --characters 5
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.corpus import make_corpus
+from storage.character_storage import CharacterStorage
+from storage.sqlite_storage import SQLiteCharacterStorage
+
+def percentile(values: list, fraction: float) -> float:
+    """Перцентиль по отсортированной выборке"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def measure(operation, arguments: list) -> dict:
+    """Выполнить операцию для каждого набора аргументов и собрать задержки"""
+    latencies = []
+    started = time.perf_counter()
+    for args in arguments:
+        call_started = time.perf_counter()
+        operation(*args)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {
+        "ops_per_sec": len(latencies) / elapsed,
+        "mean_us": statistics.mean(latencies) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+    }
+
+def run_backend(storage: CharacterStorage, corpus: dict, rng: random.Random) -> dict:
+    saves = [(user_id, character) for user_id, characters in corpus.items() for character in characters]
+    lists = [(user_id,) for user_id in corpus]
+    
+    results = {"save": measure(storage.save_character, saves)}
+    # ID выдаются при первом сохранении
+    loads = [(user_id, character["id"]) for user_id, character in saves]
+    rng.shuffle(loads)
+    results["load"] = measure(storage.load_character, loads)
+    results["list"] = measure(storage.get_character_summaries, lists)
+    storage.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--characters", type=int, default=5, help="персонажей на пользователя")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    corpus = make_corpus(args.users, args.characters, args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        backends = {
+            "files": CharacterStorage(os.path.join(workdir, "characters"), cache_size=0),
+            "sqlite": SQLiteCharacterStorage(os.path.join(workdir, "characters.db"), cache_size=0),
+        }
+        print(f"{'бэкенд':<8}{'операция':<10}{'оп/с':>10}{'среднее, мкс':>15}{'p99, мкс':>12}")
+        for name, storage in backends.items():
+            results = run_backend(storage, corpus, random.Random(args.seed))
+            for operation, stats in results.items():
+                print(
+                    f"{name:<8}{operation:<10}{stats['ops_per_sec']:>10.0f}"
+                    f"{stats['mean_us']:>15.0f}{stats['p99_us']:>12.0f}"
+                )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Шардирование пользователей по процессам-работникам: пропускная способность и баланс кольца.
+
+Родитель готовит хранилище (у каждого из --users пользователей один персонаж), запускает
+WorkerPool из cluster.ingress с N работниками и, дождавшись их готовности, подает синтетические
+обновления Telegram - JSON-словари, как их отдает getUpdates, пачками по 100. Каждый пользователь
+--rounds раз проходит диалог /set_money -> персонаж -> "Добавить" -> "0 1 0 0". Ответы бота
+уходят в сессию без сети. После прогона проверяется, что золото каждого персонажа выросло
+ровно на --rounds: шаги диалога не потерялись и не обогнали друг друга.
+
+Обработка команд упирается в процессор, ингресс только раскладывает словари по очередям,
+поэтому рост близок к линейному, пока работников не больше ядер (в таблице - число ядер).
+Дополнительно печатается баланс кольца (максимум к среднему пользователей на работника)
+и доля пользователей, сменивших работника при добавлении еще одного (ожидается около 1/(N+1)).
+
+Запуск из корня репозитория:
+    python -m benchmarks.cluster_bench --workers 1 2 4 --users 256 --rounds 5
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from functools import partial
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+
+from benchmarks.corpus import make_character
+from cluster.ingress import WorkerPool
+from cluster.ring import HashRing
+from config import MESSAGES
+from storage.character_storage import create_storage
+
+BATCH = 100
+USER_BASE = 10_000
+
+class OfflineSession(BaseSession):
+    """Сессия без сети: отвечает на sendMessage сразу и сообщает родителю о готовности работника"""
+    
+    def __init__(self, ready):
+        super().__init__()
+        self.ready = ready
+    
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            # Ответ на /help из разминки: работник поднялся и обрабатывает обновления
+            if method.text == MESSAGES["help"]:
+                self.ready.put(method.chat_id)
+            return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=method.chat_id, type="private"))
+        return True
+    
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+    
+    async def close(self):
+        pass
+
+def offline_bot(ready) -> Bot:
+    """Бот работника для бенчмарка"""
+    return Bot(token="123456:offline", session=OfflineSession(ready))
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    """Обновление с текстовым сообщением в личном чате - в том виде, в каком его присылает Telegram"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"},
+            "text": text,
+        },
+    }
+
+def ring_stats(workers: int, users: list) -> tuple:
+    """Баланс кольца и доля пользователей, переезжающих при добавлении работника"""
+    ring = HashRing(range(workers))
+    grown = HashRing(range(workers + 1))
+    counts = [0] * workers
+    moved = 0
+    for user_id in users:
+        node = ring.node_for(user_id)
+        counts[node] += 1
+        moved += node != grown.node_for(user_id)
+    return max(counts) / (len(users) / workers), moved / len(users)
+
+def run(backend: str, workers: int, args) -> dict:
+    rng = random.Random(args.seed)
+    users = [USER_BASE + index for index in range(args.users)]
+    with tempfile.TemporaryDirectory() as workdir:
+        if backend == "sqlite":
+            options = {"backend": "sqlite", "db_path": os.path.join(workdir, "characters.db")}
+        else:
+            options = {"backend": "files", "base_dir": workdir}
+        storage = create_storage(**options, shared=True)
+        gold = {}
+        for user_id in users:
+            character = make_character(f"Игрок {user_id}", rng)
+            storage.save_character(user_id, character)
+            gold[user_id] = (character["id"], character["equipment"]["money"]["gold"])
+        storage.close()
+        
+        context = multiprocessing.get_context("spawn")
+        ready = context.Queue()
+        results = context.Queue()
+        pool = WorkerPool(workers, options, bot_factory=partial(offline_bot, ready), results=results)
+        pool.start()
+        
+        # Разминка: по пользователю на каждого работника, ждем ответы - все работники готовы
+        warmup = {}
+        for user_id in range(1, 10 * workers * workers + 1):
+            warmup.setdefault(pool.ring.node_for(user_id), user_id)
+        pool.route(message_update(0, user_id, "/help") for user_id in warmup.values())
+        for _ in warmup:
+            ready.get()
+        
+        updates = []
+        for _ in range(args.rounds):
+            for text in ("/set_money", None, "Добавить", "0 1 0 0"):
+                for user_id in users:
+                    updates.append(message_update(len(updates) + 1, user_id, text or f"Игрок {user_id}"))
+        
+        started = time.time()
+        for offset in range(0, len(updates), BATCH):
+            pool.route(updates[offset:offset + BATCH])
+        asyncio.run(pool.stop())
+        stats = [results.get() for _ in range(workers)]
+        elapsed = max(item["finished"] for item in stats) - started
+        
+        storage = create_storage(**options, shared=True)
+        wrong = sum(
+            storage.load_character(user_id, character_id)["equipment"]["money"]["gold"] != start + args.rounds
+            for user_id, (character_id, start) in gold.items()
+        )
+        storage.close()
+    
+    balance, moved = ring_stats(workers, users)
+    return {
+        "updates_per_sec": len(updates) / elapsed,
+        "wrong": wrong,
+        "balance": balance,
+        "moved": moved,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="числа процессов-работников")
+    parser.add_argument("--users", type=int, default=256, help="пользователей")
+    parser.add_argument("--rounds", type=int, default=5, help="диалогов /set_money на пользователя")
+    parser.add_argument("--backend", nargs="+", choices=["files", "sqlite"], default=["files"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    print(f"ядер: {os.cpu_count()}, пользователей: {args.users}, обновлений: {args.users * args.rounds * 4}\n")
+    print(f"{'хранилище':<10}{'работников':>11}{'обн/с':>9}{'ускорение':>11}{'ошибок':>8}{'баланс':>8}{'переезд':>9}")
+    for backend in args.backend:
+        baseline = None
+        for workers in args.workers:
+            stats = run(backend, workers, args)
+            baseline = baseline or stats["updates_per_sec"]
+            print(
+                f"{backend:<10}{workers:>11}{stats['updates_per_sec']:>9.0f}{stats['updates_per_sec'] / baseline:>10.2f}x"
+                f"{stats['wrong']:>8}{stats['balance']:>8.2f}{stats['moved']:>8.0%}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Сравнение кодеков сериализации персонажей: размер документа и время кодирования/разбора.
+
+Для сравнения добавлен исходный формат (json.dump с indent=2 без нормализации).
+
+Запуск из корня репозитория:
+    python -m benchmarks.codec_bench --characters 1000
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.corpus import make_character
+from storage import codecs
+
+def legacy_encode(character: dict) -> bytes:
+    """Исходный формат хранения"""
+    return json.dumps(character, ensure_ascii=False, indent=2).encode("utf-8")
+
+def measure(function, values: list) -> float:
+    """Среднее время вызова функции на одном значении, мкс"""
+    started = time.perf_counter()
+    for value in values:
+        function(value)
+    return (time.perf_counter() - started) / len(values) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--characters", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    characters = [make_character(f"Персонаж {index}", rng) for index in range(args.characters)]
+    print(f"JSON-библиотека: {'orjson' if codecs.orjson is not None else 'json (стандартная)'}")
+    print(f"{'кодек':<14}{'байт/док':>10}{'кодирование, мкс':>19}{'разбор, мкс':>14}")
+    
+    variants = {"legacy": legacy_encode}
+    for name, codec in codecs.CODECS.items():
+        variants[name] = lambda character, codec=codec: codecs.encode_document(character, codec)
+    for name, encode in variants.items():
+        encoded = [encode(character) for character in characters]
+        size = sum(len(document) for document in encoded) / len(encoded)
+        encode_us = measure(encode, characters)
+        decode_us = measure(codecs.decode_document, encoded)
+        print(f"{name:<14}{size:>10.0f}{encode_us:>19.1f}{decode_us:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Конкурентные изменения одних и тех же персонажей: потерянные обновления и пропускная способность.
+
+Каждая задача многократно прибавляет золотой к случайному персонажу из небольшого горячего
+набора. Между загрузкой и сохранением задача уступает event loop, как обработчик, который
+ждет ответа Telegram. Режимы:
+    blind  - загрузка и сохранение без координации (как было раньше)
+    lock   - цепочка под асинхронной блокировкой персонажа
+    cas    - без блокировки, save_if_version с повтором при конфликте
+    update - CharacterStorage.update: блокировка и compare-and-swap
+
+Запуск из корня репозитория:
+    python -m benchmarks.contention_bench --tasks 50 --increments 20 --characters 4
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+from benchmarks.corpus import make_character
+from storage.character_storage import CharacterStorage
+
+async def add_gold_blind(storage: CharacterStorage, user_id: int, character_id: str):
+    """Прибавить золотой без координации"""
+    character = await storage.load(user_id, character_id)
+    await asyncio.sleep(0)
+    character["equipment"]["money"]["gold"] += 1
+    await storage.save(user_id, character)
+
+async def add_gold_lock(storage: CharacterStorage, user_id: int, character_id: str):
+    """Прибавить золотой под блокировкой персонажа"""
+    async with storage.lock(user_id, character_id):
+        await add_gold_blind(storage, user_id, character_id)
+
+async def add_gold_cas(storage: CharacterStorage, user_id: int, character_id: str):
+    """Прибавить золотой оптимистично, повторяя при конфликте версий"""
+    while True:
+        character = await storage.load(user_id, character_id)
+        expected_version = character.get("version") or 0
+        await asyncio.sleep(0)
+        character["equipment"]["money"]["gold"] += 1
+        if await storage.save_if_version(user_id, character, expected_version):
+            return
+
+async def add_gold_update(storage: CharacterStorage, user_id: int, character_id: str):
+    """Прибавить золотой через CharacterStorage.update"""
+    def add_gold(character: dict):
+        character["equipment"]["money"]["gold"] += 1
+    await storage.update(user_id, character_id, add_gold)
+
+MODES = {
+    "blind": add_gold_blind,
+    "lock": add_gold_lock,
+    "cas": add_gold_cas,
+    "update": add_gold_update,
+}
+
+async def run_mode(mode: str, args) -> dict:
+    user_id = 1
+    rng = random.Random(args.seed)
+    names = [f"Горячий {index}" for index in range(args.characters)]
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = CharacterStorage(workdir)
+        character_ids = []
+        for name in names:
+            character = make_character(name, rng)
+            character["equipment"]["money"]["gold"] = 0
+            storage.save_character(user_id, character)
+            character_ids.append(character["id"])
+        
+        async def worker(seed: int):
+            worker_rng = random.Random(seed)
+            for _ in range(args.increments):
+                await MODES[mode](storage, user_id, worker_rng.choice(character_ids))
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(args.seed + index) for index in range(args.tasks)))
+        elapsed = time.perf_counter() - started
+        
+        total = sum(storage.load_character(user_id, character_id)["equipment"]["money"]["gold"] for character_id in character_ids)
+        conflicts = storage.version_conflicts
+        storage.close()
+    expected = args.tasks * args.increments
+    return {
+        "ops_per_sec": expected / elapsed,
+        "lost": expected - total,
+        "conflicts": conflicts,
+    }
+
+async def main_async(args):
+    print(f"{'режим':<8}{'оп/с':>10}{'потеряно':>10}{'конфликтов':>12}")
+    for mode in MODES:
+        stats = await run_mode(mode, args)
+        print(f"{mode:<8}{stats['ops_per_sec']:>10.0f}{stats['lost']:>10}{stats['conflicts']:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=50, help="конкурентных задач")
+    parser.add_argument("--increments", type=int, default=20, help="изменений на задачу")
+    parser.add_argument("--characters", type=int, default=4, help="персонажей в горячем наборе")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Генерация синтетических персонажей для бенчмарков хранилища
+"""
+import copy
+import random
+from typing import Optional
+
+from character_stats import CHARACTER_STATS
+from config import RACES, CLASSES
+
+WEAPONS = ["Длинный меч", "Короткий лук", "Кинжал", "Боевой топор", "Посох", "Арбалет", "Рапира", "Булава"]
+ARMOR = ["Кожаный доспех", "Кольчуга", "Щит", "Латы", "Чешуйчатый доспех"]
+ITEMS = ["Веревка (50 футов)", "Факел", "Рацион", "Зелье лечения", "Набор вора", "Спальник", "Фляга", "Трутница"]
+CANTRIPS = ["Огненный снаряд", "Волшебная рука", "Свет", "Малая иллюзия", "Священное пламя", "Фокусы"]
+SPELLS = ["Волшебная стрела", "Щит", "Лечение ран", "Огненный шар", "Полет", "Невидимость", "Молния", "Контрзаклинание"]
+
+DESCRIPTION_WORDS = ["Высокий", "молчаливый", "странник", "с севера,", "ищет", "утраченный", "артефакт", "предков."]
+
+# Размеры наполнения по умолчанию: (минимум, максимум) элементов списка или слов описания
+DEFAULT_SIZES = {
+    "weapons": (0, 4),
+    "armor": (0, 2),
+    "items": (0, len(ITEMS)),
+    "cantrips": (0, 4),
+    "spells": (0, 6),
+    "description": (10, 80),
+}
+
+def pick(rng: random.Random, pool: list, bounds: tuple) -> list:
+    """Случайные различные элементы из набора; сверх его размера - пронумерованные копии"""
+    count = rng.randint(*bounds)
+    if count <= len(pool):
+        return rng.sample(pool, count)
+    return pool + [f"{rng.choice(pool)} #{index}" for index in range(len(pool), count)]
+
+def make_character(name: str, rng: random.Random, sizes: Optional[dict] = None) -> dict:
+    """Создать персонажа со случайным, но правдоподобным наполнением; sizes переопределяет DEFAULT_SIZES"""
+    sizes = {**DEFAULT_SIZES, **(sizes or {})}
+    character = copy.deepcopy(CHARACTER_STATS)
+    character["name"] = name
+    character["race"] = rng.choice(RACES)
+    character["class_name"] = rng.choice(CLASSES)
+    character["level"] = rng.randint(1, 20)
+    
+    for ability in character["abilities"].values():
+        ability["value"] = rng.randint(3, 18)
+        ability["modifier"] = (ability["value"] - 10) // 2
+    
+    hit_points = character["base_stats"]["hit_points"]
+    hit_points["maximum"] = rng.randint(8, 150)
+    hit_points["current"] = rng.randint(0, hit_points["maximum"])
+    
+    equipment = character["equipment"]
+    equipment["weapons"]["items"] = pick(rng, WEAPONS, sizes["weapons"])
+    equipment["armor"]["items"] = pick(rng, ARMOR, sizes["armor"])
+    equipment["items"]["items"] = pick(rng, ITEMS, sizes["items"])
+    for coin in ("copper", "silver", "gold", "platinum"):
+        equipment["money"][coin] = rng.randint(0, 500)
+    
+    magic = character["magic"]
+    magic["spells_known"]["cantrips"] = pick(rng, CANTRIPS, sizes["cantrips"])
+    magic["spells_known"]["spells"] = [
+        f"{spell} ({rng.randint(1, 9)} уровень)" for spell in pick(rng, SPELLS, sizes["spells"])
+    ]
+    for level in magic["spell_slots"]["values"]:
+        magic["spell_slots"]["values"][level] = rng.randint(0, 4)
+    
+    character["description"] = " ".join(
+        rng.choice(DESCRIPTION_WORDS) for _ in range(rng.randint(*sizes["description"]))
+    )
+    character["is_active"] = False
+    return character
+
+def make_corpus(users: int, characters_per_user: int, seed: int = 0, sizes: Optional[dict] = None) -> dict:
+    """Создать корпус {user_id: [персонажи]}"""
+    rng = random.Random(seed)
+    return {
+        user_id: [make_character(f"Герой {user_id}-{index}", rng, sizes) for index in range(characters_per_user)]
+        for user_id in range(1, users + 1)
+    }
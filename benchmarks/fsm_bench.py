@@ -0,0 +1,87 @@
+"""
+Хранилища состояний диалогов: память процесса и скорость при росте числа пользователей.
+
+Каждый пользователь начинает диалог (/set_money: состояние и словарь персонажей в данных)
+и бросает его - так копятся незавершенные диалоги. Для MemoryStorage aiogram и SQLiteFSMStorage
+измеряются прирост памяти процесса (tracemalloc), скорость записи шага диалога и чтения
+состояния (как на каждом обновлении). Для SQLite отдельно - удаление всех просроченных
+записей уборщиком. tracemalloc учитывает объекты Python; кэш страниц SQLite в C ограничен
+отдельно (PRAGMA cache_size, по умолчанию около 2 МБ на соединение).
+
+Запуск из корня репозитория:
+    python -m benchmarks.fsm_bench --users 1000 10000 50000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage.fsm_storage import SQLiteFSMStorage
+
+STATE = "CharacterManagement:waiting_for_money_character"
+
+def dialog_data(rng: random.Random) -> dict:
+    """Данные брошенного диалога: персонажи пользователя для выбора по имени"""
+    return {"character_ids": {f"Герой {index}": f"{rng.getrandbits(128):032x}" for index in range(rng.randint(1, 5))}}
+
+async def run(storage: BaseStorage, users: int, rng: random.Random) -> dict:
+    keys = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(1, users + 1)]
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for key in keys:
+        await storage.set_state(key, STATE)
+        await storage.update_data(key, dialog_data(rng))
+    write_elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    
+    rng.shuffle(keys)
+    started = time.perf_counter()
+    for key in keys:
+        await storage.get_state(key)
+    read_elapsed = time.perf_counter() - started
+    return {
+        "memory_mb": memory / 2 ** 20,
+        "steps_per_sec": users / write_elapsed,
+        "reads_per_sec": users / read_elapsed,
+    }
+
+async def main_async(args):
+    print(f"{'хранилище':<10}{'пользователей':>14}{'память, МБ':>12}{'шагов/с':>10}{'чтений/с':>10}{'уборка, с':>11}")
+    for users in args.users:
+        for name in ("memory", "sqlite"):
+            with tempfile.TemporaryDirectory() as workdir:
+                if name == "memory":
+                    storage = MemoryStorage()
+                else:
+                    storage = SQLiteFSMStorage(os.path.join(workdir, "fsm.db"), ttl=args.ttl, cache_size=args.cache_size)
+                stats = await run(storage, users, random.Random(args.seed))
+                sweep = "-"
+                if name == "sqlite":
+                    # Уборка на момент, когда все записи просрочены: один запрос по индексу
+                    started = time.perf_counter()
+                    await storage._run(storage.sweep, time.time() + args.ttl)
+                    sweep = f"{time.perf_counter() - started:.2f}"
+                await storage.close()
+            print(
+                f"{name:<10}{users:>14}{stats['memory_mb']:>12.1f}{stats['steps_per_sec']:>10.0f}"
+                f"{stats['reads_per_sec']:>10.0f}{sweep:>11}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--cache-size", type=int, default=1024, help="размер кэша SQLiteFSMStorage")
+    parser.add_argument("--ttl", type=float, default=86400.0, help="срок жизни записей SQLiteFSMStorage, секунды")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
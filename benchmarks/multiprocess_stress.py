@@ -0,0 +1,134 @@
+"""
+Несколько процессов над одним хранилищем: корректность и пропускная способность.
+
+Родитель создает набор персонажей у нескольких пользователей и запускает процессы-работники,
+каждый со своим экземпляром хранилища над тем же каталогом (или базой). Работники стартуют
+одновременно и выполняют смесь операций:
+    inc      - patch: +1 золотой случайному персонажу
+    transfer - транзакция: золотой от одного персонажа другому (в том числе между пользователями)
+    read     - загрузка персонажа с проверкой, что документ целый
+После прогона родитель сверяет сумму золота: начальная плюс число успешных inc.
+С --unsafe работники запускаются без общего режима (как до межпроцессных блокировок):
+становятся видны потерянные обновления.
+
+Запуск из корня репозитория:
+    python -m benchmarks.multiprocess_stress --processes 1 2 4 --ops 2000 --backend files sqlite
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.corpus import make_character
+from storage.character_storage import CharacterStorage
+from storage.sqlite_storage import SQLiteCharacterStorage
+
+START_GOLD = 1000
+
+def open_storage(backend: str, path: str, shared: bool) -> CharacterStorage:
+    """Открыть хранилище нужного типа"""
+    if backend == "sqlite":
+        return SQLiteCharacterStorage(path, shared=shared)
+    return CharacterStorage(path, shared=shared)
+
+def worker(backend: str, path: str, shared: bool, refs: list, ops: int, seed: int, barrier, results):
+    """Процесс-работник: смесь изменений и чтений над общим хранилищем"""
+    storage = open_storage(backend, path, shared)
+    rng = random.Random(seed)
+    stats = {"inc": 0, "transfer": 0, "read": 0, "errors": 0}
+    
+    def move_gold(documents):
+        if documents[0]["equipment"]["money"]["gold"] < 1:
+            return False
+        documents[0]["equipment"]["money"]["gold"] -= 1
+        documents[1]["equipment"]["money"]["gold"] += 1
+    
+    barrier.wait()
+    started = time.perf_counter()
+    for _ in range(ops):
+        roll = rng.random()
+        if roll < 0.4:
+            if storage.patch_character(*rng.choice(refs), [("inc", "equipment.money.gold", 1)], "money_add"):
+                stats["inc"] += 1
+            else:
+                stats["errors"] += 1
+        elif roll < 0.6:
+            if storage.transact_characters(rng.sample(refs, 2), move_gold, "money_transfer") is not None:
+                stats["transfer"] += 1
+        else:
+            character = storage.load_character(*rng.choice(refs))
+            if character is None or "equipment" not in character:
+                stats["errors"] += 1
+            stats["read"] += 1
+    stats["elapsed"] = time.perf_counter() - started
+    storage.close()
+    results.put(stats)
+
+def run(backend: str, processes: int, unsafe: bool, args) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "characters.db" if backend == "sqlite" else "characters")
+        storage = open_storage(backend, path, shared=True)
+        refs = []
+        for index in range(args.characters):
+            character = make_character(f"Стресс {index}", rng)
+            character["equipment"]["money"]["gold"] = START_GOLD
+            user_id = 1 + index % args.users
+            storage.save_character(user_id, character)
+            refs.append((user_id, character["id"]))
+        storage.close()
+        
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(processes)
+        results = context.Queue()
+        workers = [
+            context.Process(
+                target=worker,
+                args=(backend, path, not unsafe, refs, args.ops, args.seed + index, barrier, results)
+            )
+            for index in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        stats = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        
+        # Проверка - свежим экземпляром без кэша
+        storage = open_storage(backend, path, shared=True)
+        total = sum(storage.load_character(*ref)["equipment"]["money"]["gold"] for ref in refs)
+        storage.close()
+    
+    increments = sum(item["inc"] for item in stats)
+    return {
+        "ops_per_sec": processes * args.ops / max(item["elapsed"] for item in stats),
+        "lost": START_GOLD * args.characters + increments - total,
+        "errors": sum(item["errors"] for item in stats),
+        "transfers": sum(item["transfer"] for item in stats),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="числа процессов-работников")
+    parser.add_argument("--ops", type=int, default=2000, help="операций на процесс")
+    parser.add_argument("--characters", type=int, default=64, help="персонажей в наборе")
+    parser.add_argument("--users", type=int, default=16, help="пользователей, между которыми распределены персонажи")
+    parser.add_argument("--backend", nargs="+", choices=["files", "sqlite"], default=["files"])
+    parser.add_argument("--unsafe", action="store_true", help="добавить прогоны без общего режима")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    print(f"{'хранилище':<10}{'режим':<9}{'процессов':>10}{'оп/с':>9}{'переводов':>11}{'потеряно':>10}{'ошибок':>8}")
+    for backend in args.backend:
+        for unsafe in ([False, True] if args.unsafe else [False]):
+            for processes in args.processes:
+                stats = run(backend, processes, unsafe, args)
+                print(
+                    f"{backend:<10}{'unsafe' if unsafe else 'shared':<9}{processes:>10}{stats['ops_per_sec']:>9.0f}"
+                    f"{stats['transfers']:>11}{stats['lost']:>10}{stats['errors']:>8}"
+                )
+
+if __name__ == "__main__":
+    main()
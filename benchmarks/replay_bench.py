@@ -0,0 +1,137 @@
+"""
+Стоимость журнала событий: время загрузки персонажа в зависимости от числа событий после снимка.
+
+Для каждой длины журнала персонаж сохраняется целиком (снимок), затем получает заданное
+число точечных изменений (золото, хиты, предметы). Загрузка идет без кэша, поэтому каждый
+раз читается снимок и проигрывается журнал. Отдельно (с кэшем, как в боте) замеряется
+запись одного события и полного снимка.
+
+Перед замерами проверяются обратные операции событий (по ним load_character_at восстанавливает
+прошлое состояние): случайные изменения списков с повторяющимися предметами применяются,
+затем откатываются в обратном порядке - документ должен совпасть с исходным.
+
+Запуск из корня репозитория:
+    python -m benchmarks.replay_bench --events 0 8 32 128 512 --loads 200
+"""
+import argparse
+import copy
+import random
+import tempfile
+import time
+
+from benchmarks.corpus import make_character
+from storage import patch
+from storage.character_storage import CharacterStorage
+
+def fill_journal(storage: CharacterStorage, user_id: int, character_id: str, events: int):
+    """Записать в журнал персонажа заданное число точечных изменений"""
+    for index in range(events):
+        if index % 3 == 0:
+            ops = [("inc", "equipment.money.gold", 1)]
+        elif index % 3 == 1:
+            ops = [("set", "base_stats.hit_points.current", index)]
+        else:
+            ops = [("append", "equipment.items.items", f"Предмет {index}")]
+        storage.patch_character(user_id, character_id, ops)
+
+def random_ops(character: dict, rng: random.Random, count: int) -> list:
+    """Случайные изменения предметов с повторами: одинаковые названия, вставки по краям и за границами"""
+    items = list(character["equipment"]["items"]["items"])
+    names = ["Факел", "Веревка", "Факел"] + items[:2]
+    ops = []
+    for _ in range(count):
+        choice = rng.randrange(4)
+        if choice == 0 or not items:
+            name = rng.choice(names)
+            ops.append(("append", "equipment.items.items", name))
+            items.append(name)
+        elif choice == 1:
+            name = rng.choice(names)
+            index = rng.randint(-len(items) - 2, len(items) + 2)
+            ops.append(("insert", "equipment.items.items", [index, name]))
+            items.insert(index, name)
+        elif choice == 2:
+            name = rng.choice(items)
+            ops.append(("remove", "equipment.items.items", name))
+            items.remove(name)
+        else:
+            ops.append(("pop", "equipment.items.items", rng.randrange(len(items))))
+            items.pop(ops[-1][2])
+    return ops
+
+def check_undo(rounds: int, rng: random.Random) -> int:
+    """Применить случайные события и откатить их; вернуть число расхождений с исходным документом"""
+    mismatches = 0
+    # Повторяющиеся элементы: откат добавления должен убрать именно добавленный
+    document = {"items": ["x", "y"]}
+    undo = patch.apply_ops(document, [("append", "items", "x")])
+    patch.apply_ops(document, undo)
+    mismatches += document != {"items": ["x", "y"]}
+    for _ in range(rounds):
+        character = make_character("Откат", rng)
+        character["equipment"]["items"]["items"] += ["Факел", "Факел"]
+        original = copy.deepcopy(character)
+        undos = [patch.apply_ops(character, random_ops(character, rng, rng.randint(1, 5))) for _ in range(10)]
+        for undo in reversed(undos):
+            patch.apply_ops(character, undo)
+        mismatches += character != original
+    return mismatches
+
+def measure_load(storage: CharacterStorage, events: int, loads: int, rng: random.Random) -> float:
+    """Среднее время загрузки персонажа с журналом заданной длины, мкс"""
+    user_id = 1
+    character = make_character(f"Журнал {events}", rng)
+    storage.save_character(user_id, character)
+    fill_journal(storage, user_id, character["id"], events)
+    
+    started = time.perf_counter()
+    for _ in range(loads):
+        storage.load_character(user_id, character["id"])
+    return (time.perf_counter() - started) / loads * 1e6
+
+def measure_writes(storage: CharacterStorage, writes: int, rng: random.Random) -> dict:
+    """Среднее время записи одного события и полного снимка, мкс"""
+    user_id = 1
+    character = make_character("Запись", rng)
+    storage.save_character(user_id, character)
+    
+    started = time.perf_counter()
+    fill_journal(storage, user_id, character["id"], writes)
+    patch_us = (time.perf_counter() - started) / writes * 1e6
+    
+    character = storage.load_character(user_id, character["id"])
+    started = time.perf_counter()
+    for index in range(writes):
+        character["base_stats"]["hit_points"]["current"] = index
+        storage.save_character(user_id, character)
+    save_us = (time.perf_counter() - started) / writes * 1e6
+    return {"patch_us": patch_us, "save_us": save_us}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[0, 8, 32, 128, 512], help="длины журнала")
+    parser.add_argument("--loads", type=int, default=200, help="загрузок на замер")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    rng = random.Random(args.seed)
+    mismatches = check_undo(args.loads, rng)
+    print(f"откат событий: {args.loads} проверок, расхождений: {mismatches}")
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = CharacterStorage(workdir)
+        stats = measure_writes(storage, args.loads, rng)
+        storage.close()
+    print(f"запись события: {stats['patch_us']:.0f} мкс, полный снимок: {stats['save_us']:.0f} мкс\n")
+    
+    print(f"{'событий':<10}{'загрузка, мкс':>15}")
+    with tempfile.TemporaryDirectory() as workdir:
+        # Без кэша каждая загрузка читает снимок и проигрывает журнал
+        storage = CharacterStorage(workdir, cache_size=0)
+        # Снимок не должен прерывать журнал во время замера
+        storage.SNAPSHOT_EVERY = max(args.events) + 1
+        for events in args.events:
+            print(f"{events:<10}{measure_load(storage, events, args.loads, rng):>15.0f}")
+        storage.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Планировщик обработки обновлений: параллельность между пользователями и порядок внутри пользователя.
+
+Обработка обновления имитирует обработчик команды: прочитать счетчик пользователя, подождать
+--latency мс (запрос к Telegram API или хранилищу), записать счетчик плюс один и номер шага.
+Сравниваются:
+    serial    - обновления по одному, как при обработке без задач
+    tasks     - задача на каждое обновление без упорядочивания
+    scheduler - UpdateScheduler с --workers обработчиками
+После прогона проверяется, что у каждого пользователя счетчик равен числу его обновлений
+(потерянные записи - гонка "прочитать - записать") и шаги обработаны по порядку.
+--hot доля обновлений приходится на одного пользователя: его очередь растет, остальные не должны ждать.
+
+Запуск из корня репозитория:
+    python -m benchmarks.scheduler_bench --updates 5000 --users 200 --workers 1 8 32 128
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Dict, Any, List
+
+from benchmarks.backend_bench import percentile
+from scheduler import UpdateScheduler
+
+USER_BASE = 1_000_000
+
+def make_updates(count: int, users: int, hot: float, rng: random.Random) -> List[Dict[str, Any]]:
+    """Обновления-сообщения; доля hot - от первого пользователя"""
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = USER_BASE if rng.random() < hot else USER_BASE + rng.randrange(users)
+        updates.append({"update_id": update_id, "message": {"from": {"id": user_id}, "text": str(update_id)}})
+    return updates
+
+class Handler:
+    """Имитация обработчика: чтение и запись счетчика пользователя с паузой между ними"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.counters: Dict[int, int] = defaultdict(int)
+        self.last_step: Dict[int, int] = defaultdict(int)
+        self.reordered = 0
+        self.done_at: Dict[int, float] = {}
+    
+    async def __call__(self, update: Dict[str, Any]):
+        user_id = update["message"]["from"]["id"]
+        counter = self.counters[user_id]
+        await asyncio.sleep(self.latency)
+        self.counters[user_id] = counter + 1
+        if update["update_id"] < self.last_step[user_id]:
+            self.reordered += 1
+        self.last_step[user_id] = max(self.last_step[user_id], update["update_id"])
+        self.done_at[update["update_id"]] = time.perf_counter()
+
+async def run(mode: str, workers: int, updates: List[Dict[str, Any]], latency: float) -> Dict[str, Any]:
+    handler = Handler(latency)
+    scheduler_stats = {}
+    started = time.perf_counter()
+    if mode == "serial":
+        for update in updates:
+            await handler(update)
+    elif mode == "tasks":
+        await asyncio.gather(*(asyncio.create_task(handler(update)) for update in updates))
+    else:
+        scheduler = UpdateScheduler(handler, workers, max_pending=len(updates))
+        scheduler.start()
+        for update in updates:
+            await scheduler.submit(update)
+        await scheduler.close()
+        scheduler_stats = scheduler.stats()
+    elapsed = time.perf_counter() - started
+    
+    expected = defaultdict(int)
+    for update in updates:
+        expected[update["message"]["from"]["id"]] += 1
+    lost = sum(count - handler.counters[user_id] for user_id, count in expected.items())
+    # Задержка до завершения для обновлений всех пользователей, кроме горячего
+    others = [handler.done_at[update["update_id"]] - started for update in updates
+              if update["message"]["from"]["id"] != USER_BASE]
+    return {
+        "rate": len(updates) / elapsed,
+        "lost": lost,
+        "reordered": handler.reordered,
+        "others_p99_ms": percentile(others, 0.99) * 1e3 if others else 0.0,
+        "scheduler": scheduler_stats,
+    }
+
+async def main_async(args):
+    updates = make_updates(args.updates, args.users, args.hot, random.Random(args.seed))
+    print(f"обновлений: {len(updates)}, пользователей: {args.users}, пауза обработчика: {args.latency} мс, "
+          f"доля горячего пользователя: {args.hot}\n")
+    print(f"{'режим':<11}{'обработчиков':>13}{'обн/с':>9}{'потеряно':>10}{'не по порядку':>15}"
+          f"{'p99 остальных, мс':>19}{'ожидание p99, мс':>18}{'пик очереди':>13}")
+    runs = [("serial", 1), ("tasks", 0)] + [("scheduler", workers) for workers in args.workers]
+    for mode, workers in runs:
+        if mode == "serial" and len(updates) * args.latency > 60_000:
+            continue
+        stats = await run(mode, workers, updates, args.latency / 1e3)
+        scheduler_stats = stats["scheduler"]
+        wait = f"{scheduler_stats['wait_p99_ms']:.1f}" if scheduler_stats else "-"
+        depth = f"{scheduler_stats['peak_depth']}" if scheduler_stats else "-"
+        print(
+            f"{mode:<11}{workers or '-':>13}{stats['rate']:>9.0f}{stats['lost']:>10}{stats['reordered']:>15}"
+            f"{stats['others_p99_ms']:>19.1f}{wait:>18}{depth:>13}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32, 128], help="обработчиков планировщика")
+    parser.add_argument("--latency", type=float, default=5.0, help="пауза обработчика, мс")
+    parser.add_argument("--hot", type=float, default=0.1, help="доля обновлений одного пользователя")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
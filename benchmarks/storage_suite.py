@@ -0,0 +1,267 @@
+"""
+Набор бенчмарков хранилища персонажей с результатами в JSON для сравнения между коммитами.
+
+Корпус: --users пользователей по --characters персонажей, собранных из CHARACTER_STATS;
+размеры инвентаря, списков заклинаний и описания задаются диапазонами (--items 20 60 и т.п.).
+Для каждого бэкенда измеряются пропускная способность и перцентили задержки операций:
+    create - сохранение новых персонажей в пустое хранилище
+    load   - загрузка персонажа целиком
+    list   - краткие записи персонажей пользователя (для клавиатур)
+    save   - сохранение измененного персонажа
+    delete - удаление персонажа
+Каждая операция, кроме create, выполняется в двух режимах:
+    cold - свежий экземпляр хранилища: кэш документов и индексы процесса пусты
+    warm - экземпляр, в котором все персонажи и списки уже прочитаны, кэш вмещает весь корпус
+Кэш страниц ОС в обоих режимах теплый: сравнивается работа самого процесса.
+
+Каждый бэкенд прогоняется --repeat раз на новом каталоге; в таблицу и JSON попадает медиана
+каждой метрики по прогонам. С --output результаты и сведения о прогоне (коммит, параметры корпуса, платформа)
+записываются в JSON; с --compare текущий прогон сравнивается с ранее сохраненным файлом,
+и при падении оп/с или росте p95 больше --threshold процентов команда завершается с кодом 1
+(p99 и максимум на коротких прогонах слишком шумны для порога и только печатаются).
+
+Запуск из корня репозитория:
+    python -m benchmarks.storage_suite --users 200 --characters 5 --output results/base.json
+    python -m benchmarks.storage_suite --users 200 --characters 5 --compare results/base.json
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Any, List
+
+from benchmarks.backend_bench import percentile
+from benchmarks.corpus import DEFAULT_SIZES, make_corpus
+from storage.character_storage import CharacterStorage
+from storage.sqlite_storage import SQLiteCharacterStorage
+
+OPERATIONS = ("load", "list", "save", "delete")
+TEMPERATURES = ("cold", "warm")
+
+def measure(operation: Callable, arguments: list) -> Dict[str, float]:
+    """Выполнить операцию для каждого набора аргументов: пропускная способность и задержки, мкс"""
+    latencies = []
+    started = time.perf_counter()
+    for args in arguments:
+        call_started = time.perf_counter()
+        operation(*args)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed,
+        "mean_us": statistics.mean(latencies) * 1e6,
+        "p50_us": percentile(latencies, 0.50) * 1e6,
+        "p95_us": percentile(latencies, 0.95) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "max_us": max(latencies) * 1e6,
+    }
+
+def median_results(runs: List[dict]) -> dict:
+    """Медиана каждой метрики по прогонам {операция: {режим: метрики}}"""
+    return {
+        operation: {
+            temperature: {metric: statistics.median(run[operation][temperature][metric] for run in runs) for metric in stats}
+            for temperature, stats in temperatures.items()
+        }
+        for operation, temperatures in runs[0].items()
+    }
+
+def git_revision() -> Dict[str, Any]:
+    """Текущий коммит и наличие незафиксированных изменений (None вне репозитория)"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+class Suite:
+    """Прогон всех операций над одним бэкендом"""
+    
+    def __init__(self, backend: str, workdir: str, corpus: dict, codec: str, seed: int):
+        self.backend = backend
+        self.path = os.path.join(workdir, "characters.db" if backend == "sqlite" else "characters")
+        self.corpus = corpus
+        self.codec = codec
+        self.rng = random.Random(seed)
+        self.total = sum(len(characters) for characters in corpus.values())
+    
+    def open(self) -> CharacterStorage:
+        """Новый экземпляр хранилища с кэшем на весь корпус"""
+        if self.backend == "sqlite":
+            return SQLiteCharacterStorage(self.path, cache_size=self.total, codec=self.codec)
+        return CharacterStorage(self.path, cache_size=self.total, codec=self.codec)
+    
+    def refs(self) -> list:
+        """Пары (user_id, character_id) в случайном порядке"""
+        refs = [(user_id, character["id"]) for user_id, characters in self.corpus.items() for character in characters]
+        self.rng.shuffle(refs)
+        return refs
+    
+    def populate(self, storage: CharacterStorage):
+        """Записать корпус (после удаления - заново, с теми же ID)"""
+        for user_id, characters in self.corpus.items():
+            for character in characters:
+                storage.save_character(user_id, copy.deepcopy(character))
+    
+    def warm_up(self, storage: CharacterStorage):
+        """Прочитать всех персонажей и все списки, чтобы они оказались в кэше"""
+        for user_id, character_id in self.refs():
+            storage.load_character(user_id, character_id)
+        for user_id in self.corpus:
+            storage.get_character_summaries(user_id)
+    
+    def arguments(self, operation: str, storage: CharacterStorage) -> List[tuple]:
+        """Аргументы операции для каждого вызова"""
+        if operation == "list":
+            users = list(self.corpus)
+            self.rng.shuffle(users)
+            return [(user_id,) for user_id in users]
+        if operation == "save":
+            # Измененная копия из хранилища: версия документа актуальна
+            changed = []
+            for user_id, character_id in self.refs():
+                character = storage.load_character(user_id, character_id)
+                character["equipment"]["money"]["gold"] += 1
+                changed.append((user_id, character))
+            return changed
+        return self.refs()
+    
+    def run_operation(self, operation: str, temperature: str) -> Dict[str, float]:
+        storage = self.open()
+        if temperature == "warm":
+            self.warm_up(storage)
+        arguments = self.arguments(operation, storage)
+        if operation == "save" and temperature == "cold":
+            # Подготовка аргументов прочитала документы: для холодного замера - новый экземпляр
+            storage.close()
+            storage = self.open()
+        method = {
+            "load": storage.load_character,
+            "list": storage.get_character_summaries,
+            "save": storage.save_character,
+            "delete": storage.delete_character,
+        }[operation]
+        stats = measure(method, arguments)
+        storage.close()
+        if operation == "delete":
+            storage = self.open()
+            self.populate(storage)
+            storage.close()
+        return stats
+    
+    def run(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        storage = self.open()
+        saves = [(user_id, character) for user_id, characters in self.corpus.items() for character in characters]
+        results = {"create": {"cold": measure(storage.save_character, saves)}}
+        storage.close()
+        for operation in OPERATIONS:
+            results[operation] = {temperature: self.run_operation(operation, temperature) for temperature in TEMPERATURES}
+        return results
+
+def compare(current: dict, baseline: dict, threshold: float) -> int:
+    """Напечатать изменения относительно сохраненного прогона; вернуть число регрессий"""
+    if current["params"] != baseline["params"]:
+        print("Внимание: параметры корпуса отличаются от сохраненного прогона, сравнение приблизительное")
+    print(f"\nсравнение с {baseline['meta'].get('commit') or 'сохраненным прогоном'}, порог {threshold:.0f}%")
+    print(f"{'бэкенд':<8}{'операция':<10}{'режим':<6}{'было оп/с':>11}{'стало оп/с':>12}{'изм.':>8}{'p95 изм.':>10}{'p99 изм.':>10}")
+    regressions = 0
+    for backend, operations in current["results"].items():
+        for operation, temperatures in operations.items():
+            for temperature, stats in temperatures.items():
+                old = baseline["results"].get(backend, {}).get(operation, {}).get(temperature)
+                if old is None:
+                    continue
+                speed = (stats["ops_per_sec"] / old["ops_per_sec"] - 1) * 100
+                p95 = (stats["p95_us"] / old["p95_us"] - 1) * 100
+                p99 = (stats["p99_us"] / old["p99_us"] - 1) * 100
+                regression = speed < -threshold or p95 > threshold
+                regressions += regression
+                print(
+                    f"{backend:<8}{operation:<10}{temperature:<6}{old['ops_per_sec']:>11.0f}{stats['ops_per_sec']:>12.0f}"
+                    f"{speed:>+7.1f}%{p95:>+9.1f}%{p99:>+9.1f}%{'  регрессия' if regression else ''}"
+                )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--characters", type=int, default=5, help="персонажей на пользователя")
+    for field in DEFAULT_SIZES:
+        parser.add_argument(f"--{field}", type=int, nargs=2, metavar=("MIN", "MAX"),
+                            help=f"размер: {field} (по умолчанию {DEFAULT_SIZES[field][0]} {DEFAULT_SIZES[field][1]})")
+    parser.add_argument("--backend", nargs="+", choices=["files", "sqlite"], default=["files", "sqlite"])
+    parser.add_argument("--codec", default="json", help="кодек документов")
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов каждого бэкенда (берется медиана)")
+    parser.add_argument("--output", help="файл JSON для результатов")
+    parser.add_argument("--compare", help="файл JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, проценты")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    sizes = {field: tuple(getattr(args, field) or bounds) for field, bounds in DEFAULT_SIZES.items()}
+    corpus = make_corpus(args.users, args.characters, args.seed, sizes)
+    document_bytes = statistics.mean(
+        len(json.dumps(character, ensure_ascii=False).encode("utf-8"))
+        for characters in corpus.values() for character in characters
+    )
+    report = {
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {
+            "users": args.users,
+            "characters": args.characters,
+            "sizes": {field: list(bounds) for field, bounds in sizes.items()},
+            "codec": args.codec,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "corpus": {"documents": args.users * args.characters, "mean_document_bytes": round(document_bytes)},
+        "results": {},
+    }
+    
+    print(f"документов: {args.users * args.characters}, средний размер: {document_bytes:.0f} байт\n")
+    print(f"{'бэкенд':<8}{'операция':<10}{'режим':<6}{'оп/с':>10}{'p50, мкс':>10}{'p95, мкс':>10}{'p99, мкс':>10}{'макс, мкс':>11}")
+    for backend in args.backend:
+        runs = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as workdir:
+                runs.append(Suite(backend, workdir, corpus, args.codec, args.seed).run())
+        results = median_results(runs)
+        report["results"][backend] = results
+        for operation, temperatures in results.items():
+            for temperature, stats in temperatures.items():
+                print(
+                    f"{backend:<8}{operation:<10}{temperature:<6}{stats['ops_per_sec']:>10.0f}{stats['p50_us']:>10.0f}"
+                    f"{stats['p95_us']:>10.0f}{stats['p99_us']:>10.0f}{stats['max_us']:>11.0f}"
+                )
+    
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Ограничение частоты команд: сколько чтений хранилища отсекает ThrottlingMiddleware и во что обходятся корзины.
+
+Спам: у --users пользователей по персонажу; один из них присылает --spam команд /list_characters
+и /view_character подряд, остальные - по одной /list_characters вперемешку со спамом.
+Обновления идут через планировщик и диспетчер бота (ответы - в сессию без сети) с ограничением
+и без него; считаются чтения списка персонажей из хранилища, время прогона и p99 времени
+до ответа обычным пользователям.
+
+Корзины: --buckets пользователей присылают по команде; прирост памяти процесса (tracemalloc)
+на корзину, скорость проверки лимита и число корзин после простоя (простоявшие удаляются).
+
+Запуск из корня репозитория:
+    python -m benchmarks.throttling_bench --users 200 --spam 2000 --buckets 100000
+"""
+import argparse
+import asyncio
+import queue
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.backend_bench import percentile
+from benchmarks.cluster_bench import USER_BASE, message_update, offline_bot
+from benchmarks.corpus import make_character
+from dispatcher import create_dispatcher
+from middlewares.throttling import ThrottlingMiddleware
+from scheduler import UpdateScheduler, feed_update
+from storage.character_storage import create_storage
+
+async def run_spam(throttle: bool, args) -> dict:
+    rng = random.Random(args.seed)
+    users = [USER_BASE + index for index in range(args.users)]
+    spammer = users[0]
+    updates = [message_update(0, spammer, rng.choice(["/list_characters", "/view_character"])) for _ in range(args.spam)]
+    for user_id in users[1:]:
+        updates.insert(rng.randrange(len(updates) + 1), message_update(0, user_id, "/list_characters"))
+    for update_id, update in enumerate(updates, 1):
+        update["update_id"] = update_id
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = create_storage("files", base_dir=workdir)
+        for user_id in users:
+            storage.save_character(user_id, make_character(f"Игрок {user_id}", rng))
+        reads = 0
+        read_summaries = storage.get_character_summaries
+        
+        def counted(user_id: int) -> list:
+            nonlocal reads
+            reads += 1
+            return read_summaries(user_id)
+        
+        storage.get_character_summaries = counted
+        dp = create_dispatcher(storage, throttle=throttle)
+        bot = offline_bot(queue.SimpleQueue())
+        done = {}
+        
+        async def process(update: dict):
+            await feed_update(dp, bot, update)
+            done[update["update_id"]] = time.perf_counter()
+        
+        scheduler = UpdateScheduler(process, args.workers, max_pending=len(updates))
+        started = time.perf_counter()
+        scheduler.start()
+        for update in updates:
+            await scheduler.submit(update)
+        await scheduler.close()
+        elapsed = time.perf_counter() - started
+        others = [done[update["update_id"]] - started for update in updates if update["message"]["from"]["id"] != spammer]
+        await storage.shutdown()
+    return {"reads": reads, "elapsed": elapsed, "others_p99_ms": percentile(others, 0.99) * 1e3}
+
+def run_buckets(count: int) -> dict:
+    throttling = ThrottlingMiddleware(rate=1, burst=10, command_limits={"list_characters": (0.2, 3)})
+    now = time.monotonic()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for user_id in range(count):
+        throttling.allow(user_id, "list_characters", now)
+    elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    # Через время полного пополнения корзины неотличимы от новых: одна проверка удаляет простоявшие
+    throttling.allow(count, "list_characters", now + throttling._idle)
+    return {"bytes_per_bucket": memory / count, "checks_per_sec": count / elapsed, "after_idle": len(throttling._buckets)}
+
+async def main_async(args):
+    print(f"пользователей: {args.users}, команд спамера: {args.spam}, обработчиков планировщика: {args.workers}\n")
+    print(f"{'ограничение':<13}{'чтений списка':>15}{'прогон, с':>11}{'p99 остальных, мс':>19}")
+    for throttle in (False, True):
+        stats = await run_spam(throttle, args)
+        print(f"{'да' if throttle else 'нет':<13}{stats['reads']:>15}{stats['elapsed']:>11.2f}{stats['others_p99_ms']:>19.1f}")
+    
+    stats = run_buckets(args.buckets)
+    print(f"\nкорзин: {args.buckets}, байт на корзину: {stats['bytes_per_bucket']:.0f}, "
+          f"проверок/с: {stats['checks_per_sec']:.0f}, корзин после простоя: {stats['after_idle']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="пользователей с персонажами")
+    parser.add_argument("--spam", type=int, default=2000, help="команд от спамера")
+    parser.add_argument("--workers", type=int, default=32, help="обработчиков планировщика")
+    parser.add_argument("--buckets", type=int, default=100000, help="пользователей для замера памяти корзин")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Встречные переводы золота между персонажами: пропускная способность и отсутствие взаимоблокировок.
+
+Каждая задача многократно переводит золотой между случайной парой персонажей из небольшого
+набора, принадлежащих нескольким пользователям, так что переводы A -> B и B -> A идут
+одновременно. Режимы:
+    transaction - CharacterStorage.transaction: блокировки по возрастанию полосы, запись все или ничего
+    nested      - вложенные блокировки в порядке "отправитель, затем получатель" и два patch
+
+Режим nested на встречных переводах взаимоблокируется: если за --stall секунд не завершился
+ни один перевод, прогон прерывается, и в таблице видно, сколько переводов успело пройти. Сумма золота в transaction всегда сохраняется.
+
+Запуск из корня репозитория:
+    python -m benchmarks.transfer_bench --tasks 64 --transfers 50 --characters 8 --backend files sqlite
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.corpus import make_character
+from storage.character_storage import CharacterStorage
+from storage.sqlite_storage import SQLiteCharacterStorage
+
+START_GOLD = 1000
+
+async def transfer_transaction(storage: CharacterStorage, source: tuple, target: tuple) -> bool:
+    """Перевести золотой одной транзакцией"""
+    def move_gold(documents):
+        if documents[0]["equipment"]["money"]["gold"] < 1:
+            return False
+        documents[0]["equipment"]["money"]["gold"] -= 1
+        documents[1]["equipment"]["money"]["gold"] += 1
+    return await storage.transaction([source, target], move_gold, "money_transfer") is not None
+
+async def transfer_nested(storage: CharacterStorage, source: tuple, target: tuple) -> bool:
+    """Перевести золотой под вложенными блокировками в порядке отправитель -> получатель"""
+    async with storage.lock(*source):
+        # Пока ждем блокировку получателя, встречный перевод мог взять ее и ждать нашу
+        await asyncio.sleep(0)
+        same_stripe = storage.lock(*source) is storage.lock(*target)
+        async with (asyncio.Lock() if same_stripe else storage.lock(*target)):
+            character = await storage.load_fields(source[0], source[1], ("equipment",))
+            if character["equipment"]["money"]["gold"] < 1:
+                return False
+            await storage.patch(source[0], source[1], [("inc", "equipment.money.gold", -1)], "money_spend")
+            await storage.patch(target[0], target[1], [("inc", "equipment.money.gold", 1)], "money_add")
+            return True
+
+MODES = {
+    "transaction": transfer_transaction,
+    "nested": transfer_nested,
+}
+
+async def run_mode(backend: str, mode: str, args) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        if backend == "sqlite":
+            storage = SQLiteCharacterStorage(os.path.join(workdir, "characters.db"))
+        else:
+            storage = CharacterStorage(workdir)
+        refs = []
+        for index in range(args.characters):
+            # Персонажи распределены по нескольким пользователям: переводы между игроками тоже проверяются
+            user_id = 1 + index % args.users
+            character = make_character(f"Казначей {index}", rng)
+            character["equipment"]["money"]["gold"] = START_GOLD
+            storage.save_character(user_id, character)
+            refs.append((user_id, character["id"]))
+        
+        done = 0
+        finished = 0
+        latencies = []
+        
+        async def worker(seed: int):
+            nonlocal done, finished
+            worker_rng = random.Random(seed)
+            for _ in range(args.transfers):
+                source, target = worker_rng.sample(refs, 2)
+                started = time.perf_counter()
+                if await MODES[mode](storage, source, target):
+                    done += 1
+                finished += 1
+                latencies.append(time.perf_counter() - started)
+        
+        started = time.perf_counter()
+        workers = asyncio.gather(*(worker(args.seed + index) for index in range(args.tasks)))
+        deadlock = False
+        # Сторож: нет прогресса за --stall секунд - задачи ждут друг друга по кругу
+        while not workers.done():
+            progress = finished
+            await asyncio.wait([workers], timeout=args.stall)
+            if not workers.done() and finished == progress:
+                deadlock = True
+                workers.cancel()
+                await asyncio.gather(workers, return_exceptions=True)
+                break
+        elapsed = time.perf_counter() - started
+        
+        total = sum(storage.load_character(*ref)["equipment"]["money"]["gold"] for ref in refs)
+        storage.close()
+    latencies.sort()
+    return {
+        "transfers_per_sec": done / elapsed,
+        "done": done,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        "conserved": total == START_GOLD * args.characters,
+        "deadlock": deadlock,
+    }
+
+async def main_async(args):
+    expected = args.tasks * args.transfers
+    print(f"переводов: {expected}, задач: {args.tasks}, персонажей: {args.characters}, пользователей: {args.users}\n")
+    print(f"{'хранилище':<10}{'режим':<13}{'пер/с':>9}{'выполнено':>11}{'p99, мс':>9}{'сумма':>8}  взаимоблокировка")
+    for backend in args.backend:
+        for mode in args.modes:
+            stats = await run_mode(backend, mode, args)
+            print(
+                f"{backend:<10}{mode:<13}{stats['transfers_per_sec']:>9.0f}{stats['done']:>11}"
+                f"{stats['p99_ms']:>9.1f}{'да' if stats['conserved'] else 'НЕТ':>8}  "
+                f"{'да (прервано сторожем)' if stats['deadlock'] else 'нет'}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=64, help="конкурентных задач")
+    parser.add_argument("--transfers", type=int, default=50, help="переводов на задачу")
+    parser.add_argument("--characters", type=int, default=8, help="персонажей в наборе")
+    parser.add_argument("--users", type=int, default=3, help="пользователей, между которыми распределены персонажи")
+    parser.add_argument("--backend", nargs="+", choices=["files", "sqlite"], default=["files", "sqlite"])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--stall", type=float, default=2.0, help="секунд без прогресса, после которых прогон считается зависшим")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Прием обновлений в режиме webhook: сколько обновлений в секунду принимает сервер из webhook.py.
+
+Сервер поднимается в этом же процессе на свободном порту, --concurrency клиентов aiohttp
+присылают обновления POST-запросами с секретом в заголовке, как Telegram (он держит до 40
+соединений). Режимы:
+    intake   - принятое обновление только считается: HTTP, проверка секрета и разбор JSON
+    dispatch - обновление уходит в планировщик и диспетчер бота (ответы - в сессию без сети); кроме приема
+               замеряется время до окончания обработки всех принятых обновлений
+Обновления - синтетические диалоги /set_money по --users пользователям (как в cluster_bench)
+или записанные (--replay): JSON-массив, ответ getUpdates или по обновлению на строке.
+Клиенты и сервер делят процессор, поэтому числа - нижняя оценка для отдельной машины.
+Перед замером проверяется, что запрос с неверным секретом получает 401.
+
+С --url записанные обновления отправляются на уже запущенного бота в режиме webhook:
+так локально проверяется прием без Telegram.
+
+Запуск из корня репозитория:
+    python -m benchmarks.webhook_bench --updates 5000 --concurrency 1 8 40
+    python -m benchmarks.webhook_bench --url http://localhost:8080/webhook --secret "$WEBHOOK_SECRET" --replay updates.json
+"""
+import argparse
+import asyncio
+import json
+import queue
+import random
+import socket
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, Any, List
+
+import aiohttp
+
+from benchmarks.backend_bench import percentile
+from benchmarks.cluster_bench import USER_BASE, message_update, offline_bot
+from benchmarks.corpus import make_character
+from dispatcher import create_dispatcher
+from storage.character_storage import create_storage
+from scheduler import UpdateScheduler, feed_update
+from webhook import SECRET_HEADER, WebhookReceiver, serve
+
+SECRET = "benchmark-secret"
+PATH = "/webhook"
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """Записанные обновления: JSON-массив, ответ getUpdates, одно обновление или по обновлению на строке"""
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(payload, dict):
+        return payload["result"] if "result" in payload else [payload]
+    return payload
+
+def dialog_updates(users: int, count: int) -> List[Dict[str, Any]]:
+    """Диалоги /set_money -> персонаж -> "Добавить" -> "0 1 0 0" по кругу пользователей"""
+    updates = []
+    while len(updates) < count:
+        for text in ("/set_money", None, "Добавить", "0 1 0 0"):
+            for user_id in range(USER_BASE, USER_BASE + users):
+                updates.append(message_update(len(updates) + 1, user_id, text or f"Игрок {user_id}"))
+    return updates[:count]
+
+def free_port() -> int:
+    """Свободный порт на локальном интерфейсе"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_listening(port: int):
+    """Дождаться, пока сервер начнет принимать соединения"""
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.01)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+
+async def post_all(url: str, secret: str, updates: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """Отправить обновления concurrency клиентами; статусы ответов и задержки запросов"""
+    bodies = iter([json.dumps(update, ensure_ascii=False).encode("utf-8") for update in updates])
+    headers = {SECRET_HEADER: secret, "Content-Type": "application/json"}
+    statuses = Counter()
+    latencies = []
+    
+    async def client(session: aiohttp.ClientSession):
+        for body in bodies:
+            started = time.perf_counter()
+            async with session.post(url, data=body, headers=headers) as response:
+                await response.read()
+                statuses[response.status] += 1
+            latencies.append(time.perf_counter() - started)
+    
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {
+        "elapsed": elapsed,
+        "statuses": dict(statuses),
+        "p50_ms": percentile(latencies, 0.50) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+    }
+
+async def check_secret(url: str) -> int:
+    """Статус ответа на обновление с неверным секретом (ожидается 401)"""
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=message_update(0, USER_BASE, "/help"), headers={SECRET_HEADER: "wrong"}) as response:
+            return response.status
+
+async def run_local(mode: str, updates: List[Dict[str, Any]], concurrency: int, args) -> Dict[str, Any]:
+    """Замер на сервере в этом процессе"""
+    scheduler = None
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = None
+        if mode == "dispatch":
+            storage = create_storage("files", base_dir=workdir)
+            rng = random.Random(args.seed)
+            for user_id in range(USER_BASE, USER_BASE + args.users):
+                storage.save_character(user_id, make_character(f"Игрок {user_id}", rng))
+            dp = create_dispatcher(storage)
+            bot = offline_bot(queue.SimpleQueue())
+            scheduler = UpdateScheduler(lambda update: feed_update(dp, bot, update), args.workers)
+            scheduler.start()
+            consume = scheduler.submit
+        else:
+            async def consume(update: Dict[str, Any]):
+                pass
+        
+        receiver = WebhookReceiver(consume, SECRET, PATH)
+        port = free_port()
+        server = asyncio.create_task(serve(receiver, "127.0.0.1", port))
+        await wait_listening(port)
+        url = f"http://127.0.0.1:{port}{PATH}"
+        rejected = await check_secret(url)
+        
+        started = time.perf_counter()
+        stats = await post_all(url, SECRET, updates, concurrency)
+        if scheduler is not None:
+            await scheduler.close()
+        stats["processed_elapsed"] = time.perf_counter() - started
+        stats["rejected_status"] = rejected
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        if storage is not None:
+            await storage.shutdown()
+    return stats
+
+async def main_async(args):
+    if args.url:
+        if not args.replay:
+            raise SystemExit("С --url нужен --replay: файл с записанными обновлениями")
+        updates = load_updates(args.replay)
+        stats = await post_all(args.url, args.secret, updates, args.concurrency[0])
+        print(f"отправлено обновлений: {len(updates)} за {stats['elapsed']:.2f} с, ответы: {stats['statuses']}")
+        return
+    
+    updates = load_updates(args.replay) if args.replay else dialog_updates(args.users, args.updates)
+    print(f"обновлений: {len(updates)}\n")
+    print(f"{'режим':<10}{'клиентов':>9}{'прием, обн/с':>14}{'обработка, обн/с':>18}{'p50, мс':>9}{'p99, мс':>9}{'ответы':>14}")
+    for mode in args.mode:
+        for concurrency in args.concurrency:
+            stats = await run_local(mode, updates, concurrency, args)
+            if stats["rejected_status"] != 401:
+                print(f"Внимание: неверный секрет получил ответ {stats['rejected_status']}")
+            processed = f"{len(updates) / stats['processed_elapsed']:.0f}" if mode == "dispatch" else "-"
+            statuses = " ".join(f"{status}:{count}" for status, count in sorted(stats["statuses"].items()))
+            print(
+                f"{mode:<10}{concurrency:>9}{len(updates) / stats['elapsed']:>14.0f}{processed:>18}"
+                f"{stats['p50_ms']:>9.2f}{stats['p99_ms']:>9.2f}{statuses:>14}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000, help="синтетических обновлений")
+    parser.add_argument("--users", type=int, default=100, help="пользователей в синтетических диалогах")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 40], help="одновременных клиентов")
+    parser.add_argument("--mode", nargs="+", choices=["intake", "dispatch"], default=["intake", "dispatch"])
+    parser.add_argument("--workers", type=int, default=32, help="обработчиков планировщика в режиме dispatch")
+    parser.add_argument("--replay", help="файл с записанными обновлениями")
+    parser.add_argument("--url", help="адрес webhook запущенного бота (вместо своего сервера)")
+    parser.add_argument("--secret", default="", help="секрет webhook для --url")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Ингресс: принимает обновления Telegram и раскладывает их по процессам-работникам.
+
+Ингресс не разбирает обновления в модели aiogram: getUpdates читается как обычный JSON,
+из словаря достается ID пользователя (from.id события), кольцо консистентного хеширования
+выбирает работника, и обновления уходят ему пачкой через очередь multiprocessing.
+Так ингресс остается легким, а обработка команд масштабируется числом работников.
+В режиме webhook обновления вместо getUpdates принимает сервер из webhook.py.
+
+Очереди работников ограничены (CLUSTER_QUEUE_SIZE пачек): при заполненной очереди раскладка ждет,
+а с ней и подтверждение приема - следующий getUpdates или ответ на запрос webhook. Так же, как
+планировщик в одном процессе, ингресс не принимает больше, чем работники успевают обработать.
+
+Доставка - не более одного раза. Пачки, еще лежащие в очереди упавшего работника, получит
+перезапущенный работник; пачка, которую он уже забрал, теряется вместе с ним. Повторная
+раздача не годится: часть обновлений пачки уже могла быть обработана, и повтор провел бы,
+например, изменение денег персонажа дважды.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from collections import defaultdict
+from contextlib import suppress
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+
+from cluster.ring import HashRing
+from cluster.worker import run_worker
+from config import CLUSTER_QUEUE_SIZE
+from polling import poll_updates
+from scheduler import update_user_id
+from webhook import WebhookReceiver, register_webhook, serve
+
+class WorkerPool:
+    """Процессы-работники и маршрутизация обновлений между ними"""
+    
+    def __init__(self, workers: int, storage_options: Dict[str, Any],
+                 bot_factory: Optional[Callable[[], Bot]] = None, results=None,
+                 queue_size: int = CLUSTER_QUEUE_SIZE):
+        self._context = multiprocessing.get_context("spawn")
+        self.ring = HashRing(range(workers))
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._args = (storage_options, bot_factory, results)
+        self.processes: List[multiprocessing.Process] = [None] * workers
+        self.routed = [0] * workers
+        # Раскладка может идти из нескольких потоков (запросы webhook): работник перезапускается один раз
+        self._spawn_lock = threading.Lock()
+    
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=run_worker, args=(index, self.queues[index], *self._args), name=f"bot-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+    
+    def start(self):
+        """Запустить всех работников"""
+        for index in range(len(self.queues)):
+            self._spawn(index)
+    
+    def ensure_alive(self):
+        """Перезапустить упавших работников: очередь сохраняется, пачки, еще лежащие в ней, не теряются
+        (пачка, которую работник успел забрать, теряется вместе с ним)"""
+        with self._spawn_lock:
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logging.error("Работник %s завершился с кодом %s, перезапуск", index, process.exitcode)
+                    self._spawn(index)
+    
+    def _put(self, node: int, item: Any):
+        """Положить пачку в очередь работника, дождавшись места; пока ждем, упавший работник перезапускается"""
+        while True:
+            try:
+                self.queues[node].put(item, timeout=1.0)
+                return
+            except queue.Full:
+                self.ensure_alive()
+    
+    def route(self, updates: Iterable[Dict[str, Any]]):
+        """Разложить обновления по работникам; каждому - одной пачкой с сохранением порядка.
+        Блокирует, пока в очередях нет места"""
+        batches: Dict[int, List[Tuple[Optional[int], Dict[str, Any]]]] = defaultdict(list)
+        for update in updates:
+            user_id = update_user_id(update)
+            node = self.ring.node_for(user_id if user_id is not None else update["update_id"])
+            batches[node].append((user_id, update))
+        for node, batch in batches.items():
+            self._put(node, batch)
+            self.routed[node] += len(batch)
+    
+    async def stop(self, timeout: float = 30.0):
+        """Попросить работников завершиться и дождаться их; зависших - остановить"""
+        loop = asyncio.get_running_loop()
+        for index in range(len(self.queues)):
+            await loop.run_in_executor(None, self._put, index, None)
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.error("Работник %s не завершился за %s с, остановка", index, timeout)
+                process.terminate()
+        logging.info("Обновлений по работникам: %s", self.routed)
+
+async def run_cluster(bot: Bot, workers: int, storage_options: Dict[str, Any],
+                      webhook: Optional[Dict[str, Any]] = None):
+    """Запустить работников и принимать обновления до SIGINT/SIGTERM: длинным опросом или,
+    если заданы параметры webhook (host, port, path, secret, url), встроенным сервером"""
+    pool = WorkerPool(workers, storage_options)
+    loop = asyncio.get_running_loop()
+    
+    async def consume(updates: List[Dict[str, Any]]):
+        # Раскладка ждет места в очередях вне event loop; прием подтверждается после нее
+        await loop.run_in_executor(None, pool.route, updates)
+        pool.ensure_alive()
+    
+    if webhook is None:
+        receiving = poll_updates(bot, consume)
+    else:
+        async def consume_one(update: Dict[str, Any]):
+            await consume([update])
+        
+        receiver = WebhookReceiver(consume_one, webhook["secret"], webhook["path"])
+        await register_webhook(bot, webhook.get("url"), webhook["path"], webhook["secret"])
+        receiving = serve(receiver, webhook["host"], webhook["port"])
+    pool.start()
+    task = asyncio.create_task(receiving)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+    logging.info("Ингресс запущен, работников: %s", workers)
+    try:
+        with suppress(asyncio.CancelledError):
+            await task
+    finally:
+        await pool.stop()
+        await bot.session.close()
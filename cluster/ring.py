@@ -0,0 +1,32 @@
+"""
+Кольцо консистентного хеширования пользователей по процессам-работникам.
+
+Каждый работник занимает на кольце REPLICAS виртуальных точек; пользователь обслуживается
+работником, чья точка первая по часовой стрелке от хеша его ID. При добавлении работника
+к новому переходит примерно 1/N пользователей, остальные остаются там же, где были
+(и где лежат их кэш персонажей и состояние FSM).
+"""
+import bisect
+import hashlib
+from typing import Iterable, List
+
+REPLICAS = 160
+
+def ring_hash(key: str) -> int:
+    """Позиция ключа на кольце: 64 бита blake2b, равномерно при любых ID"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Неизменяемое кольцо: номер работника для пользователя"""
+    
+    def __init__(self, nodes: Iterable[int], replicas: int = REPLICAS):
+        points = sorted((ring_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        if not points:
+            raise ValueError("Кольцо без работников")
+        self._points: List[int] = [point for point, _ in points]
+        self._nodes: List[int] = [node for _, node in points]
+    
+    def node_for(self, key: int) -> int:
+        """Работник, обслуживающий ключ (ID пользователя)"""
+        index = bisect.bisect(self._points, ring_hash(str(key)))
+        return self._nodes[index % len(self._nodes)]
@@ -0,0 +1,79 @@
+"""
+Процесс-работник: свой диспетчер, кэш состояний диалогов и кэш персонажей для пользователей своего сегмента кольца.
+
+Обновления приходят от ингресса пачками [(user_id, update), ...] через очередь процесса;
+None в очереди - сигнал завершения: работник дообрабатывает принятое и выходит.
+Обработку ведет планировщик (scheduler.py): обновления одного пользователя - строго по очереди
+(шаги диалога не обгоняют друг друга), разных пользователей - параллельно. Хранилище открывается в общем режиме:
+перевод чужому персонажу меняет данные пользователя, которого обслуживает другой работник.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from multiprocessing.queues import Queue
+from typing import Callable, Dict, Any, Optional
+
+from aiogram import Bot
+
+from config import BOT_TOKEN, FSM_STORAGE, STORAGE_COMPACTION_INTERVAL, SCHEDULER_STATS_INTERVAL
+from dispatcher import create_dispatcher
+from scheduler import UpdateScheduler, feed_update
+from storage.character_storage import create_storage
+from storage.fsm_storage import create_fsm_storage
+
+def next_batch(updates: Queue) -> Optional[list]:
+    """Следующая пачка обновлений; None - сигнал завершения или ингресс перестал существовать"""
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return updates.get(timeout=1.0)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return None
+
+async def serve(index: int, updates: Queue, storage_options: Dict[str, Any],
+                bot_factory: Optional[Callable[[], Bot]] = None) -> Dict[str, Any]:
+    """Принимать обновления из очереди до сигнала завершения; вернуть статистику работника"""
+    bot = bot_factory() if bot_factory else Bot(token=BOT_TOKEN)
+    character_storage = create_storage(**storage_options, shared=True)
+    character_storage.start_compaction(STORAGE_COMPACTION_INTERVAL)
+    dp = create_dispatcher(character_storage, create_fsm_storage(FSM_STORAGE))
+    scheduler = UpdateScheduler(lambda update: feed_update(dp, bot, update))
+    scheduler.start(SCHEDULER_STATS_INTERVAL)
+    loop = asyncio.get_running_loop()
+    processed = 0
+    started = None
+    try:
+        while True:
+            batch = await loop.run_in_executor(None, next_batch, updates)
+            if batch is None:
+                break
+            if started is None:
+                started = time.time()
+            for _, data in batch:
+                await scheduler.submit(data)
+                processed += 1
+        await scheduler.close()
+        finished = time.time()
+    finally:
+        await dp.storage.close()
+        await character_storage.shutdown()
+        await bot.session.close()
+        logging.info("Работник %s: обработано обновлений %s, кэш: %s, планировщик: %s",
+                     index, processed, character_storage.cache_stats(), scheduler.stats())
+    return {"worker": index, "processed": processed, "started": started, "finished": finished}
+
+def run_worker(index: int, updates: Queue, storage_options: Dict[str, Any],
+               bot_factory: Optional[Callable[[], Bot]] = None, results: Optional[Queue] = None):
+    """Точка входа процесса-работника"""
+    # Ctrl+C и SIGTERM от менеджера служб получает вся группа процессов: работник завершается
+    # по сигналу ингресса, дообработав очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    stats = asyncio.run(serve(index, updates, storage_options, bot_factory))
+    if results is not None:
+        results.put(stats)
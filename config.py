@@ -8,6 +8,71 @@ load_dotenv()
 # Настройки бота
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Хранилище персонажей: files (JSON-файлы) или sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "files")
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "characters.db")
+# Формат новых записей: json, json-zlib или json-pretty (для отладки)
+STORAGE_CODEC = os.getenv("STORAGE_CODEC", "json")
+
+# Отложенная запись персонажей: изменения копятся в памяти и сбрасываются фоном
+STORAGE_WRITE_BEHIND = os.getenv("STORAGE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "5"))
+STORAGE_MAX_DIRTY = int(os.getenv("STORAGE_MAX_DIRTY", "100"))
+
+# Общий режим: несколько процессов бота работают с одним хранилищем (межпроцессные блокировки
+# и сверка кэшей); отложенная запись в нем отключается
+STORAGE_SHARED = os.getenv("STORAGE_SHARED", "false").lower() in ("1", "true", "yes")
+
+# Хранилище состояний диалогов (FSM): memory (теряется при перезапуске) или sqlite
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.db")
+# Срок жизни незавершенного диалога с последнего шага, секунды
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))
+# Период удаления просроченных диалогов из базы, секунды
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", "600"))
+# Сколько записей FSM держать в памяти
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1024"))
+# Сколько снимков персонажей незавершенных диалогов держать в памяти (по одному на пользователя)
+FLOW_SESSION_SIZE = int(os.getenv("FLOW_SESSION_SIZE", "1024"))
+
+# Число процессов-работников. Больше 1 - режим шардирования: ингресс принимает обновления и
+# распределяет пользователей по работникам кольцом консистентного хеширования (хранилище - в общем режиме)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Пачек обновлений в очереди работника; при заполненной очереди ингресс ждет и не подтверждает прием
+CLUSTER_QUEUE_SIZE = int(os.getenv("CLUSTER_QUEUE_SIZE", "16"))
+
+# Прием обновлений: polling (длинный опрос getUpdates) или webhook (встроенный сервер aiohttp)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный адрес сервера для setWebhook (без пути); пусто - webhook регистрируется вручную
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token (обязателен в режиме webhook)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Планировщик обработки обновлений: обработчиков (одновременно обрабатываемых пользователей) в процессе
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "32"))
+# Принятых, но не обработанных обновлений в процессе; при переполнении прием ждет обработки
+SCHEDULER_MAX_PENDING = int(os.getenv("SCHEDULER_MAX_PENDING", "1000"))
+# Период вывода метрик планировщика в лог, секунды (0 - только при остановке)
+SCHEDULER_STATS_INTERVAL = float(os.getenv("SCHEDULER_STATS_INTERVAL", "0"))
+
+# Ограничение частоты команд пользователя (корзины токенов): пополнение, команд в секунду, и запас
+# на всплеск; 0 в пополнении - без ограничения
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "10"))
+# Свои лимиты команд: "команда=в_секунду/запас" через запятую
+THROTTLE_COMMAND_LIMITS = os.getenv("THROTTLE_COMMAND_LIMITS", "list_characters=0.2/3,view_character=0.2/3")
+# Общий лимит сообщений всех пользователей процесса (0 - без общего лимита)
+THROTTLE_GLOBAL_RATE = float(os.getenv("THROTTLE_GLOBAL_RATE", "0"))
+THROTTLE_GLOBAL_BURST = float(os.getenv("THROTTLE_GLOBAL_BURST", "400"))
+# Сколько корзин пользователей держать в памяти
+THROTTLE_MAX_BUCKETS = int(os.getenv("THROTTLE_MAX_BUCKETS", "100000"))
+
+# Период фонового сворачивания журналов событий персонажей в снимки, секунды
+STORAGE_COMPACTION_INTERVAL = float(os.getenv("STORAGE_COMPACTION_INTERVAL", "300"))
+
 # Состояния FSM для создания персонажа
 class CharacterCreation(StatesGroup):
     waiting_for_name = State()
@@ -69,6 +134,11 @@ class CharacterManagement(StatesGroup):
     waiting_for_view_equipment_character = State()
     # Состояния для управления активным персонажем
     waiting_for_active_character = State()
+    # Состояния для передачи денег и предметов между персонажами
+    waiting_for_transfer_source = State()
+    waiting_for_transfer_target = State()
+    waiting_for_transfer_amount = State()
+    waiting_for_transfer_item = State()
 
 # Доступные расы и классы
 RACES = [
@@ -99,6 +169,9 @@ MESSAGES = {
 /view_equipment - Просмотреть снаряжение персонажа
 /set_money - Управление деньгами персонажа
 /inventory - Управление инвентарем персонажа
+/transfer_money - Передать деньги другому персонажу
+/transfer_item - Передать предмет другому персонажу
+(ответьте командой на сообщение участника группы, чтобы передать его персонажу)
 
 Управление навыками и спасбросками:
 /set_proficiencies - Установить владение навыками
@@ -167,5 +240,8 @@ MESSAGES = {
     "common": {
         "invalid_input": "Пожалуйста, используйте кнопки для выбора.",
         "error": "Произошла ошибка. Пожалуйста, попробуйте позже."
+    },
+    "throttling": {
+        "slow_down": "Слишком много сообщений. Подождите немного и повторите."
     }
 } 
\ No newline at end of file
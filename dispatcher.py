@@ -0,0 +1,53 @@
+"""
+Сборка диспетчера бота: обработчики всех команд, хранилище состояний диалогов и хранилище персонажей
+"""
+from typing import Optional
+
+from aiogram import Dispatcher
+from aiogram.filters import Command
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message
+
+from config import MESSAGES
+from handlers.character_creation import register_character_creation_handlers
+from handlers.character_management import register_character_management_handlers
+from handlers.spell_management import register_spell_management_handlers
+from handlers.money_management import register_money_management_handlers
+from handlers.inventory_management import register_inventory_management_handlers
+from handlers.description_management import register_description_management_handlers
+from handlers.active_character import register_active_character_handlers
+from handlers.transfer_management import register_transfer_management_handlers
+from middlewares.throttling import ThrottlingMiddleware
+from storage.character_storage import CharacterStorage
+
+# Обработчик команды /start
+async def cmd_start(message: Message):
+    await message.answer(MESSAGES["start"])
+
+# Обработчик команды /help
+async def cmd_help(message: Message):
+    await message.answer(MESSAGES["help"])
+
+def create_dispatcher(character_storage: CharacterStorage, fsm_storage: Optional[BaseStorage] = None,
+                      throttle: bool = True) -> Dispatcher:
+    """Создать диспетчер со всеми обработчиками; без fsm_storage состояния диалогов хранятся в памяти,
+    throttle=False отключает ограничение частоты команд"""
+    # Хранилище персонажей передается в обработчики через данные диспетчера как аргумент character_storage
+    dp = Dispatcher(storage=fsm_storage or MemoryStorage(), character_storage=character_storage)
+    # Лишние сообщения отсекаются до обработчиков и обращений к хранилищу
+    if throttle:
+        dp.message.outer_middleware(ThrottlingMiddleware())
+    
+    register_character_creation_handlers(dp)
+    register_character_management_handlers(dp)
+    register_spell_management_handlers(dp)
+    register_money_management_handlers(dp)
+    register_inventory_management_handlers(dp)
+    register_description_management_handlers(dp)
+    register_active_character_handlers(dp)
+    register_transfer_management_handlers(dp)
+    
+    dp.message.register(cmd_start, Command("start"))
+    dp.message.register(cmd_help, Command("help"))
+    return dp
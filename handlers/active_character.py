@@ -1,17 +1,15 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
 from config import MESSAGES, CharacterManagement
+from handlers.common import remember_character_ids, selected_character_id
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 # Обработчик команды /set_active
-async def cmd_set_active(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_active(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -28,12 +26,14 @@ async def cmd_set_active(message: types.Message, state: FSMContext):
         "Выберите персонажа, которого хотите сделать активным:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_active_character)
 
 # Обработчик выбора активного персонажа
-async def process_active_character(message: types.Message, state: FSMContext):
+async def process_active_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.load_fields(message.from_user.id, character_id, ("name",)) if character_id else None
     
     if not character:
         await message.answer(
@@ -43,20 +43,8 @@ async def process_active_character(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сбрасываем флаг активного персонажа у всех персонажей пользователя
-    characters = character_storage.get_user_characters(message.from_user.id)
-    for char in characters:
-        if char["name"] != character_name:
-            char_obj = character_storage.load_character(message.from_user.id, char["name"])
-            if char_obj:
-                char_obj["is_active"] = False
-                character_storage.save_character(message.from_user.id, char_obj)
-    
-    # Устанавливаем флаг активного персонажа
-    character["is_active"] = True
-    
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    # Активный персонаж - указатель в метаданных пользователя, файлы персонажей не переписываются
+    if await character_storage.set_active(message.from_user.id, character_id):
         await message.answer(
             f"Персонаж {character_name} теперь активный!",
             reply_markup=ReplyKeyboardRemove()
@@ -70,25 +58,22 @@ async def process_active_character(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /get_active
-async def cmd_get_active(message: types.Message):
-    characters = character_storage.get_user_characters(message.from_user.id)
-    
-    if not characters:
-        await message.answer(MESSAGES["character_management"]["no_characters"])
-        return
-    
-    # Ищем активного персонажа
+async def cmd_get_active(message: types.Message, character_storage: CharacterStorage):
+    # Ищем активного персонажа по указателю пользователя
+    active_id = await character_storage.get_active(message.from_user.id)
     active_character = None
-    for char in characters:
-        if char.get("is_active", False):
-            active_character = char
-            break
+    if active_id:
+        active_character = await character_storage.load_fields(
+            message.from_user.id, active_id, ("name", "race", "class_name", "level")
+        )
     
     if active_character:
         await message.answer(
             f"Ваш активный персонаж: {active_character['name']} - "
             f"{active_character['race']} {active_character['class_name']} {active_character['level']} уровня"
         )
+    elif not await character_storage.summaries(message.from_user.id):
+        await message.answer(MESSAGES["character_management"]["no_characters"])
     else:
         await message.answer(
             "У вас нет активного персонажа. Используйте /set_active чтобы выбрать активного персонажа."
@@ -98,4 +83,4 @@ def register_active_character_handlers(dp):
     """Регистрация всех обработчиков управления активным персонажем"""
     dp.message.register(cmd_set_active, Command("set_active"))
     dp.message.register(cmd_get_active, Command("get_active"))
-    dp.message.register(process_active_character, CharacterManagement.waiting_for_active_character) 
\ No newline at end of file
+    dp.message.register(process_active_character, StateFilter(CharacterManagement.waiting_for_active_character)) 
\ No newline at end of file
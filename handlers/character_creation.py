@@ -1,5 +1,5 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
@@ -9,9 +9,6 @@ from config import (
 )
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 def calculate_modifier(ability_score: int) -> int:
     """Рассчитать модификатор характеристики"""
     return (ability_score - 10) // 2
@@ -64,15 +61,14 @@ async def cmd_create_character(message: types.Message, state: FSMContext):
     await state.set_state(CharacterCreation.waiting_for_name)
 
 # Обработчик ввода имени
-async def process_name(message: types.Message, state: FSMContext):
+async def process_name(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     name = message.text.strip()
     if not 2 <= len(name) <= 30:
         await message.answer(MESSAGES["character_creation"]["name_invalid"])
         return
     
     # Проверяем, не существует ли уже персонаж с таким именем
-    existing_character = character_storage.load_character(message.from_user.id, name)
-    if existing_character:
+    if await character_storage.find(message.from_user.id, name):
         await message.answer("У вас уже есть персонаж с таким именем. Пожалуйста, выберите другое имя.")
         return
     
@@ -145,7 +141,7 @@ async def process_level(message: types.Message, state: FSMContext):
     await state.set_state(CharacterCreation.waiting_for_abilities)
 
 # Обработчик ввода характеристик
-async def process_abilities(message: types.Message, state: FSMContext):
+async def process_abilities(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         abilities = [int(x) for x in message.text.strip().split()]
         if len(abilities) != 6 or not all(3 <= x <= 18 for x in abilities):
@@ -352,8 +348,14 @@ async def process_abilities(message: types.Message, state: FSMContext):
     for ability in character['abilities']:
         character['advanced_stats']['saving_throws']['values'][ability] = calculate_saving_throw_value(character, ability)
     
-    # Сохраняем персонажа
-    if character_storage.save_character(message.from_user.id, character):
+    # Имя могло быть занято, пока заполнялись характеристики: персонажи с одним именем не создаются
+    if await character_storage.find(message.from_user.id, character["name"]):
+        await message.answer("У вас уже есть персонаж с таким именем. Пожалуйста, выберите другое имя.")
+        await state.clear()
+        return
+    
+    # Сохраняем персонажа: ID выдает хранилище
+    if await character_storage.save(message.from_user.id, character):
         await message.answer(MESSAGES["character_creation"]["success"])
     else:
         await message.answer("Произошла ошибка при сохранении персонажа. Пожалуйста, попробуйте позже.")
@@ -363,8 +365,8 @@ async def process_abilities(message: types.Message, state: FSMContext):
 def register_character_creation_handlers(dp):
     """Регистрация всех обработчиков создания персонажа"""
     dp.message.register(cmd_create_character, Command("create_character"))
-    dp.message.register(process_name, CharacterCreation.waiting_for_name)
-    dp.message.register(process_race, CharacterCreation.waiting_for_race)
-    dp.message.register(process_class, CharacterCreation.waiting_for_class)
-    dp.message.register(process_level, CharacterCreation.waiting_for_level)
-    dp.message.register(process_abilities, CharacterCreation.waiting_for_abilities) 
\ No newline at end of file
+    dp.message.register(process_name, StateFilter(CharacterCreation.waiting_for_name))
+    dp.message.register(process_race, StateFilter(CharacterCreation.waiting_for_race))
+    dp.message.register(process_class, StateFilter(CharacterCreation.waiting_for_class))
+    dp.message.register(process_level, StateFilter(CharacterCreation.waiting_for_level))
+    dp.message.register(process_abilities, StateFilter(CharacterCreation.waiting_for_abilities)) 
\ No newline at end of file
@@ -1,14 +1,12 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
 from config import MESSAGES, CharacterManagement, RACES, CLASSES
+from handlers.common import remember_character_ids, selected_character_id
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 def calculate_modifier(ability_score: int) -> int:
     """Рассчитать модификатор характеристики"""
     return (ability_score - 10) // 2
@@ -69,8 +67,8 @@ def calculate_saving_throw_value(character: dict, ability: str) -> int:
     return value
 
 # Обработчик команды /list_characters
-async def cmd_list_characters(message: types.Message):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_list_characters(message: types.Message, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -88,8 +86,8 @@ async def cmd_list_characters(message: types.Message):
     )
 
 # Обработчик команды /view_character
-async def cmd_view_character(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_view_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -106,12 +104,14 @@ async def cmd_view_character(message: types.Message, state: FSMContext):
         MESSAGES["character_management"]["select_character"],
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_character_select)
 
 # Обработчик выбора персонажа для просмотра
-async def process_character_select(message: types.Message, state: FSMContext):
+async def process_character_select(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.load(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -190,8 +190,8 @@ async def process_character_select(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /delete_character
-async def cmd_delete_character(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_delete_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -208,12 +208,14 @@ async def cmd_delete_character(message: types.Message, state: FSMContext):
         MESSAGES["character_management"]["select_character"],
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_delete_confirmation)
 
 # Обработчик подтверждения удаления
-async def process_delete_confirmation(message: types.Message, state: FSMContext):
+async def process_delete_confirmation(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.load_fields(message.from_user.id, character_id, ("name",)) if character_id else None
     
     if not character:
         await message.answer(
@@ -238,17 +240,18 @@ async def process_delete_confirmation(message: types.Message, state: FSMContext)
         ),
         reply_markup=keyboard
     )
-    await state.update_data(character_name=character_name)
+    await state.update_data(character_id=character_id, character_name=character_name)
     await state.set_state(CharacterManagement.waiting_for_delete_answer)
 
 # Обработчик ответа на подтверждение удаления
-async def process_delete_answer(message: types.Message, state: FSMContext):
+async def process_delete_answer(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     answer = message.text.strip().lower()
     data = await state.get_data()
     character_name = data["character_name"]
+    character_id = data["character_id"]
     
     if answer == "да":
-        if character_storage.delete_character(message.from_user.id, character_name):
+        if await character_storage.delete(message.from_user.id, character_id):
             await message.answer(
                 MESSAGES["character_management"]["delete_success"].format(
                     name=character_name
@@ -269,8 +272,8 @@ async def process_delete_answer(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_proficiencies
-async def cmd_set_proficiencies(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_proficiencies(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -287,12 +290,14 @@ async def cmd_set_proficiencies(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки мастерства навыков:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_proficiencies_character)
 
 # Обработчик выбора персонажа для установки мастерства
-async def process_proficiencies_character(message: types.Message, state: FSMContext):
+async def process_proficiencies_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -302,8 +307,8 @@ async def process_proficiencies_character(message: types.Message, state: FSMCont
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Получаем список всех доступных навыков
     all_skills = get_all_skills(character)
@@ -323,10 +328,10 @@ async def process_proficiencies_character(message: types.Message, state: FSMCont
     await state.set_state(CharacterManagement.waiting_for_proficiencies_list)
 
 # Обработчик ввода списка навыков для мастерства
-async def process_proficiencies_list(message: types.Message, state: FSMContext):
+async def process_proficiencies_list(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
+    character = await character_storage.session(message.from_user.id, character_id)
     
     # Получаем список всех доступных навыков
     all_skills = get_all_skills(character)
@@ -357,24 +362,27 @@ async def process_proficiencies_list(message: types.Message, state: FSMContext):
         )
         return
     
-    # Удаляем навыки из списка если они там есть
-    character['advanced_stats']['skills']['proficiencies'] = list(
-        set(character['advanced_stats']['skills']['proficiencies']) ^ set(normalized_skills))
-    
-    # Удаляем навыки из списка экспертизы, если они там есть
-    character['advanced_stats']['skills']['expertise'] = [
-        skill for skill in character['advanced_stats']['skills']['expertise']
-        if skill not in normalized_skills
-    ]
+    def toggle_proficiencies(character):
+        # Удаляем навыки из списка если они там есть
+        character['advanced_stats']['skills']['proficiencies'] = list(
+            set(character['advanced_stats']['skills']['proficiencies']) ^ set(normalized_skills))
+        
+        # Удаляем навыки из списка экспертизы, если они там есть
+        character['advanced_stats']['skills']['expertise'] = [
+            skill for skill in character['advanced_stats']['skills']['expertise']
+            if skill not in normalized_skills
+        ]
+        
+        # Пересчитываем значения навыков
+        skill_values = {}
+        for skill in all_skills:
+            skill_values[skill] = calculate_skill_value(character, skill)
+        character['advanced_stats']['skills']['values'] = skill_values
     
-    # Пересчитываем значения навыков
-    skill_values = {}
-    for skill in all_skills:
-        skill_values[skill] = calculate_skill_value(character, skill)
-    character['advanced_stats']['skills']['values'] = skill_values
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, toggle_proficiencies)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer("Мастерство навыков успешно обновлено!")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -382,8 +390,8 @@ async def process_proficiencies_list(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_expertise
-async def cmd_set_expertise(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_expertise(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -400,12 +408,14 @@ async def cmd_set_expertise(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки экспертизы навыков:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_expertise_character)
 
 # Обработчик выбора персонажа для установки экспертизы
-async def process_expertise_character(message: types.Message, state: FSMContext):
+async def process_expertise_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -415,8 +425,8 @@ async def process_expertise_character(message: types.Message, state: FSMContext)
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Получаем список всех доступных навыков
     all_skills = get_all_skills(character)
@@ -429,10 +439,10 @@ async def process_expertise_character(message: types.Message, state: FSMContext)
     await state.set_state(CharacterManagement.waiting_for_expertise_list)
 
 # Обработчик ввода списка навыков для экспертизы
-async def process_expertise_list(message: types.Message, state: FSMContext):
+async def process_expertise_list(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
+    character = await character_storage.session(message.from_user.id, character_id)
     
     # Получаем список всех доступных навыков
     all_skills = get_all_skills(character)
@@ -449,24 +459,27 @@ async def process_expertise_list(message: types.Message, state: FSMContext):
         )
         return
     
-    # Удаляем навыки из списка если они там есть
-    character['advanced_stats']['skills']['expertise'] = list(
-        set(character['advanced_stats']['skills']['expertise']) ^ set(input_skills))
-    
-    # Удаляем навыки из списка мастерства, если они там есть
-    character['advanced_stats']['skills']['proficiencies'] = [
-        skill for skill in character['advanced_stats']['skills']['proficiencies']
-        if skill not in input_skills
-    ]
+    def toggle_expertise(character):
+        # Удаляем навыки из списка если они там есть
+        character['advanced_stats']['skills']['expertise'] = list(
+            set(character['advanced_stats']['skills']['expertise']) ^ set(input_skills))
+        
+        # Удаляем навыки из списка мастерства, если они там есть
+        character['advanced_stats']['skills']['proficiencies'] = [
+            skill for skill in character['advanced_stats']['skills']['proficiencies']
+            if skill not in input_skills
+        ]
+        
+        # Пересчитываем значения навыков
+        skill_values = {}
+        for skill in all_skills:
+            skill_values[skill] = calculate_skill_value(character, skill)
+        character['advanced_stats']['skills']['values'] = skill_values
     
-    # Пересчитываем значения навыков
-    skill_values = {}
-    for skill in all_skills:
-        skill_values[skill] = calculate_skill_value(character, skill)
-    character['advanced_stats']['skills']['values'] = skill_values
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, toggle_expertise)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer("Экспертиза навыков успешно обновлена!")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -474,8 +487,8 @@ async def process_expertise_list(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_saving_throws
-async def cmd_set_saving_throws(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_saving_throws(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -492,12 +505,14 @@ async def cmd_set_saving_throws(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки владения спасбросками:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_saving_throws_character)
 
 # Обработчик выбора персонажа для установки спасбросков
-async def process_saving_throws_character(message: types.Message, state: FSMContext):
+async def process_saving_throws_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -507,8 +522,8 @@ async def process_saving_throws_character(message: types.Message, state: FSMCont
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Получаем список всех характеристик
     abilities = [data['name'] for data in character['abilities'].values()]
@@ -521,10 +536,10 @@ async def process_saving_throws_character(message: types.Message, state: FSMCont
     await state.set_state(CharacterManagement.waiting_for_saving_throws_list)
 
 # Обработчик ввода списка характеристик для спасбросков
-async def process_saving_throws_list(message: types.Message, state: FSMContext):
+async def process_saving_throws_list(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
+    character = await character_storage.session(message.from_user.id, character_id)
     
     # Получаем список всех характеристик
     abilities = {data['name']: ability for ability, data in character['abilities'].items()}
@@ -541,21 +556,24 @@ async def process_saving_throws_list(message: types.Message, state: FSMContext):
         )
         return
     
-    # Сбрасываем все спасброски
-    for ability in character['abilities'].values():
-        ability['saving_throw_proficient'] = False
-    
-    # Устанавливаем владение для выбранных характеристик
-    for ability_name in input_abilities:
-        ability_key = abilities[ability_name]
-        character['abilities'][ability_key]['saving_throw_proficient'] = True
+    def set_saving_throws(character):
+        # Сбрасываем все спасброски
+        for ability in character['abilities'].values():
+            ability['saving_throw_proficient'] = False
+        
+        # Устанавливаем владение для выбранных характеристик
+        for ability_name in input_abilities:
+            ability_key = abilities[ability_name]
+            character['abilities'][ability_key]['saving_throw_proficient'] = True
+        
+        # Обновляем значения всех спасбросков
+        for ability in character['abilities']:
+            character['advanced_stats']['saving_throws']['values'][ability] = calculate_saving_throw_value(character, ability)
     
-    # Обновляем значения всех спасбросков
-    for ability in character['abilities']:
-        character['advanced_stats']['saving_throws']['values'][ability] = calculate_saving_throw_value(character, ability)
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_saving_throws)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer("Владение спасбросками успешно обновлено!")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -563,8 +581,8 @@ async def process_saving_throws_list(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_hit_points
-async def cmd_set_hit_points(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_hit_points(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -581,12 +599,14 @@ async def cmd_set_hit_points(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки здоровья:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_hit_points_character)
 
 # Обработчик выбора персонажа для установки здоровья
-async def process_hit_points_character(message: types.Message, state: FSMContext):
+async def process_hit_points_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -596,8 +616,8 @@ async def process_hit_points_character(message: types.Message, state: FSMContext
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     await message.answer(
         f"Введите значения здоровья через пробел в следующем порядке:\n"
@@ -613,7 +633,7 @@ async def process_hit_points_character(message: types.Message, state: FSMContext
     await state.set_state(CharacterManagement.waiting_for_hit_points_value)
 
 # Обработчик ввода значения здоровья
-async def process_hit_points_value(message: types.Message, state: FSMContext):
+async def process_hit_points_value(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         # Разбиваем ввод на максимальное, текущее и временное здоровье
         values = message.text.strip().split()
@@ -637,16 +657,13 @@ async def process_hit_points_value(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
-    # Обновляем значения здоровья
-    character['base_stats']['hit_points']['maximum'] = max_hp
-    character['base_stats']['hit_points']['current'] = current_hp
-    character['base_stats']['hit_points']['temporary'] = temp_hp
+    def set_hit_points(character):
+        character['base_stats']['hit_points'].update(maximum=max_hp, current=current_hp, temporary=temp_hp)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    # Обновляем значения здоровья: в историю попадает событие hp_set
+    if await character_storage.commit_session(message.from_user.id, character_id, set_hit_points, "hp_set"):
         await message.answer(
             f"Здоровье успешно обновлено:\n"
             f"Максимальное: {max_hp}\n"
@@ -659,8 +676,8 @@ async def process_hit_points_value(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_armor_class
-async def cmd_set_armor_class(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_armor_class(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -677,12 +694,14 @@ async def cmd_set_armor_class(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки класса брони:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_armor_class_character)
 
 # Обработчик выбора персонажа для установки класса брони
-async def process_armor_class_character(message: types.Message, state: FSMContext):
+async def process_armor_class_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -692,8 +711,8 @@ async def process_armor_class_character(message: types.Message, state: FSMContex
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     await message.answer(
         f"Введите значение класса брони (текущее значение: {character['base_stats']['armor_class']['value']}):",
@@ -702,7 +721,7 @@ async def process_armor_class_character(message: types.Message, state: FSMContex
     await state.set_state(CharacterManagement.waiting_for_armor_class_value)
 
 # Обработчик ввода значения класса брони
-async def process_armor_class_value(message: types.Message, state: FSMContext):
+async def process_armor_class_value(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         armor_class = int(message.text.strip())
         if armor_class < 0:
@@ -712,14 +731,16 @@ async def process_armor_class_value(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
     # Обновляем значение класса брони
-    character['base_stats']['armor_class']['value'] = armor_class
+    def set_armor_class(character):
+        character['base_stats']['armor_class']['value'] = armor_class
+    
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_armor_class)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(f"Класс брони успешно обновлен: {armor_class}")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -727,8 +748,8 @@ async def process_armor_class_value(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_speed
-async def cmd_set_speed(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_speed(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -745,12 +766,14 @@ async def cmd_set_speed(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки скорости:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_speed_character)
 
 # Обработчик выбора персонажа для установки скорости
-async def process_speed_character(message: types.Message, state: FSMContext):
+async def process_speed_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -760,8 +783,8 @@ async def process_speed_character(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     await message.answer(
         f"Введите значения скоростей через пробел в следующем порядке:\n"
@@ -778,7 +801,7 @@ async def process_speed_character(message: types.Message, state: FSMContext):
     await state.set_state(CharacterManagement.waiting_for_speed_value)
 
 # Обработчик ввода значения скорости
-async def process_speed_value(message: types.Message, state: FSMContext):
+async def process_speed_value(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         # Разбиваем ввод на значения скоростей
         values = message.text.strip().split()
@@ -794,18 +817,20 @@ async def process_speed_value(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
     # Обновляем значения скоростей
-    character['base_stats']['speed']['current'] = speeds[0]
-    character['base_stats']['speed']['fly'] = speeds[1]
-    character['base_stats']['speed']['swim'] = speeds[2]
-    character['base_stats']['speed']['climb'] = speeds[3]
-    character['base_stats']['speed']['burrow'] = speeds[4]
-    
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    def set_speed(character):
+        character['base_stats']['speed']['current'] = speeds[0]
+        character['base_stats']['speed']['fly'] = speeds[1]
+        character['base_stats']['speed']['swim'] = speeds[2]
+        character['base_stats']['speed']['climb'] = speeds[3]
+        character['base_stats']['speed']['burrow'] = speeds[4]
+    
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_speed)
+    
+    if saved:
         await message.answer(
             f"Скорости успешно обновлены:\n"
             f"Обычная: {speeds[0]} футов\n"
@@ -820,8 +845,8 @@ async def process_speed_value(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /set_proficiency_bonus
-async def cmd_set_proficiency_bonus(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_proficiency_bonus(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -838,12 +863,14 @@ async def cmd_set_proficiency_bonus(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки бонуса мастерства:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_proficiency_bonus_character)
 
 # Обработчик выбора персонажа для установки бонуса мастерства
-async def process_proficiency_bonus_character(message: types.Message, state: FSMContext):
+async def process_proficiency_bonus_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -853,8 +880,8 @@ async def process_proficiency_bonus_character(message: types.Message, state: FSM
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     await message.answer(
         f"Введите значение бонуса мастерства (текущее значение: +{character['base_stats']['proficiency_bonus']['value']}):",
@@ -863,7 +890,7 @@ async def process_proficiency_bonus_character(message: types.Message, state: FSM
     await state.set_state(CharacterManagement.waiting_for_proficiency_bonus_value)
 
 # Обработчик ввода значения бонуса мастерства
-async def process_proficiency_bonus_value(message: types.Message, state: FSMContext):
+async def process_proficiency_bonus_value(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         bonus = int(message.text.strip())
         if bonus < 0:
@@ -873,21 +900,23 @@ async def process_proficiency_bonus_value(message: types.Message, state: FSMCont
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
-    
-    # Обновляем значение бонуса мастерства
-    character['base_stats']['proficiency_bonus']['value'] = bonus
+    character_id = data["character_id"]
     
-    # Пересчитываем значения навыков и спасбросков
-    for ability in character['abilities']:
-        character['advanced_stats']['saving_throws']['values'][ability] = calculate_saving_throw_value(character, ability)
+    def set_proficiency_bonus(character):
+        # Обновляем значение бонуса мастерства
+        character['base_stats']['proficiency_bonus']['value'] = bonus
+        
+        # Пересчитываем значения навыков и спасбросков
+        for ability in character['abilities']:
+            character['advanced_stats']['saving_throws']['values'][ability] = calculate_saving_throw_value(character, ability)
+        
+        for skill in character['advanced_stats']['skills']['values']:
+            character['advanced_stats']['skills']['values'][skill] = calculate_skill_value(character, skill)
     
-    for skill in character['advanced_stats']['skills']['values']:
-        character['advanced_stats']['skills']['values'][skill] = calculate_skill_value(character, skill)
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_proficiency_bonus)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(f"Бонус мастерства успешно обновлен: +{bonus}")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -895,8 +924,8 @@ async def process_proficiency_bonus_value(message: types.Message, state: FSMCont
     await state.clear()
 
 # Обработчик команды /edit_character
-async def cmd_edit_character(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_edit_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -913,12 +942,14 @@ async def cmd_edit_character(message: types.Message, state: FSMContext):
         "Выберите персонажа для редактирования:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_edit_character)
 
 # Обработчик выбора персонажа для редактирования
-async def process_edit_character(message: types.Message, state: FSMContext):
+async def process_edit_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -928,8 +959,8 @@ async def process_edit_character(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Создаем клавиатуру с параметрами для редактирования
     keyboard = ReplyKeyboardMarkup(
@@ -955,9 +986,6 @@ async def process_edit_character(message: types.Message, state: FSMContext):
 # Обработчик выбора параметра для редактирования
 async def process_edit_parameter(message: types.Message, state: FSMContext):
     parameter = message.text.strip()
-    data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
     
     if parameter == "Имя":
         await message.answer(
@@ -1004,7 +1032,7 @@ async def process_edit_parameter(message: types.Message, state: FSMContext):
         return
 
 # Обработчик ввода нового имени
-async def process_edit_name(message: types.Message, state: FSMContext):
+async def process_edit_name(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     new_name = message.text.strip()
     
     if len(new_name) < 2 or len(new_name) > 30:
@@ -1012,22 +1040,20 @@ async def process_edit_name(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
-    
-    # Проверяем, не занято ли новое имя
-    if new_name != character_name and character_storage.load_character(message.from_user.id, new_name):
-        await message.answer("Персонаж с таким именем уже существует.")
-        return
+    character_id = data["character_id"]
+    async with character_storage.lock(message.from_user.id, character_id):
+        # Проверяем, не занято ли новое имя
+        if await character_storage.find(message.from_user.id, new_name) not in (None, character_id):
+            await message.answer("Персонаж с таким именем уже существует.")
+            return
+        
+        # Переименование меняет только имя и индекс имен: данные остаются под тем же ID
+        saved = await character_storage.rename(message.from_user.id, character_id, new_name)
     
-    # Обновляем имя персонажа
-    character['name'] = new_name
+    # Имя меняется переименованием, снимок диалога больше не нужен
+    character_storage.close_session(message.from_user.id)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
-        # Если имя изменилось, удаляем старый файл
-        if new_name != character_name:
-            character_storage.delete_character(message.from_user.id, character_name)
+    if saved:
         await message.answer(f"Имя персонажа успешно изменено на: {new_name}")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -1035,7 +1061,7 @@ async def process_edit_name(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик выбора новой расы
-async def process_edit_race(message: types.Message, state: FSMContext):
+async def process_edit_race(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     new_race = message.text.strip()
     
     if new_race not in RACES:
@@ -1043,14 +1069,16 @@ async def process_edit_race(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
     # Обновляем расу персонажа
-    character['race'] = new_race
+    def set_race(character):
+        character['race'] = new_race
+    
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_race)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(f"Раса персонажа успешно изменена на: {new_race}")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -1058,7 +1086,7 @@ async def process_edit_race(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик выбора нового класса
-async def process_edit_class(message: types.Message, state: FSMContext):
+async def process_edit_class(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     new_class = message.text.strip()
     
     if new_class not in CLASSES:
@@ -1066,14 +1094,16 @@ async def process_edit_class(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
     # Обновляем класс персонажа
-    character['class_name'] = new_class
+    def set_class_name(character):
+        character['class_name'] = new_class
+    
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_class_name)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(f"Класс персонажа успешно изменен на: {new_class}")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -1081,7 +1111,7 @@ async def process_edit_class(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик ввода нового уровня
-async def process_edit_level(message: types.Message, state: FSMContext):
+async def process_edit_level(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         new_level = int(message.text.strip())
         if new_level < 1 or new_level > 20:
@@ -1091,14 +1121,16 @@ async def process_edit_level(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
     # Обновляем уровень персонажа
-    character['level'] = new_level
+    def set_level(character):
+        character['level'] = new_level
+    
+    # Сохраняем изменения снимка
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_level)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(f"Уровень персонажа успешно изменен на: {new_level}")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -1119,26 +1151,26 @@ def register_character_management_handlers(dp):
     dp.message.register(cmd_set_proficiency_bonus, Command("set_proficiency_bonus"))
     dp.message.register(cmd_edit_character, Command("edit_character"))
     
-    dp.message.register(process_character_select, CharacterManagement.waiting_for_character_select)
-    dp.message.register(process_delete_confirmation, CharacterManagement.waiting_for_delete_confirmation)
-    dp.message.register(process_delete_answer, CharacterManagement.waiting_for_delete_answer)
-    dp.message.register(process_proficiencies_character, CharacterManagement.waiting_for_proficiencies_character)
-    dp.message.register(process_proficiencies_list, CharacterManagement.waiting_for_proficiencies_list)
-    dp.message.register(process_expertise_character, CharacterManagement.waiting_for_expertise_character)
-    dp.message.register(process_expertise_list, CharacterManagement.waiting_for_expertise_list)
-    dp.message.register(process_saving_throws_character, CharacterManagement.waiting_for_saving_throws_character)
-    dp.message.register(process_saving_throws_list, CharacterManagement.waiting_for_saving_throws_list)
-    dp.message.register(process_hit_points_character, CharacterManagement.waiting_for_hit_points_character)
-    dp.message.register(process_hit_points_value, CharacterManagement.waiting_for_hit_points_value)
-    dp.message.register(process_armor_class_character, CharacterManagement.waiting_for_armor_class_character)
-    dp.message.register(process_armor_class_value, CharacterManagement.waiting_for_armor_class_value)
-    dp.message.register(process_speed_character, CharacterManagement.waiting_for_speed_character)
-    dp.message.register(process_speed_value, CharacterManagement.waiting_for_speed_value)
-    dp.message.register(process_proficiency_bonus_character, CharacterManagement.waiting_for_proficiency_bonus_character)
-    dp.message.register(process_proficiency_bonus_value, CharacterManagement.waiting_for_proficiency_bonus_value)
-    dp.message.register(process_edit_character, CharacterManagement.waiting_for_edit_character)
-    dp.message.register(process_edit_parameter, CharacterManagement.waiting_for_edit_name, F.text.in_(["Имя", "Раса", "Класс", "Уровень"]))
-    dp.message.register(process_edit_name, CharacterManagement.waiting_for_edit_name)
-    dp.message.register(process_edit_race, CharacterManagement.waiting_for_edit_race)
-    dp.message.register(process_edit_class, CharacterManagement.waiting_for_edit_class)
-    dp.message.register(process_edit_level, CharacterManagement.waiting_for_edit_level) 
\ No newline at end of file
+    dp.message.register(process_character_select, StateFilter(CharacterManagement.waiting_for_character_select))
+    dp.message.register(process_delete_confirmation, StateFilter(CharacterManagement.waiting_for_delete_confirmation))
+    dp.message.register(process_delete_answer, StateFilter(CharacterManagement.waiting_for_delete_answer))
+    dp.message.register(process_proficiencies_character, StateFilter(CharacterManagement.waiting_for_proficiencies_character))
+    dp.message.register(process_proficiencies_list, StateFilter(CharacterManagement.waiting_for_proficiencies_list))
+    dp.message.register(process_expertise_character, StateFilter(CharacterManagement.waiting_for_expertise_character))
+    dp.message.register(process_expertise_list, StateFilter(CharacterManagement.waiting_for_expertise_list))
+    dp.message.register(process_saving_throws_character, StateFilter(CharacterManagement.waiting_for_saving_throws_character))
+    dp.message.register(process_saving_throws_list, StateFilter(CharacterManagement.waiting_for_saving_throws_list))
+    dp.message.register(process_hit_points_character, StateFilter(CharacterManagement.waiting_for_hit_points_character))
+    dp.message.register(process_hit_points_value, StateFilter(CharacterManagement.waiting_for_hit_points_value))
+    dp.message.register(process_armor_class_character, StateFilter(CharacterManagement.waiting_for_armor_class_character))
+    dp.message.register(process_armor_class_value, StateFilter(CharacterManagement.waiting_for_armor_class_value))
+    dp.message.register(process_speed_character, StateFilter(CharacterManagement.waiting_for_speed_character))
+    dp.message.register(process_speed_value, StateFilter(CharacterManagement.waiting_for_speed_value))
+    dp.message.register(process_proficiency_bonus_character, StateFilter(CharacterManagement.waiting_for_proficiency_bonus_character))
+    dp.message.register(process_proficiency_bonus_value, StateFilter(CharacterManagement.waiting_for_proficiency_bonus_value))
+    dp.message.register(process_edit_character, StateFilter(CharacterManagement.waiting_for_edit_character))
+    dp.message.register(process_edit_parameter, StateFilter(CharacterManagement.waiting_for_edit_name), F.text.in_(["Имя", "Раса", "Класс", "Уровень"]))
+    dp.message.register(process_edit_name, StateFilter(CharacterManagement.waiting_for_edit_name))
+    dp.message.register(process_edit_race, StateFilter(CharacterManagement.waiting_for_edit_race))
+    dp.message.register(process_edit_class, StateFilter(CharacterManagement.waiting_for_edit_class))
+    dp.message.register(process_edit_level, StateFilter(CharacterManagement.waiting_for_edit_level)) 
\ No newline at end of file
@@ -0,0 +1,18 @@
+from typing import Optional
+
+from aiogram.fsm.context import FSMContext
+
+from storage.character_storage import CharacterStorage
+
+async def remember_character_ids(state: FSMContext, characters: list, key: str = "character_ids"):
+    """Запомнить в состоянии ID персонажей с кнопок клавиатуры: кнопка присылает только имя"""
+    await state.update_data({key: {char["name"]: char["id"] for char in characters}})
+
+async def selected_character_id(state: FSMContext, character_storage: CharacterStorage,
+                                user_id: int, character_name: str, key: str = "character_ids") -> Optional[str]:
+    """ID выбранного персонажа: по клавиатуре из состояния, иначе по индексу имен хранилища"""
+    data = await state.get_data()
+    character_id = data.get(key, {}).get(character_name)
+    if character_id is None:
+        character_id = await character_storage.find(user_id, character_name)
+    return character_id
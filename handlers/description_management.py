@@ -1,17 +1,15 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
 from config import MESSAGES, CharacterManagement
+from handlers.common import remember_character_ids, selected_character_id
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 # Обработчик команды /set_description
-async def cmd_set_description(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_description(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -28,12 +26,14 @@ async def cmd_set_description(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки описания:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_description_character)
 
 # Обработчик выбора персонажа для установки описания
-async def process_description_character(message: types.Message, state: FSMContext):
+async def process_description_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -43,8 +43,8 @@ async def process_description_character(message: types.Message, state: FSMContex
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Показываем текущее описание, если оно есть
     current_description = character.get('description', '')
@@ -63,7 +63,7 @@ async def process_description_character(message: types.Message, state: FSMContex
     await state.set_state(CharacterManagement.waiting_for_description_text)
 
 # Обработчик ввода описания персонажа
-async def process_description_text(message: types.Message, state: FSMContext):
+async def process_description_text(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     description = message.text.strip()
     if not description:
         await message.answer("Описание не может быть пустым.")
@@ -71,13 +71,13 @@ async def process_description_text(message: types.Message, state: FSMContext):
     
     data = await state.get_data()
     character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
-    # Обновляем описание персонажа
-    character['description'] = description
+    def set_description(character):
+        character['description'] = description
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    # Обновляем описание персонажа: в журнал пишется только новое описание
+    if await character_storage.commit_session(message.from_user.id, character_id, set_description, "description_set"):
         await message.answer(
             f"Описание персонажа {character_name} успешно обновлено.",
             reply_markup=ReplyKeyboardRemove()
@@ -91,8 +91,8 @@ async def process_description_text(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /view_description
-async def cmd_view_description(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_view_description(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -109,12 +109,14 @@ async def cmd_view_description(message: types.Message, state: FSMContext):
         "Выберите персонажа для просмотра описания:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_view_description_character)
 
 # Обработчик выбора персонажа для просмотра описания
-async def process_view_description_character(message: types.Message, state: FSMContext):
+async def process_view_description_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.load(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -143,6 +145,6 @@ def register_description_management_handlers(dp):
     dp.message.register(cmd_set_description, Command("set_description"))
     dp.message.register(cmd_view_description, Command("view_description"))
     
-    dp.message.register(process_description_character, CharacterManagement.waiting_for_description_character)
-    dp.message.register(process_description_text, CharacterManagement.waiting_for_description_text)
-    dp.message.register(process_view_description_character, CharacterManagement.waiting_for_view_description_character) 
\ No newline at end of file
+    dp.message.register(process_description_character, StateFilter(CharacterManagement.waiting_for_description_character))
+    dp.message.register(process_description_text, StateFilter(CharacterManagement.waiting_for_description_text))
+    dp.message.register(process_view_description_character, StateFilter(CharacterManagement.waiting_for_view_description_character)) 
\ No newline at end of file
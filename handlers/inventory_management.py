@@ -1,17 +1,15 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
 from config import MESSAGES, CharacterManagement
+from handlers.common import remember_character_ids, selected_character_id
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 # Обработчик команды /inventory
-async def cmd_inventory(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_inventory(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -28,12 +26,14 @@ async def cmd_inventory(message: types.Message, state: FSMContext):
         "Выберите персонажа для управления инвентарем:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_inventory_character)
 
 # Обработчик выбора персонажа для управления инвентарем
-async def process_inventory_character(message: types.Message, state: FSMContext):
+async def process_inventory_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -43,8 +43,8 @@ async def process_inventory_character(message: types.Message, state: FSMContext)
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Создаем клавиатуру с типами операций
     keyboard = ReplyKeyboardMarkup(
@@ -63,11 +63,12 @@ async def process_inventory_character(message: types.Message, state: FSMContext)
     await state.set_state(CharacterManagement.waiting_for_inventory_operation)
 
 # Обработчик выбора операции с инвентарем
-async def process_inventory_operation(message: types.Message, state: FSMContext):
+async def process_inventory_operation(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     operation = message.text.strip()
     data = await state.get_data()
     character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
+    character = await character_storage.session(message.from_user.id, character_id)
     
     if operation == "Показать инвентарь":
         inventory_info = f"🎒 Инвентарь персонажа {character_name}:\n\n"
@@ -97,6 +98,7 @@ async def process_inventory_operation(message: types.Message, state: FSMContext)
             inventory_info += "Нет предметов\n"
         
         await message.answer(inventory_info, reply_markup=ReplyKeyboardRemove())
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -105,6 +107,7 @@ async def process_inventory_operation(message: types.Message, state: FSMContext)
             MESSAGES["common"]["invalid_input"],
             reply_markup=ReplyKeyboardRemove()
         )
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -128,13 +131,14 @@ async def process_inventory_operation(message: types.Message, state: FSMContext)
     await state.set_state(CharacterManagement.waiting_for_inventory_category)
 
 # Обработчик выбора категории предмета
-async def process_inventory_category(message: types.Message, state: FSMContext):
+async def process_inventory_category(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     category = message.text.strip()
     if category not in ["Оружие", "Броня", "Предметы"]:
         await message.answer(
             MESSAGES["common"]["invalid_input"],
             reply_markup=ReplyKeyboardRemove()
         )
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -160,8 +164,8 @@ async def process_inventory_category(message: types.Message, state: FSMContext):
         await state.set_state(CharacterManagement.waiting_for_inventory_item_name)
     else:  # Удалить предмет
         data = await state.get_data()
-        character_name = data["character_name"]
-        character = character_storage.load_character(message.from_user.id, character_name)
+        character_id = data["character_id"]
+        character = await character_storage.session(message.from_user.id, character_id)
         
         # Получаем список предметов выбранной категории
         category_key = category_mapping[category]
@@ -172,6 +176,7 @@ async def process_inventory_category(message: types.Message, state: FSMContext):
                 f"В категории {category} нет предметов.",
                 reply_markup=ReplyKeyboardRemove()
             )
+            character_storage.close_session(message.from_user.id)
             await state.clear()
             return
         
@@ -189,17 +194,17 @@ async def process_inventory_category(message: types.Message, state: FSMContext):
         await state.set_state(CharacterManagement.waiting_for_inventory_item_remove)
 
 # Обработчик ввода названия предмета
-async def process_inventory_item_name(message: types.Message, state: FSMContext):
+async def process_inventory_item_name(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     item_name = message.text.strip()
     if not item_name:
         await message.answer("Название предмета не может быть пустым.")
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
+    character_id = data["character_id"]
     category = data["inventory_category"]
     category_key = data["category_key"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character = await character_storage.session(message.from_user.id, character_id)
     
     # Добавляем предмет в соответствующую категорию
     if item_name in character['equipment'][category_key]['items']:
@@ -207,13 +212,18 @@ async def process_inventory_item_name(message: types.Message, state: FSMContext)
             f"Предмет '{item_name}' уже есть в инвентаре.",
             reply_markup=ReplyKeyboardRemove()
         )
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
-    character['equipment'][category_key]['items'].append(item_name)
+    def add_item(character):
+        if item_name not in character['equipment'][category_key]['items']:
+            character['equipment'][category_key]['items'].append(item_name)
+    
+    # Сохраняем изменения снимка событием item_add
+    saved = await character_storage.commit_session(message.from_user.id, character_id, add_item, "item_add")
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(
             f"Предмет '{item_name}' успешно добавлен в категорию {category}.",
             reply_markup=ReplyKeyboardRemove()
@@ -227,13 +237,13 @@ async def process_inventory_item_name(message: types.Message, state: FSMContext)
     await state.clear()
 
 # Обработчик удаления предмета
-async def process_inventory_item_remove(message: types.Message, state: FSMContext):
+async def process_inventory_item_remove(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     item_name = message.text.strip()
     data = await state.get_data()
-    character_name = data["character_name"]
+    character_id = data["character_id"]
     category = data["inventory_category"]
     category_key = data["category_key"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character = await character_storage.session(message.from_user.id, character_id)
     
     # Удаляем предмет из соответствующей категории
     if item_name not in character['equipment'][category_key]['items']:
@@ -241,13 +251,18 @@ async def process_inventory_item_remove(message: types.Message, state: FSMContex
             f"Предмет '{item_name}' не найден в категории {category}.",
             reply_markup=ReplyKeyboardRemove()
         )
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
-    character['equipment'][category_key]['items'].remove(item_name)
+    def remove_item(character):
+        if item_name in character['equipment'][category_key]['items']:
+            character['equipment'][category_key]['items'].remove(item_name)
+    
+    # Сохраняем изменения снимка событием item_remove
+    saved = await character_storage.commit_session(message.from_user.id, character_id, remove_item, "item_remove")
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(
             f"Предмет '{item_name}' успешно удален из категории {category}.",
             reply_markup=ReplyKeyboardRemove()
@@ -261,8 +276,8 @@ async def process_inventory_item_remove(message: types.Message, state: FSMContex
     await state.clear()
 
 # Обработчик команды /view_equipment
-async def cmd_view_equipment(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_view_equipment(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -279,12 +294,14 @@ async def cmd_view_equipment(message: types.Message, state: FSMContext):
         "Выберите персонажа для просмотра снаряжения:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_view_equipment_character)
 
 # Обработчик выбора персонажа для просмотра снаряжения
-async def process_view_equipment_character(message: types.Message, state: FSMContext):
+async def process_view_equipment_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.load(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -340,9 +357,9 @@ def register_inventory_management_handlers(dp):
     dp.message.register(cmd_inventory, Command("inventory"))
     dp.message.register(cmd_view_equipment, Command("view_equipment"))
     
-    dp.message.register(process_inventory_character, CharacterManagement.waiting_for_inventory_character)
-    dp.message.register(process_inventory_operation, CharacterManagement.waiting_for_inventory_operation)
-    dp.message.register(process_inventory_category, CharacterManagement.waiting_for_inventory_category)
-    dp.message.register(process_inventory_item_name, CharacterManagement.waiting_for_inventory_item_name)
-    dp.message.register(process_inventory_item_remove, CharacterManagement.waiting_for_inventory_item_remove)
-    dp.message.register(process_view_equipment_character, CharacterManagement.waiting_for_view_equipment_character) 
\ No newline at end of file
+    dp.message.register(process_inventory_character, StateFilter(CharacterManagement.waiting_for_inventory_character))
+    dp.message.register(process_inventory_operation, StateFilter(CharacterManagement.waiting_for_inventory_operation))
+    dp.message.register(process_inventory_category, StateFilter(CharacterManagement.waiting_for_inventory_category))
+    dp.message.register(process_inventory_item_name, StateFilter(CharacterManagement.waiting_for_inventory_item_name))
+    dp.message.register(process_inventory_item_remove, StateFilter(CharacterManagement.waiting_for_inventory_item_remove))
+    dp.message.register(process_view_equipment_character, StateFilter(CharacterManagement.waiting_for_view_equipment_character)) 
\ No newline at end of file
@@ -1,17 +1,15 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
 from config import MESSAGES, CharacterManagement
+from handlers.common import remember_character_ids, selected_character_id
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 # Обработчик команды /set_money
-async def cmd_set_money(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_money(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -28,12 +26,14 @@ async def cmd_set_money(message: types.Message, state: FSMContext):
         "Выберите персонажа для управления деньгами:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_money_character)
 
 # Обработчик выбора персонажа для управления деньгами
-async def process_money_character(message: types.Message, state: FSMContext):
+async def process_money_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -43,8 +43,8 @@ async def process_money_character(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Создаем клавиатуру с типами операций
     keyboard = ReplyKeyboardMarkup(
@@ -63,11 +63,12 @@ async def process_money_character(message: types.Message, state: FSMContext):
     await state.set_state(CharacterManagement.waiting_for_money_operation)
 
 # Обработчик выбора операции с деньгами
-async def process_money_operation(message: types.Message, state: FSMContext):
+async def process_money_operation(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     operation = message.text.strip()
     data = await state.get_data()
     character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
+    character = await character_storage.session(message.from_user.id, character_id)
     
     if operation == "Показать баланс":
         money = character['equipment']['money']
@@ -93,6 +94,7 @@ async def process_money_operation(message: types.Message, state: FSMContext):
                 balance_info += f"• {money['copper']} медных"
         
         await message.answer(balance_info, reply_markup=ReplyKeyboardRemove())
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -101,6 +103,7 @@ async def process_money_operation(message: types.Message, state: FSMContext):
             MESSAGES["common"]["invalid_input"],
             reply_markup=ReplyKeyboardRemove()
         )
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -121,7 +124,7 @@ async def process_money_operation(message: types.Message, state: FSMContext):
     await state.set_state(CharacterManagement.waiting_for_money_amount)
 
 # Обработчик ввода количества денег
-async def process_money_amount(message: types.Message, state: FSMContext):
+async def process_money_amount(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         # Разбиваем ввод на значения монет
         values = message.text.strip().split()
@@ -137,33 +140,39 @@ async def process_money_amount(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
+    character_id = data["character_id"]
     operation = data["money_operation"]
-    character = character_storage.load_character(message.from_user.id, character_name)
-    
-    # Обновляем значения денег
-    if operation == "Добавить":
-        character['equipment']['money']['platinum'] += coins[0]
-        character['equipment']['money']['gold'] += coins[1]
-        character['equipment']['money']['silver'] += coins[2]
-        character['equipment']['money']['copper'] += coins[3]
-    else:  # Потратить
+    coin_types = ("platinum", "gold", "silver", "copper")
+    
+    # Достаточно ли денег для траты
+    def enough_money(character):
+        return all(character['equipment']['money'][coin_type] >= coin for coin_type, coin in zip(coin_types, coins))
+    
+    if operation != "Добавить":  # Потратить
         # Проверяем, достаточно ли денег
-        if (character['equipment']['money']['platinum'] < coins[0] or
-            character['equipment']['money']['gold'] < coins[1] or
-            character['equipment']['money']['silver'] < coins[2] or
-            character['equipment']['money']['copper'] < coins[3]):
+        if not enough_money(await character_storage.session(message.from_user.id, character_id)):
             await message.answer("Недостаточно денег для совершения операции.")
+            character_storage.close_session(message.from_user.id)
             await state.clear()
             return
-        
-        character['equipment']['money']['platinum'] -= coins[0]
-        character['equipment']['money']['gold'] -= coins[1]
-        character['equipment']['money']['silver'] -= coins[2]
-        character['equipment']['money']['copper'] -= coins[3]
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    shortage = []
+    
+    def change_money(character):
+        # Если персонажа изменили после выбора, проверка повторяется на свежем документе
+        if operation != "Добавить" and not enough_money(character):
+            shortage.append(True)
+            return False
+        sign = 1 if operation == "Добавить" else -1
+        for coin_type, coin in zip(coin_types, coins):
+            character['equipment']['money'][coin_type] += sign * coin
+    
+    # Обновляем значения денег: снимок записывается событием money_add или money_spend
+    character = await character_storage.commit_session(
+        message.from_user.id, character_id, change_money, "money_add" if operation == "Добавить" else "money_spend"
+    )
+    
+    if character:
         money = character['equipment']['money']
         balance_info = "Баланс успешно обновлен:\n"
         
@@ -187,6 +196,8 @@ async def process_money_amount(message: types.Message, state: FSMContext):
                 balance_info += f"• {money['copper']} медных"
         
         await message.answer(balance_info)
+    elif shortage:
+        await message.answer("Недостаточно денег для совершения операции.")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
     
@@ -196,6 +207,6 @@ def register_money_management_handlers(dp):
     """Регистрация всех обработчиков управления деньгами"""
     dp.message.register(cmd_set_money, Command("set_money"))
     
-    dp.message.register(process_money_character, CharacterManagement.waiting_for_money_character)
-    dp.message.register(process_money_operation, CharacterManagement.waiting_for_money_operation)
-    dp.message.register(process_money_amount, CharacterManagement.waiting_for_money_amount) 
\ No newline at end of file
+    dp.message.register(process_money_character, StateFilter(CharacterManagement.waiting_for_money_character))
+    dp.message.register(process_money_operation, StateFilter(CharacterManagement.waiting_for_money_operation))
+    dp.message.register(process_money_amount, StateFilter(CharacterManagement.waiting_for_money_amount)) 
\ No newline at end of file
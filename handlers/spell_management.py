@@ -1,18 +1,16 @@
 import re
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
 from config import MESSAGES, CharacterManagement
+from handlers.common import remember_character_ids, selected_character_id
 from storage.character_storage import CharacterStorage
 
-# Инициализация хранилища
-character_storage = CharacterStorage()
-
 # Обработчик команды /set_spell_slots
-async def cmd_set_spell_slots(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_set_spell_slots(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -29,12 +27,14 @@ async def cmd_set_spell_slots(message: types.Message, state: FSMContext):
         "Выберите персонажа для установки ячеек заклинаний:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_spell_slots_character)
 
 # Обработчик выбора персонажа для установки ячеек заклинаний
-async def process_spell_slots_character(message: types.Message, state: FSMContext):
+async def process_spell_slots_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -44,8 +44,8 @@ async def process_spell_slots_character(message: types.Message, state: FSMContex
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Показываем текущие значения ячеек заклинаний
     current_slots = character['magic']['spell_slots']['values']
@@ -59,7 +59,7 @@ async def process_spell_slots_character(message: types.Message, state: FSMContex
     await state.set_state(CharacterManagement.waiting_for_spell_slots_values)
 
 # Обработчик ввода значений ячеек заклинаний
-async def process_spell_slots_values(message: types.Message, state: FSMContext):
+async def process_spell_slots_values(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     try:
         # Разбиваем ввод на значения для каждого уровня
         values = [int(value) for value in message.text.strip().split()]
@@ -74,15 +74,17 @@ async def process_spell_slots_values(message: types.Message, state: FSMContext):
         return
     
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
     
     # Обновляем значения ячеек заклинаний
-    for level, slots in enumerate(values, 1):
-        character['magic']['spell_slots']['values'][str(level)] = slots
+    def set_slots(character):
+        for level, slots in enumerate(values, 1):
+            character['magic']['spell_slots']['values'][str(level)] = slots
+    
+    # Персонаж загружен при выборе: записываем изменения снимка событием spell_slots_set
+    saved = await character_storage.commit_session(message.from_user.id, character_id, set_slots, "spell_slots_set")
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         slots_info = "\n".join(f"Уровень {level}: {slots}" for level, slots in enumerate(values, 1) if slots > 0)
         await message.answer(f"Ячейки заклинаний успешно обновлены:\n{slots_info}")
     else:
@@ -91,8 +93,8 @@ async def process_spell_slots_values(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /add_spell
-async def cmd_add_spell(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_add_spell(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -109,12 +111,14 @@ async def cmd_add_spell(message: types.Message, state: FSMContext):
         "Выберите персонажа для добавления заклинания:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_add_spell_character)
 
 # Обработчик выбора персонажа для добавления заклинания
-async def process_add_spell_character(message: types.Message, state: FSMContext):
+async def process_add_spell_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -124,8 +128,8 @@ async def process_add_spell_character(message: types.Message, state: FSMContext)
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Создаем клавиатуру с типами заклинаний
     keyboard = ReplyKeyboardMarkup(
@@ -196,34 +200,36 @@ async def process_spell_level(message: types.Message, state: FSMContext):
     await state.set_state(CharacterManagement.waiting_for_spell_name)
 
 # Обработчик ввода названия заклинания
-async def process_spell_name(message: types.Message, state: FSMContext):
+async def process_spell_name(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     spell_name = message.text.strip()
     data = await state.get_data()
-    character_name = data["character_name"]
+    character_id = data["character_id"]
     spell_type = data["spell_type"]
-    character = character_storage.load_character(message.from_user.id, character_name)
-    
-    if spell_type == "Заговор":
-        # Добавляем заговор
-        if spell_name not in character['magic']['spells_known']['cantrips']:
-            character['magic']['spells_known']['cantrips'].append(spell_name)
-    else:
-        # Добавляем заклинание
+    if spell_type != "Заговор":
         spell_level = data["spell_level"]
         spell_name_with_level = f"{spell_name} ({spell_level} уровень)"
-        if spell_name_with_level not in character['magic']['spells_known']['spells']:
-            character['magic']['spells_known']['spells'].append(spell_name_with_level)
-
-            def extract_level(spell):
-                match = re.search(r"\((\d+) уровень\)", spell)
-                return int(match.group(1)) if match else 0
-
-            # Сортируем список по уровню
-            character['magic']['spells_known']['spells'] = sorted(
-                character['magic']['spells_known']['spells'], key=extract_level)
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    def add_spell(character):
+        if spell_type == "Заговор":
+            # Добавляем заговор
+            if spell_name not in character['magic']['spells_known']['cantrips']:
+                character['magic']['spells_known']['cantrips'].append(spell_name)
+        else:
+            # Добавляем заклинание
+            spells = character['magic']['spells_known']['spells']
+            if spell_name_with_level not in spells:
+                def extract_level(spell):
+                    match = re.search(r"\((\d+) уровень\)", spell)
+                    return int(match.group(1)) if match else 0
+                
+                # Вставляем после заклинаний того же и меньших уровней, сохраняя сортировку по уровню
+                position = sum(1 for spell in spells if extract_level(spell) <= spell_level)
+                spells.insert(position, spell_name_with_level)
+    
+    # Сохраняем изменения снимка событием spell_add
+    saved = await character_storage.commit_session(message.from_user.id, character_id, add_spell, "spell_add")
+    
+    if saved:
         if spell_type == "Заговор":
             await message.answer(f"Заговор '{spell_name}' успешно добавлен.")
         else:
@@ -234,8 +240,8 @@ async def process_spell_name(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /remove_spell
-async def cmd_remove_spell(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_remove_spell(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -252,12 +258,14 @@ async def cmd_remove_spell(message: types.Message, state: FSMContext):
         "Выберите персонажа для удаления заклинания:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_remove_spell_character)
 
 # Обработчик выбора персонажа для удаления заклинания
-async def process_remove_spell_character(message: types.Message, state: FSMContext):
+async def process_remove_spell_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.open_session(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -267,8 +275,8 @@ async def process_remove_spell_character(message: types.Message, state: FSMConte
         await state.clear()
         return
     
-    # Сохраняем имя персонажа в состоянии
-    await state.update_data(character_name=character_name)
+    # Сохраняем ID и имя персонажа в состоянии
+    await state.update_data(character_id=character_id, character_name=character_name)
     
     # Создаем клавиатуру с типами заклинаний
     keyboard = ReplyKeyboardMarkup(
@@ -286,17 +294,18 @@ async def process_remove_spell_character(message: types.Message, state: FSMConte
     await state.set_state(CharacterManagement.waiting_for_remove_spell_type)
 
 # Обработчик выбора типа заклинания для удаления
-async def process_remove_spell_type(message: types.Message, state: FSMContext):
+async def process_remove_spell_type(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     spell_type = message.text.strip()
     data = await state.get_data()
-    character_name = data["character_name"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = data["character_id"]
+    character = await character_storage.session(message.from_user.id, character_id)
     
     if spell_type not in ["Заговор", "Заклинание"]:
         await message.answer(
             MESSAGES["common"]["invalid_input"],
             reply_markup=ReplyKeyboardRemove()
         )
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -308,6 +317,7 @@ async def process_remove_spell_type(message: types.Message, state: FSMContext):
     
     if not spells:
         await message.answer(f"У персонажа нет {spell_type.lower()}ов.")
+        character_storage.close_session(message.from_user.id)
         await state.clear()
         return
     
@@ -324,22 +334,21 @@ async def process_remove_spell_type(message: types.Message, state: FSMContext):
     await state.set_state(CharacterManagement.waiting_for_remove_spell_name)
 
 # Обработчик выбора заклинания для удаления
-async def process_remove_spell_name(message: types.Message, state: FSMContext):
+async def process_remove_spell_name(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     spell_name = message.text.strip()
     data = await state.get_data()
-    character_name = data["character_name"]
+    character_id = data["character_id"]
     spell_type = data["spell_type"]
-    character = character_storage.load_character(message.from_user.id, character_name)
+    spell_list = "cantrips" if spell_type == "Заговор" else "spells"
     
-    if spell_type == "Заговор":
-        if spell_name in character['magic']['spells_known']['cantrips']:
-            character['magic']['spells_known']['cantrips'].remove(spell_name)
-    else:
-        if spell_name in character['magic']['spells_known']['spells']:
-            character['magic']['spells_known']['spells'].remove(spell_name)
+    def remove_spell(character):
+        if spell_name in character['magic']['spells_known'][spell_list]:
+            character['magic']['spells_known'][spell_list].remove(spell_name)
+    
+    # Сохраняем изменения снимка событием spell_remove
+    saved = await character_storage.commit_session(message.from_user.id, character_id, remove_spell, "spell_remove")
     
-    # Сохраняем изменения
-    if character_storage.save_character(message.from_user.id, character):
+    if saved:
         await message.answer(f"{spell_type} '{spell_name}' успешно удален.")
     else:
         await message.answer("Произошла ошибка при сохранении изменений.")
@@ -347,8 +356,8 @@ async def process_remove_spell_name(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Обработчик команды /view_spells
-async def cmd_view_spells(message: types.Message, state: FSMContext):
-    characters = character_storage.get_user_characters(message.from_user.id)
+async def cmd_view_spells(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    characters = await character_storage.summaries(message.from_user.id)
     
     if not characters:
         await message.answer(MESSAGES["character_management"]["no_characters"])
@@ -365,12 +374,14 @@ async def cmd_view_spells(message: types.Message, state: FSMContext):
         "Выберите персонажа для просмотра заклинаний:",
         reply_markup=keyboard
     )
+    await remember_character_ids(state, characters)
     await state.set_state(CharacterManagement.waiting_for_view_spells_character)
 
 # Обработчик выбора персонажа для просмотра заклинаний
-async def process_view_spells_character(message: types.Message, state: FSMContext):
+async def process_view_spells_character(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
     character_name = message.text.strip()
-    character = character_storage.load_character(message.from_user.id, character_name)
+    character_id = await selected_character_id(state, character_storage, message.from_user.id, character_name)
+    character = await character_storage.load(message.from_user.id, character_id) if character_id else None
     
     if not character:
         await message.answer(
@@ -424,13 +435,13 @@ def register_spell_management_handlers(dp):
     dp.message.register(cmd_remove_spell, Command("remove_spell"))
     dp.message.register(cmd_view_spells, Command("view_spells"))
     
-    dp.message.register(process_spell_slots_character, CharacterManagement.waiting_for_spell_slots_character)
-    dp.message.register(process_spell_slots_values, CharacterManagement.waiting_for_spell_slots_values)
-    dp.message.register(process_add_spell_character, CharacterManagement.waiting_for_add_spell_character)
-    dp.message.register(process_spell_type, CharacterManagement.waiting_for_spell_type)
-    dp.message.register(process_spell_level, CharacterManagement.waiting_for_spell_level)
-    dp.message.register(process_spell_name, CharacterManagement.waiting_for_spell_name)
-    dp.message.register(process_remove_spell_character, CharacterManagement.waiting_for_remove_spell_character)
-    dp.message.register(process_remove_spell_type, CharacterManagement.waiting_for_remove_spell_type)
-    dp.message.register(process_remove_spell_name, CharacterManagement.waiting_for_remove_spell_name)
-    dp.message.register(process_view_spells_character, CharacterManagement.waiting_for_view_spells_character) 
\ No newline at end of file
+    dp.message.register(process_spell_slots_character, StateFilter(CharacterManagement.waiting_for_spell_slots_character))
+    dp.message.register(process_spell_slots_values, StateFilter(CharacterManagement.waiting_for_spell_slots_values))
+    dp.message.register(process_add_spell_character, StateFilter(CharacterManagement.waiting_for_add_spell_character))
+    dp.message.register(process_spell_type, StateFilter(CharacterManagement.waiting_for_spell_type))
+    dp.message.register(process_spell_level, StateFilter(CharacterManagement.waiting_for_spell_level))
+    dp.message.register(process_spell_name, StateFilter(CharacterManagement.waiting_for_spell_name))
+    dp.message.register(process_remove_spell_character, StateFilter(CharacterManagement.waiting_for_remove_spell_character))
+    dp.message.register(process_remove_spell_type, StateFilter(CharacterManagement.waiting_for_remove_spell_type))
+    dp.message.register(process_remove_spell_name, StateFilter(CharacterManagement.waiting_for_remove_spell_name))
+    dp.message.register(process_view_spells_character, StateFilter(CharacterManagement.waiting_for_view_spells_character)) 
\ No newline at end of file
@@ -0,0 +1,278 @@
+from aiogram import types
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+
+from config import MESSAGES, CharacterManagement
+from handlers.common import remember_character_ids, selected_character_id
+from storage.character_storage import CharacterStorage
+
+COIN_TYPES = ("platinum", "gold", "silver", "copper")
+COIN_NAMES = {
+    "platinum": "платиновых",
+    "gold": "золотых",
+    "silver": "серебряных",
+    "copper": "медных"
+}
+# Категории снаряжения, предметы которых можно передавать
+ITEM_CATEGORIES = ("weapons", "armor", "items")
+
+def format_money(money: dict) -> str:
+    """Баланс строками: только ненулевые монеты, а если денег нет - все четыре"""
+    coins = [coin for coin in COIN_TYPES if money[coin] > 0] or list(COIN_TYPES)
+    return "\n".join(f"• {money[coin]} {COIN_NAMES[coin]}" for coin in coins)
+
+def transfer_target_user(message: types.Message) -> int:
+    """Получатель перевода: участник группы, на чье сообщение ответили командой, иначе сам игрок"""
+    reply = message.reply_to_message
+    if reply and reply.from_user and not reply.from_user.is_bot and reply.from_user.id != message.from_user.id:
+        return reply.from_user.id
+    return message.from_user.id
+
+# Начало перевода: выбор персонажа-отправителя
+async def start_transfer(message: types.Message, state: FSMContext, character_storage: CharacterStorage,
+                         transfer_kind: str, prompt: str):
+    characters = await character_storage.summaries(message.from_user.id)
+    
+    if not characters:
+        await message.answer(MESSAGES["character_management"]["no_characters"])
+        return
+    
+    # Создаем клавиатуру с персонажами
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=char["name"])] for char in characters],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+    
+    await message.answer(prompt, reply_markup=keyboard)
+    await remember_character_ids(state, characters)
+    await state.update_data(transfer_kind=transfer_kind, target_user_id=transfer_target_user(message))
+    await state.set_state(CharacterManagement.waiting_for_transfer_source)
+
+# Обработчик команды /transfer_money
+async def cmd_transfer_money(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    await start_transfer(message, state, character_storage, "money", "Выберите персонажа, который отдает деньги:")
+
+# Обработчик команды /transfer_item
+async def cmd_transfer_item(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    await start_transfer(message, state, character_storage, "item", "Выберите персонажа, который отдает предмет:")
+
+# Обработчик выбора персонажа-отправителя
+async def process_transfer_source(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    source_name = message.text.strip()
+    source_id = await selected_character_id(state, character_storage, message.from_user.id, source_name)
+    
+    if not source_id:
+        await message.answer(
+            MESSAGES["common"]["invalid_input"],
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.clear()
+        return
+    
+    data = await state.get_data()
+    target_user_id = data["target_user_id"]
+    targets = [
+        char for char in await character_storage.summaries(target_user_id)
+        if not (target_user_id == message.from_user.id and char["id"] == source_id)
+    ]
+    
+    if not targets:
+        await message.answer(
+            "Нет персонажа, которому можно передать. Ответьте командой на сообщение участника группы, "
+            "чтобы передать его персонажу.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.clear()
+        return
+    
+    # Сохраняем отправителя; ID получателей запоминаем отдельно от ID отправителей
+    await state.update_data(source_id=source_id, source_name=source_name)
+    await remember_character_ids(state, targets, key="target_ids")
+    
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=char["name"])] for char in targets],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+    
+    await message.answer(
+        "Выберите персонажа-получателя:",
+        reply_markup=keyboard
+    )
+    await state.set_state(CharacterManagement.waiting_for_transfer_target)
+
+# Обработчик выбора персонажа-получателя
+async def process_transfer_target(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    target_name = message.text.strip()
+    data = await state.get_data()
+    target_user_id = data["target_user_id"]
+    target_id = await selected_character_id(state, character_storage, target_user_id, target_name, key="target_ids")
+    
+    if not target_id or (target_user_id == message.from_user.id and target_id == data["source_id"]):
+        await message.answer(
+            MESSAGES["common"]["invalid_input"],
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.clear()
+        return
+    
+    await state.update_data(target_id=target_id, target_name=target_name)
+    source = await character_storage.load_fields(message.from_user.id, data["source_id"], ("equipment",))
+    
+    if not source:
+        await message.answer(
+            MESSAGES["common"]["invalid_input"],
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.clear()
+        return
+    
+    if data["transfer_kind"] == "money":
+        await message.answer(
+            f"Введите количество монет через пробел в следующем порядке:\n"
+            f"платиновые золотые серебряные медные\n"
+            f"Например: '0 10 5 0'\n\n"
+            f"Баланс персонажа {data['source_name']}:\n"
+            f"{format_money(source['equipment']['money'])}",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.set_state(CharacterManagement.waiting_for_transfer_amount)
+        return
+    
+    # Предмет ищется по всем категориям снаряжения отправителя
+    items = {
+        item: category_key
+        for category_key in ITEM_CATEGORIES
+        for item in source["equipment"][category_key]["items"]
+    }
+    
+    if not items:
+        await message.answer(
+            f"У персонажа {data['source_name']} нет предметов.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.clear()
+        return
+    
+    await state.update_data(transfer_items=items)
+    
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=item)] for item in items],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+    
+    await message.answer(
+        "Выберите предмет для передачи:",
+        reply_markup=keyboard
+    )
+    await state.set_state(CharacterManagement.waiting_for_transfer_item)
+
+# Обработчик ввода суммы перевода
+async def process_transfer_amount(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    try:
+        # Разбиваем ввод на значения монет
+        values = message.text.strip().split()
+        if len(values) != 4:
+            await message.answer("Пожалуйста, введите 4 значения через пробел (платиновые золотые серебряные медные)")
+            return
+        
+        coins = [int(value) for value in values]
+        if any(coin < 0 for coin in coins):
+            raise ValueError
+    except ValueError:
+        await message.answer("Пожалуйста, введите положительные числа.")
+        return
+    
+    data = await state.get_data()
+    shortage = []
+    
+    def move_coins(documents):
+        source_money = documents[0]["equipment"]["money"]
+        target_money = documents[1]["equipment"]["money"]
+        # Проверка баланса внутри транзакции: между проверкой и списанием деньги не потратить
+        if any(source_money[coin] < amount for coin, amount in zip(COIN_TYPES, coins)):
+            shortage.append(True)
+            return False
+        for coin, amount in zip(COIN_TYPES, coins):
+            source_money[coin] -= amount
+            target_money[coin] += amount
+    
+    documents = await character_storage.transaction(
+        [(message.from_user.id, data["source_id"]), (data["target_user_id"], data["target_id"])],
+        move_coins, "money_transfer"
+    )
+    
+    if documents:
+        source, target = documents
+        await message.answer(
+            f"Перевод выполнен.\n\n"
+            f"Баланс персонажа {data['source_name']}:\n{format_money(source['equipment']['money'])}\n\n"
+            f"Баланс персонажа {data['target_name']}:\n{format_money(target['equipment']['money'])}"
+        )
+    elif shortage:
+        await message.answer("Недостаточно денег для совершения операции.")
+    else:
+        await message.answer("Произошла ошибка при сохранении изменений.")
+    
+    await state.clear()
+
+# Обработчик выбора предмета для передачи
+async def process_transfer_item(message: types.Message, state: FSMContext, character_storage: CharacterStorage):
+    item_name = message.text.strip()
+    data = await state.get_data()
+    category_key = data["transfer_items"].get(item_name)
+    
+    if category_key is None:
+        await message.answer(
+            MESSAGES["common"]["invalid_input"],
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.clear()
+        return
+    
+    problems = []
+    
+    def move_item(documents):
+        source_items = documents[0]["equipment"][category_key]["items"]
+        target_items = documents[1]["equipment"][category_key]["items"]
+        if item_name not in source_items:
+            problems.append(f"Предмет '{item_name}' уже не в инвентаре персонажа {data['source_name']}.")
+            return False
+        if item_name in target_items:
+            problems.append(f"Предмет '{item_name}' уже есть в инвентаре персонажа {data['target_name']}.")
+            return False
+        source_items.remove(item_name)
+        target_items.append(item_name)
+    
+    documents = await character_storage.transaction(
+        [(message.from_user.id, data["source_id"]), (data["target_user_id"], data["target_id"])],
+        move_item, "item_transfer"
+    )
+    
+    if documents:
+        await message.answer(
+            f"Предмет '{item_name}' передан от {data['source_name']} к {data['target_name']}.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+    elif problems:
+        await message.answer(problems[0], reply_markup=ReplyKeyboardRemove())
+    else:
+        await message.answer(
+            "Произошла ошибка при сохранении изменений.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+    
+    await state.clear()
+
+def register_transfer_management_handlers(dp):
+    """Регистрация всех обработчиков передачи денег и предметов между персонажами"""
+    dp.message.register(cmd_transfer_money, Command("transfer_money"))
+    dp.message.register(cmd_transfer_item, Command("transfer_item"))
+    
+    dp.message.register(process_transfer_source, StateFilter(CharacterManagement.waiting_for_transfer_source))
+    dp.message.register(process_transfer_target, StateFilter(CharacterManagement.waiting_for_transfer_target))
+    dp.message.register(process_transfer_amount, StateFilter(CharacterManagement.waiting_for_transfer_amount))
+    dp.message.register(process_transfer_item, StateFilter(CharacterManagement.waiting_for_transfer_item))
@@ -1,46 +1,26 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, BotCommand, BotCommandScopeDefault
+from typing import Dict, Any, Optional
 
-from config import BOT_TOKEN, MESSAGES
-from handlers.character_creation import register_character_creation_handlers
-from handlers.character_management import register_character_management_handlers
-from handlers.spell_management import register_spell_management_handlers
-from handlers.money_management import register_money_management_handlers
-from handlers.inventory_management import register_inventory_management_handlers
-from handlers.description_management import register_description_management_handlers
-from handlers.active_character import register_active_character_handlers
+from aiogram import Bot
+from aiogram.types import BotCommand, BotCommandScopeDefault
+
+from config import (
+    BOT_TOKEN, BOT_WORKERS, BOT_MODE, FSM_STORAGE, STORAGE_BACKEND, STORAGE_CODEC, STORAGE_SHARED,
+    STORAGE_WRITE_BEHIND, STORAGE_FLUSH_INTERVAL, STORAGE_MAX_DIRTY, STORAGE_COMPACTION_INTERVAL,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, SCHEDULER_STATS_INTERVAL
+)
+from cluster.ingress import run_cluster
+from dispatcher import create_dispatcher
+from polling import run_polling
+from scheduler import UpdateScheduler, feed_update
+from storage.character_storage import create_storage
+from storage.fsm_storage import create_fsm_storage
+from webhook import run_webhook
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-# Регистрация обработчиков
-register_character_creation_handlers(dp)
-register_character_management_handlers(dp)
-register_spell_management_handlers(dp)
-register_money_management_handlers(dp)
-register_inventory_management_handlers(dp)
-register_description_management_handlers(dp)
-register_active_character_handlers(dp)
-
-# Обработчик команды /start
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
-    await message.answer(MESSAGES["start"])
-
-# Обработчик команды /help
-@dp.message(Command("help"))
-async def cmd_help(message: Message):
-    await message.answer(MESSAGES["help"])
-
 async def set_commands(bot: Bot):
     """Установка меню команд"""
     commands = [
@@ -104,6 +84,14 @@ async def set_commands(bot: Bot):
             command="inventory",
             description="Управление инвентарем персонажа"
         ),
+        BotCommand(
+            command="transfer_money",
+            description="Передать деньги другому персонажу"
+        ),
+        BotCommand(
+            command="transfer_item",
+            description="Передать предмет другому персонажу"
+        ),
         BotCommand(
             command="set_description",
             description="Установить описание персонажа"
@@ -139,12 +127,50 @@ async def set_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands, scope=BotCommandScopeDefault())
 
-# Запуск бота
+# Запуск бота в одном процессе
+async def run_single(bot: Bot, webhook: Optional[Dict[str, Any]] = None):
+    # Одно хранилище персонажей на весь процесс: общий кэш, блокировки и пул потоков
+    character_storage = create_storage(STORAGE_BACKEND, codec=STORAGE_CODEC, shared=STORAGE_SHARED)
+    # Состояния диалогов; хранилище закрывается диспетчером при остановке
+    dp = create_dispatcher(character_storage, create_fsm_storage(FSM_STORAGE))
+    # Включаем отложенную запись персонажей, если она настроена
+    if STORAGE_WRITE_BEHIND:
+        character_storage.start_write_behind(STORAGE_FLUSH_INTERVAL, STORAGE_MAX_DIRTY)
+    # Сворачиваем журналы событий персонажей в снимки в фоне
+    character_storage.start_compaction(STORAGE_COMPACTION_INTERVAL)
+    # Обновления одного пользователя обрабатываются по очереди, разных - параллельно
+    scheduler = UpdateScheduler(lambda update: feed_update(dp, bot, update))
+    # Запускаем бота
+    try:
+        if webhook is not None:
+            await run_webhook(bot, dp, scheduler, **webhook, stats_interval=SCHEDULER_STATS_INTERVAL)
+        else:
+            await run_polling(bot, dp, scheduler, SCHEDULER_STATS_INTERVAL)
+    finally:
+        # Сбрасываем отложенные изменения и дожидаемся завершения файловых операций
+        await character_storage.shutdown()
+        logging.info("Статистика кэша персонажей: %s", character_storage.cache_stats())
+
 async def main():
+    if BOT_MODE not in ("polling", "webhook"):
+        raise ValueError(f"Неизвестный режим приема обновлений: {BOT_MODE}")
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise ValueError("В режиме webhook нужен секрет WEBHOOK_SECRET")
+    bot = Bot(token=BOT_TOKEN)
     # Устанавливаем меню команд
     await set_commands(bot)
-    # Запускаем бота
-    await dp.start_polling(bot)
+    webhook = None
+    if BOT_MODE == "webhook":
+        webhook = {"host": WEBHOOK_HOST, "port": WEBHOOK_PORT, "path": WEBHOOK_PATH,
+                   "secret": WEBHOOK_SECRET, "url": WEBHOOK_URL}
+    else:
+        # getUpdates не работает, пока установлен webhook (например, после запуска в режиме webhook)
+        await bot.delete_webhook()
+    if BOT_WORKERS > 1:
+        # Шардирование: пользователи распределяются по процессам-работникам
+        await run_cluster(bot, BOT_WORKERS, {"backend": STORAGE_BACKEND, "codec": STORAGE_CODEC}, webhook)
+    else:
+        await run_single(bot, webhook)
 
 if __name__ == "__main__":
     asyncio.run(main())
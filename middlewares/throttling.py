@@ -0,0 +1,156 @@
+"""
+Ограничение частоты сообщений: корзины токенов (token bucket) на пользователя и общая на процесс.
+
+Корзина пополняется на rate токенов в секунду до burst; команда тратит токен. Команды
+со своим лимитом (THROTTLE_COMMAND_LIMITS: например, /list_characters и /view_character,
+которые читают всех персонажей пользователя) считаются в своих корзинах, остальные команды
+пользователя - в одной общей. Ответы внутри диалога (выбор персонажа, суммы) ограничивает
+только общая корзина процесса: она считает все сообщения всех пользователей.
+
+Сообщение сверх лимита не доходит до обработчиков: пользователь один раз получает готовый
+ответ "не так быстро" (без обращения к хранилищу), следующие лишние сообщения до появления
+токена отбрасываются молча - бот не отвечает на спам спамом.
+
+Отметка "предупрежден" всегда своя у каждого пользователя: при исчерпании общей корзины
+ответ получает каждый упершийся в нее пользователь (запись (пользователь, "*") появляется
+только у них). Корзина - три числа на пару (пользователь, лимит). Корзины лежат в порядке последнего
+обращения; корзина, которая за время простоя успела бы наполниться, неотличима от новой
+и удаляется. Сверх max_buckets вытесняются самые давние.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Any, Hashable, List, Mapping, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+from config import (
+    MESSAGES, THROTTLE_RATE, THROTTLE_BURST, THROTTLE_COMMAND_LIMITS, THROTTLE_GLOBAL_RATE,
+    THROTTLE_GLOBAL_BURST, THROTTLE_MAX_BUCKETS
+)
+
+# Лимит: пополнение в секунду и емкость корзины
+Limit = Tuple[float, float]
+# Имя записи пользователя об общем лимите (только отметка "предупрежден", без токенов)
+GLOBAL_NOTICE = "*"
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """Лимиты команд из строки вида "list_characters=0.2/3,view_character=0.2/3" """
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        command, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        limits[command.strip().lstrip("/").lower()] = (float(rate), float(burst or 1))
+    return limits
+
+def message_command(message: Message) -> Optional[str]:
+    """Команда сообщения без "/" и имени бота или None"""
+    text = message.text or ""
+    if not text.startswith("/"):
+        return None
+    return text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(text) > 1 else None
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware сообщений: корзины токенов пользователей и общая корзина"""
+    
+    def __init__(self, rate: float = THROTTLE_RATE, burst: float = THROTTLE_BURST,
+                 command_limits: Optional[Mapping[str, Limit]] = None,
+                 global_rate: float = THROTTLE_GLOBAL_RATE, global_burst: float = THROTTLE_GLOBAL_BURST,
+                 max_buckets: int = THROTTLE_MAX_BUCKETS):
+        self.default = (rate, burst)
+        self.command_limits = dict(parse_limits(THROTTLE_COMMAND_LIMITS) if command_limits is None else command_limits)
+        self.max_buckets = max_buckets
+        # (пользователь, лимит) -> [токены, момент пересчета, предупрежден ли]
+        self._buckets: "OrderedDict[Hashable, List[Any]]" = OrderedDict()
+        self._global = [global_burst, time.monotonic()] if global_rate > 0 else None
+        self._global_limit = (global_rate, global_burst)
+        # Дольше этого любая корзина наполняется полностью: простоявшие столько удаляются
+        limits = [self.default, self._global_limit, *self.command_limits.values()]
+        self._idle = max((burst / rate for rate, burst in limits if rate > 0), default=0.0)
+        self._reply = MESSAGES["throttling"]["slow_down"]
+        self.allowed = 0
+        self.throttled = 0
+    
+    @staticmethod
+    def _refill(bucket: List[Any], limit: Limit, now: float):
+        rate, burst = limit
+        bucket[0] = min(burst, bucket[0] + max(0.0, now - bucket[1]) * rate)
+        bucket[1] = now
+    
+    def _bucket(self, key: Hashable, burst: float, now: float) -> List[Any]:
+        """Корзина ключа (новая - полная); заодно удаляются простоявшие корзины"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now, False]
+        else:
+            self._buckets.move_to_end(key)
+        while self._buckets:
+            oldest_key, oldest = next(iter(self._buckets.items()))
+            if oldest is bucket or (now - oldest[1] < self._idle and len(self._buckets) <= self.max_buckets):
+                break
+            del self._buckets[oldest_key]
+        return bucket
+    
+    def limit_for(self, command: str) -> Tuple[str, Limit]:
+        """Имя корзины и лимит команды"""
+        if command in self.command_limits:
+            return command, self.command_limits[command]
+        return "", self.default
+    
+    def allow(self, user_id: int, command: Optional[str] = None, now: Optional[float] = None) -> Tuple[bool, bool]:
+        """Списать токены; вернуть (пропустить ли сообщение, нужно ли ответить "не так быстро").
+        command None - сообщение не команда: учитывается только в общей корзине"""
+        now = time.monotonic() if now is None else now
+        bucket = None
+        if command is not None:
+            name, limit = self.limit_for(command)
+            if limit[0] > 0:
+                bucket = self._bucket((user_id, name), limit[1], now)
+                self._refill(bucket, limit, now)
+        if self._global is not None:
+            self._refill(self._global, self._global_limit, now)
+        if bucket is not None and bucket[0] < 1:
+            return False, self._warn(bucket)
+        if self._global is not None and self._global[0] < 1:
+            # Отметка пользователя об общем лимите; время обновляется, пока он продолжает писать
+            notice = self._bucket((user_id, GLOBAL_NOTICE), 0, now)
+            notice[1] = now
+            return False, self._warn(notice)
+        if bucket is not None:
+            bucket[0] -= 1
+            bucket[2] = False
+        if self._global is not None:
+            self._global[0] -= 1
+            notice = self._buckets.get((user_id, GLOBAL_NOTICE))
+            if notice is not None:
+                notice[2] = False
+        return True, False
+    
+    @staticmethod
+    def _warn(bucket: List[Any]) -> bool:
+        """Отвечать только на первое лишнее сообщение, пока не появится токен"""
+        warned = bucket[2]
+        bucket[2] = True
+        return not warned
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+        command = message_command(event)
+        allowed, reply = self.allow(event.from_user.id, command)
+        if allowed:
+            self.allowed += 1
+            return await handler(event, data)
+        self.throttled += 1
+        if reply:
+            logging.info("Пользователь %s превысил лимит сообщений (%s)", event.from_user.id, command or "сообщения")
+            await event.answer(self._reply)
+        return None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика ограничения частоты"""
+        return {"allowed": self.allowed, "throttled": self.throttled, "buckets": len(self._buckets)}
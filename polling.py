@@ -0,0 +1,64 @@
+"""
+Режим polling: обновления читаются длинным опросом getUpdates.
+
+Запросы идут через сессию бота (прокси, свой API-сервер, таймауты и ошибки aiogram), обновления
+передаются дальше (consume) словарями: в планировщик обновлений одного процесса или ингрессу,
+который раскладывает их по работникам. Следующий запрос подтверждает полученные обновления,
+поэтому он уходит только после того, как consume их принял: при заполненных очередях опрос
+ждет обработки. Сбои сети и API повторяются с растущей паузой; неверный токен и конфликт
+(другой getUpdates или установленный webhook) останавливают опрос.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import (
+    ClientDecodeError, TelegramAPIError, TelegramConflictError, TelegramRetryAfter, TelegramUnauthorizedError
+)
+
+from scheduler import UpdateScheduler, run_scheduled
+
+async def poll_updates(bot: Bot, consume: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+                       timeout: int = 30, allowed_updates: Optional[List[str]] = None):
+    """Длинный опрос getUpdates; завершается отменой задачи или неустранимой ошибкой API"""
+    offset: Optional[int] = None
+    # Запрос ждет ответа дольше, чем Telegram держит длинный опрос
+    request_timeout = int((bot.session.timeout or 0) + timeout)
+    delay = 1.0
+    while True:
+        try:
+            result = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                           request_timeout=request_timeout)
+        except (TelegramUnauthorizedError, TelegramConflictError) as e:
+            logging.error("Опрос getUpdates остановлен: %s", e)
+            raise
+        except TelegramRetryAfter as e:
+            logging.warning("Ограничение частоты getUpdates: повтор через %s с", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            continue
+        except (TelegramAPIError, ClientDecodeError, asyncio.TimeoutError) as e:
+            logging.error("Ошибка получения обновлений: %s", e)
+            # Повтор с растущей паузой, чтобы не засыпать API запросами при сбое
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            continue
+        delay = 1.0
+        updates = [update.model_dump(mode="json", by_alias=True, exclude_unset=True) for update in result]
+        try:
+            await consume(updates)
+        except Exception:
+            logging.exception("Ошибка передачи обновлений в обработку, опрос остановлен")
+            raise
+        if result:
+            # Подтверждение следующим запросом: обновления уже приняты
+            offset = result[-1].update_id + 1
+
+async def run_polling(bot: Bot, dp: Dispatcher, scheduler: UpdateScheduler, stats_interval: float = 0.0):
+    """Запустить бота длинным опросом в одном процессе и работать до SIGINT/SIGTERM"""
+    async def consume(updates: List[Dict[str, Any]]):
+        for update in updates:
+            await scheduler.submit(update)
+    
+    receiving = poll_updates(bot, consume, allowed_updates=dp.resolve_used_update_types())
+    await run_scheduled(bot, dp, scheduler, receiving, stats_interval)
@@ -0,0 +1,186 @@
+"""
+Планировщик обработки обновлений: порядок внутри пользователя, параллельность между пользователями.
+
+Каждое принятое обновление попадает в очередь своего пользователя (from.id события).
+Пул из workers обработчиков берет пользователей из общей очереди готовых: у пользователя
+одновременно обрабатывается не больше одного обновления, поэтому шаги диалога и пары
+"загрузить - сохранить" персонажа одного пользователя не обгоняют друг друга, а разные
+пользователи обрабатываются параллельно - не больше workers одновременно. После каждого
+обновления пользователь уходит в конец очереди готовых: пользователь с длинной очередью
+не задерживает остальных. Пустая очередь пользователя удаляется, память растет только
+с числом пользователей, у которых есть необработанные обновления.
+
+Принятых, но не обработанных обновлений не больше max_pending: при переполнении submit ждет,
+и прием (getUpdates или ответ на запрос webhook) замедляется вместе с обработкой.
+Метрики (stats): глубина очередей и время ожидания обновления до начала обработки.
+"""
+import asyncio
+import logging
+import signal
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Awaitable, Callable, Deque, Dict, Any, Hashable, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+
+from config import SCHEDULER_WORKERS, SCHEDULER_MAX_PENDING
+
+# Сколько последних времен ожидания хранится для процентилей
+WAIT_SAMPLES = 4096
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """ID пользователя, от которого пришло обновление (для событий без автора - ID чата)"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+async def feed_update(dp: Dispatcher, bot: Bot, update: Dict[str, Any]):
+    """Обработать принятое обновление; ошибка обработчика не роняет прием"""
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+
+def _percentile(values: List[float], fraction: float) -> float:
+    """Перцентиль выборки (0 для пустой)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class UpdateScheduler:
+    """Очереди обновлений по пользователям и пул обработчиков с общим ограничением параллельности"""
+    
+    def __init__(self, process: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 workers: int = SCHEDULER_WORKERS, max_pending: int = SCHEDULER_MAX_PENDING):
+        if workers < 1 or max_pending < 1:
+            raise ValueError("Нужен хотя бы один обработчик и одно место в очереди планировщика")
+        self.process = process
+        self.workers = workers
+        self.max_pending = max_pending
+        # Очереди пользователей: (момент приема, обновление); ключ есть, пока есть необработанные обновления
+        self._queues: Dict[Hashable, Deque[Tuple[float, Dict[str, Any]]]] = {}
+        # Пользователи, чье следующее обновление можно обрабатывать
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._tasks: List[asyncio.Task] = []
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.submitted = 0
+        self.processed = 0
+        self.active = 0
+        self.peak_depth = 0
+        self.peak_pending = 0
+        self.max_wait = 0.0
+    
+    def start(self, stats_interval: float = 0.0):
+        """Запустить обработчики (и периодический вывод метрик, если задан интервал)"""
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if stats_interval > 0:
+            self._tasks.append(asyncio.create_task(self._log_stats(stats_interval)))
+    
+    async def submit(self, update: Dict[str, Any]):
+        """Поставить обновление в очередь его пользователя; ждет, если очереди заполнены"""
+        await self._capacity.acquire()
+        user_id = update_user_id(update)
+        # Обновления без пользователя не упорядочиваются между собой
+        key = user_id if user_id is not None else ("update", update.get("update_id"))
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ready.put_nowait(key)
+        queue.append((time.monotonic(), update))
+        self.submitted += 1
+        self.peak_depth = max(self.peak_depth, len(queue))
+        self.peak_pending = max(self.peak_pending, self.submitted - self.processed)
+    
+    async def _work(self):
+        """Обработчик: следующее обновление следующего готового пользователя"""
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            enqueued, update = queue.popleft()
+            wait = time.monotonic() - enqueued
+            self._waits.append(wait)
+            self.max_wait = max(self.max_wait, wait)
+            self.active += 1
+            try:
+                await self.process(update)
+            except Exception:
+                logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+            finally:
+                self.active -= 1
+                self.processed += 1
+                self._capacity.release()
+                # Пользователь возвращается в конец очереди готовых, пока у него есть обновления
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+                self._ready.task_done()
+    
+    async def _log_stats(self, interval: float):
+        """Периодический вывод метрик в лог"""
+        while True:
+            await asyncio.sleep(interval)
+            logging.info("Планировщик обновлений: %s", self.stats())
+    
+    async def close(self):
+        """Дообработать принятые обновления и остановить обработчики"""
+        await self._ready.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def stats(self) -> Dict[str, Any]:
+        """Метрики: глубина очередей и время ожидания обновлений до обработки"""
+        waits = list(self._waits)
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "active": self.active,
+            "queued": self.submitted - self.processed - self.active,
+            "users_queued": len(self._queues),
+            "max_depth": max((len(queue) for queue in self._queues.values()), default=0),
+            "peak_depth": self.peak_depth,
+            "peak_pending": self.peak_pending,
+            "wait_p50_ms": _percentile(waits, 0.50) * 1e3,
+            "wait_p99_ms": _percentile(waits, 0.99) * 1e3,
+            "wait_max_ms": self.max_wait * 1e3
+        }
+
+async def run_scheduled(bot: Bot, dp: Dispatcher, scheduler: UpdateScheduler, receiving: Awaitable[Any],
+                        stats_interval: float = 0.0):
+    """Запустить диспетчер и планировщик, принимать обновления (receiving) до SIGINT/SIGTERM,
+    затем дообработать принятые и остановить диспетчер"""
+    workflow_data = {key: value for key, value in dp.workflow_data.items() if key != "bot"}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    scheduler.start(stats_interval)
+    task = asyncio.ensure_future(receiving)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+    try:
+        try:
+            with suppress(asyncio.CancelledError):
+                await task
+        finally:
+            # Новые обновления больше не принимаются (в том числе после ошибки приема): дообрабатываем принятые
+            if scheduler.submitted > scheduler.processed:
+                logging.info("Дообработка принятых обновлений: %s", scheduler.submitted - scheduler.processed)
+            await scheduler.close()
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        logging.info("Планировщик обновлений: %s", scheduler.stats())
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
@@ -1,78 +1,1321 @@
+import asyncio
+import copy
+import hashlib
 import json
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, ExitStack, contextmanager
 from pathlib import Path
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from config import STORAGE_SQLITE_PATH
+from storage import codecs, interprocess, patch
+from storage.sessions import FlowSessions
+
+# Поля персонажа, которые хранятся в манифесте пользователя
+SUMMARY_FIELDS = ("name", "race", "class_name", "level", "is_active")
 
 class CharacterStorage:
-    def __init__(self, base_dir: str = "characters"):
+    # Манифест не совпадает ни с одним файлом персонажа: в ID персонажа нет точек
+    MANIFEST_NAME = ".manifest"
+    META_NAME = ".meta"
+    # Жесткий предел окна потери данных в режиме отложенной записи, секунды
+    MAX_FLUSH_DELAY = 30.0
+    # Число полос блокировок персонажей: (user_id, character_id) -> полоса по хэшу
+    LOCK_STRIPES = 64
+    # События персонажа лежат рядом со снимком: журнал - еще не свернутые в снимок, история - свернутые
+    JOURNAL_SUFFIX = ".journal"
+    HISTORY_SUFFIX = ".history"
+    # Снимок пишется каждые SNAPSHOT_EVERY событий журнала; история хранит не больше HISTORY_LIMIT событий
+    SNAPSHOT_EVERY = 32
+    HISTORY_LIMIT = 1000
+    # Журнал намерений транзакций над несколькими персонажами (переживает сбой посреди записи)
+    TRANSACTIONS_DIR = ".transactions"
+    # Файлы межпроцессных блокировок и счетчиков изменений (общий режим)
+    LOCKS_DIR = ".locks"
+    
+    def __init__(self, base_dir: str = "characters", max_workers: int = 8, cache_size: int = 256, codec: str = "json",
+                 shared: bool = False):
         self.base_dir = Path(base_dir)
         self.base_dir.mkdir(exist_ok=True)
+        # Формат новых записей; читаются документы в любом формате
+        self.codec = codecs.get_codec(codec)
+        # Ограниченный пул потоков для файловых операций, чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="character-storage"
+        )
+        # LRU-кэш документов персонажей: (user_id, character_id) -> данные
+        self._cache: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        # Счетчик изменений: чтение с диска не попадает в кэш, если во время него была запись
+        self._cache_epoch = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Блокировка чтения-изменения-записи манифестов (повторная: перестройка идет и изнутри обновления)
+        self._manifest_lock = threading.RLock()
+        # Отложенная запись (write-behind): грязные документы ждут фонового сброса
+        self._write_behind = False
+        self._dirty: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self._dirty_since: Optional[float] = None
+        self._flush_lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_event: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.flush_interval = 5.0
+        self.max_dirty = 100
+        self.coalesced_writes = 0
+        # Полосы блокировок: потоковые защищают сравнение версий при записи,
+        # асинхронные сериализуют чтение-изменение-запись одного персонажа в обработчиках
+        self._stripes = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._async_stripes = [asyncio.Lock() for _ in range(self.LOCK_STRIPES)]
+        self.version_conflicts = 0
+        # События отложенной записи пишутся в историю вместе со своими документами
+        self._dirty_events: Dict[Tuple[int, str], List[Dict[str, Any]]] = {}
+        # Число событий в журналах: путь журнала -> счетчик (при первом обращении читается с диска)
+        self._journal_lengths: Dict[Path, int] = {}
+        self._compaction_task: Optional[asyncio.Task] = None
+        # Указатели на активного персонажа: user_id -> имя (None - не выбран)
+        self._active: Dict[int, Optional[str]] = {}
+        self._active_lock = threading.Lock()
+        # Индекс имен: user_id -> {имя: ID}, строится по кратким записям при первом обращении
+        self._name_index: Dict[int, Dict[str, str]] = {}
+        self._index_lock = threading.RLock()
+        self.transactions = 0
+        # Общий режим: с хранилищем одновременно работают несколько процессов. Изменения идут под
+        # межпроцессной блокировкой пользователя, кэши сверяются со счетчиками изменений пользователей
+        self.shared = shared
+        self._coordinator = interprocess.ProcessCoordinator(self._lock_dir()) if shared else None
+        # Поколения пользователей, которым соответствуют кэши процесса: user_id -> значение счетчика
+        self._generations: Dict[int, int] = {}
+        # Снимки персонажей незавершенных диалогов: загружаются при выборе персонажа, пишутся одним событием
+        self.sessions = FlowSessions()
+        # Транзакции, прерванные сбоем после фиксации, доводятся до конца до первого чтения
+        self._recover_transactions()
+    
+    def _get_shard_dir(self, user_id: int) -> Path:
+        """Директория пользователя в шардированной раскладке: characters/ab/cd/<user_id>"""
+        digest = hashlib.md5(str(user_id).encode()).hexdigest()
+        return self.base_dir / digest[:2] / digest[2:4] / str(user_id)
     
     def _get_user_dir(self, user_id: int) -> Path:
-        """Получить директорию пользователя"""
-        user_dir = self.base_dir / str(user_id)
-        user_dir.mkdir(exist_ok=True)
+        """Получить директорию пользователя (старая раскладка characters/<user_id> поддерживается до миграции)"""
+        user_dir = self._get_shard_dir(user_id)
+        if user_dir.is_dir():
+            return user_dir
+        legacy_dir = self.base_dir / str(user_id)
+        # Каталог с именем из двух цифр может быть каталогом шарда: старый он, только если в нем есть файлы
+        if legacy_dir.is_dir() and (
+            not self._is_shard_name(legacy_dir.name) or any(path.is_file() for path in legacy_dir.iterdir())
+        ):
+            return legacy_dir
+        user_dir.mkdir(parents=True, exist_ok=True)
         return user_dir
     
-    def _get_character_path(self, user_id: int, character_name: str) -> Path:
-        """Получить путь к файлу персонажа"""
+    @staticmethod
+    def _is_shard_name(name: str) -> bool:
+        """Имя каталога уровня шарда: две шестнадцатеричные цифры"""
+        return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
+    
+    def _iter_user_dirs(self) -> Iterator[Tuple[int, Path]]:
+        """Перебрать директории пользователей в обеих раскладках"""
+        for top_dir in sorted(self.base_dir.iterdir()):
+            if not top_dir.is_dir():
+                continue
+            # Старая раскладка: в каталоге пользователя лежат только файлы
+            if top_dir.name.isdigit() and any(path.is_file() for path in top_dir.iterdir()):
+                yield int(top_dir.name), top_dir
+            if not self._is_shard_name(top_dir.name):
+                continue
+            for middle_dir in sorted(top_dir.iterdir()):
+                if not (middle_dir.is_dir() and self._is_shard_name(middle_dir.name)):
+                    continue
+                for user_dir in sorted(middle_dir.iterdir()):
+                    if user_dir.is_dir() and user_dir.name.isdigit():
+                        yield int(user_dir.name), user_dir
+    
+    def migrate_layout(self) -> int:
+        """Перенести директории пользователей в шардированную раскладку, не останавливая бота.
+        Каталог пользователя переносится под теми же блокировками, что и запись его персонажей:
+        всеми полосами процесса, блокировкой активного персонажа и межпроцессной блокировкой
+        пользователя (в общем режиме)"""
+        migrated = 0
+        legacy_dirs = [
+            (user_id, user_dir) for user_id, user_dir in self._iter_user_dirs()
+            if user_dir.parent == self.base_dir
+        ]
+        for user_id, legacy_dir in legacy_dirs:
+            shard_dir = self._get_shard_dir(user_id)
+            shard_dir.parent.mkdir(parents=True, exist_ok=True)
+            with ExitStack() as stack:
+                # Персонажи пользователя могут попасть в любую полосу: берем все по возрастанию номера
+                for stripe in self._stripes:
+                    stack.enter_context(stripe)
+                stack.enter_context(self._user_locks([user_id]))
+                # Указатель на активного персонажа пишется без полос - под своей блокировкой
+                stack.enter_context(self._active_lock)
+                stack.enter_context(self._manifest_lock)
+                if not legacy_dir.is_dir():
+                    continue
+                has_subdirs = any(path.is_dir() for path in legacy_dir.iterdir())
+                if not shard_dir.exists() and not has_subdirs:
+                    # Переименование каталога атомарно: файлы видны либо по старому, либо по новому пути
+                    os.rename(legacy_dir, shard_dir)
+                else:
+                    # Каталог совпал с каталогом шарда или новая директория уже есть: переносим файлы
+                    shard_dir.mkdir(exist_ok=True)
+                    for file_path in legacy_dir.iterdir():
+                        if file_path.is_file() and not (shard_dir / file_path.name).exists():
+                            os.replace(file_path, shard_dir / file_path.name)
+                    if not any(legacy_dir.iterdir()):
+                        legacy_dir.rmdir()
+            migrated += 1
+        return migrated
+    
+    @staticmethod
+    def new_character_id() -> str:
+        """Новый ID персонажа: короткий UUID, не зависящий от имени"""
+        return uuid.uuid4().hex[:12]
+    
+    def _cache_get(self, key: Tuple[int, str]) -> Dict[str, Any]:
+        """Получить копию документа из кэша и обновить счетчики"""
+        self._sync_user(key[0])
+        with self._cache_lock:
+            character_data = self._cache.get(key)
+            if character_data is None:
+                self.cache_misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return copy.deepcopy(character_data)
+    
+    def _cache_put(self, key: Tuple[int, str], character_data: Dict[str, Any], epoch: int = None):
+        """Положить копию документа в кэш, вытеснив самые старые записи"""
+        if self._cache_size <= 0:
+            return
+        character_data = copy.deepcopy(character_data)
+        with self._cache_lock:
+            if epoch is not None and epoch != self._cache_epoch:
+                return
+            self._cache[key] = character_data
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+    
+    def _cache_invalidate(self, key: Tuple[int, str]):
+        """Удалить документ из кэша"""
+        with self._cache_lock:
+            self._cache_epoch += 1
+            self._cache.pop(key, None)
+    
+    def _stripe_index(self, key: Tuple[int, str]) -> int:
+        """Номер полосы блокировки для персонажа"""
+        return hash(key) % self.LOCK_STRIPES
+    
+    def _lock_dir(self) -> Path:
+        """Каталог межпроцессных блокировок"""
+        return self.base_dir / self.LOCKS_DIR
+    
+    @contextmanager
+    def _user_locks(self, user_ids: Iterable[int], changes: bool = True, recover: bool = True) -> Iterator[None]:
+        """Межпроцессная блокировка пользователей на время чтения-изменения-записи (только в общем режиме).
+        После захвата кэши пользователей сверяются со счетчиками, перед снятием счетчики увеличиваются.
+        Транзакции этих пользователей, которые упавший процесс зафиксировал, но не записал, доводятся
+        до конца до захвата: для них нужны блокировки всех участников (recover=False - внутри самого довода)"""
+        if self._coordinator is None:
+            yield
+            return
+        user_ids = sorted(set(user_ids))
+        with ExitStack() as stack:
+            while True:
+                # Полосы, которые поток уже держит, проверены при их внешнем захвате
+                fresh = [user_id for user_id in user_ids if recover and not self._coordinator.holds(user_id)]
+                for user_id in fresh:
+                    if self._coordinator.pending(user_id):
+                        self._recover_transactions(user_id)
+                outer = stack.enter_context(self._coordinator.lock(user_ids))
+                # Отметку мог оставить писатель, упавший, пока этот поток ждал блокировку
+                if not any(self._coordinator.pending(user_id) for user_id in fresh):
+                    break
+                stack.close()
+            for user_id in user_ids:
+                self._sync_user(user_id)
+            try:
+                yield
+            finally:
+                if outer and changes:
+                    for user_id in user_ids:
+                        generation = self._coordinator.bump(user_id)
+                        with self._cache_lock:
+                            # Свои изменения кэши уже отражают: их поколение сдвигается вместе со счетчиком
+                            if self._generations.get(user_id) == generation - 1:
+                                self._generations[user_id] = generation
+    
+    def _sync_user(self, user_id: int):
+        """В общем режиме сбросить кэши пользователя, если его данные изменил другой процесс"""
+        if self._coordinator is None:
+            return
+        if self._coordinator.pending(user_id) and not self._coordinator.holds(user_id):
+            # Зафиксированная транзакция еще не записана: ждем писателя или, если он упал, дописываем ее сами
+            self._recover_transactions(user_id)
+        generation = self._coordinator.generation(user_id)
+        with self._cache_lock:
+            if self._generations.get(user_id) == generation:
+                return
+            self._generations[user_id] = generation
+            self._cache_epoch += 1
+            for key in [key for key in self._cache if key[0] == user_id]:
+                del self._cache[key]
+            self._name_index.pop(user_id, None)
+            self._active.pop(user_id, None)
+    
+    @staticmethod
+    def _write_atomic(file_path: Path, data: bytes):
+        """Записать файл целиком через временный файл и переименование: читатель видит старую или новую версию"""
+        temp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+    
+    def _document_key(self, user_id: int, character_data: Dict[str, Any]) -> Tuple[int, str]:
+        """Ключ документа; новому персонажу выдается постоянный ID, имя на хранение не влияет"""
+        if not character_data.get("id"):
+            character_data["id"] = self.new_character_id()
+        return user_id, character_data["id"]
+    
+    def _stored_version(self, key: Tuple[int, str]) -> int:
+        """Текущая версия персонажа (0 для нового или старого документа без версии)"""
+        self._sync_user(key[0])
+        with self._cache_lock:
+            character_data = self._dirty.get(key)
+            if character_data is None:
+                character_data = self._cache.get(key)
+        if character_data is None:
+            character_data = self._read_fields(key[0], key[1], ("version",))
+        return (character_data or {}).get("version") or 0
+    
+    def _current_document(self, key: Tuple[int, str]) -> Optional[Dict[str, Any]]:
+        """Текущий документ персонажа без копирования: из очереди записи, кэша или хранилища"""
+        self._sync_user(key[0])
+        with self._cache_lock:
+            character_data = self._dirty.get(key)
+            if character_data is None:
+                character_data = self._cache.get(key)
+        if character_data is None:
+            character_data = self._read_document(key[0], key[1])
+        return character_data
+    
+    def _store(self, key: Tuple[int, str], character_data: Dict[str, Any], kind: str = "save"):
+        """Присвоить документу следующую версию и записать его (вызывается под блокировкой полосы).
+        Полное сохранение (kind="save") пишет снимок, изменение другого вида - только событие kind в журнал"""
+        previous = self._current_document(key)
+        character_data["version"] = ((previous or {}).get("version") or 0) + 1
+        if previous is None:
+            event = patch.make_event(character_data["version"], "create", [], None)
+        else:
+            # Полное сохранение тоже попадает в историю: как разница с прежним документом
+            ops, undo = patch.diff(previous, character_data)
+            event = patch.make_event(character_data["version"], kind, ops, undo) if ops else None
+        self._commit(key, character_data, event, snapshot=kind == "save" or previous is None or event is None)
+    
+    def _commit(self, key: Tuple[int, str], character_data: Dict[str, Any], event: Optional[Dict[str, Any]],
+                snapshot: bool):
+        """Записать новую версию документа: снимком или событием в журнал, и обновить кэш"""
+        self._index_name(key, character_data["name"])
+        if self._write_behind:
+            self._mark_dirty(key, character_data, event)
+            return
+        
+        if snapshot:
+            self._write_documents(key[0], {key[1]: character_data}, {key[1]: [event]} if event else None)
+        else:
+            self._write_patch(key[0], key[1], event, character_data)
+        
+        # Запись сквозь кэш
+        with self._cache_lock:
+            self._cache_epoch += 1
+        self._cache_put(key, character_data)
+    
+    def _summary(self, character_id: str, character_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Краткая запись о персонаже для манифеста"""
+        summary = {field: character_data.get(field) for field in SUMMARY_FIELDS}
+        summary["is_active"] = bool(summary["is_active"])
+        summary["file"] = f"{character_id}.json"
+        return summary
+    
+    def _get_manifest_path(self, user_id: int) -> Path:
+        """Получить путь к манифесту пользователя"""
+        return self._get_user_dir(user_id) / self.MANIFEST_NAME
+    
+    def _scan_summaries(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Краткие записи по самим файлам персонажей, без манифеста"""
+        entries = {}
+        for file_path in sorted(self._get_user_dir(user_id).glob("*.json")):
+            entries[file_path.stem] = self._summary(file_path.stem, self._decode_file(file_path))
+        return entries
+    
+    def _rebuild_manifest(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Построить манифест по файлам персонажей (для данных без манифеста или с устаревшим манифестом)"""
+        with self._user_locks([user_id], changes=False), self._manifest_lock:
+            entries = self._scan_summaries(user_id)
+            self._write_manifest(user_id, entries)
+        return entries
+    
+    def _read_manifest(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Прочитать манифест пользователя: character_id -> краткая запись"""
+        manifest_path = self._get_manifest_path(user_id)
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)["characters"]
+        except FileNotFoundError:
+            return self._rebuild_manifest(user_id)
+        # Снимок пишется раньше манифеста: после сбоя между ними персонажа нет в манифесте
+        # (или удаленный остался в нем), и индекс имен его не видит. Такой манифест перестраивается
+        character_ids = {name[:-5] for name in os.listdir(manifest_path.parent) if name.endswith(".json")}
+        if entries.keys() != character_ids:
+            return self._rebuild_manifest(user_id)
+        return entries
+    
+    def _write_manifest(self, user_id: int, entries: Dict[str, Dict[str, Any]]):
+        """Записать манифест пользователя"""
+        self._write_atomic(
+            self._get_manifest_path(user_id),
+            json.dumps({"characters": entries}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+    
+    def _update_manifest(self, user_id: int, changes: Dict[str, Optional[Dict[str, Any]]]):
+        """Обновить (или удалить при None) записи манифеста; файл переписывается только при изменениях"""
+        with self._manifest_lock:
+            entries = self._read_manifest(user_id)
+            changed = False
+            for character_id, summary in changes.items():
+                if summary is None:
+                    changed |= entries.pop(character_id, None) is not None
+                elif entries.get(character_id) != summary:
+                    entries[character_id] = summary
+                    changed = True
+            if changed:
+                self._write_manifest(user_id, entries)
+    
+    def _read_meta(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Прочитать метаданные пользователя (активный персонаж) или None, если их еще нет"""
+        try:
+            with open(self._get_user_dir(user_id) / self.META_NAME, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def _write_meta(self, user_id: int, meta: Dict[str, Any]):
+        """Записать метаданные пользователя"""
+        self._write_atomic(
+            self._get_user_dir(user_id) / self.META_NAME,
+            json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+    
+    @staticmethod
+    def _resolve_active(meta: Optional[Dict[str, Any]], summaries: Dict[str, Dict[str, Any]]) -> Optional[str]:
+        """ID активного персонажа по метаданным и кратким записям; без метаданных - по старому флагу is_active"""
+        if meta is None:
+            return next((character_id for character_id, summary in summaries.items() if summary.get("is_active")), None)
+        active_id = meta.get("active")
+        if active_id is not None and active_id not in summaries:
+            # Указатель, записанный до появления ID, хранит имя персонажа
+            active_id = next(
+                (character_id for character_id, summary in summaries.items() if summary["name"] == active_id), None
+            )
+        return active_id
+    
+    def _read_journal(self, file_path: Path) -> List[Dict[str, Any]]:
+        """Прочитать журнал событий, лежащий рядом со снимком (пустой, если его нет)"""
+        try:
+            with open(file_path.with_suffix(self.JOURNAL_SUFFIX), "rb") as f:
+                return patch.decode_events(f.read())
+        except FileNotFoundError:
+            return []
+    
+    def _archive_journal(self, file_path: Path, events: List[Dict[str, Any]]):
+        """Перенести журнал и новые события в историю: снимок уже записан и содержит их"""
+        journal_path = file_path.with_suffix(self.JOURNAL_SUFFIX)
+        try:
+            with open(journal_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data and not data.endswith(b"\n"):
+            data += b"\n"
+        data += b"".join(patch.encode_event(event) for event in events)
+        if data:
+            with open(file_path.with_suffix(self.HISTORY_SUFFIX), "ab") as f:
+                f.write(data)
+        journal_path.unlink(missing_ok=True)
+        self._journal_lengths.pop(journal_path, None)
+    
+    def _decode_file(self, file_path: Path) -> Dict[str, Any]:
+        """Прочитать снимок персонажа и применить к нему журнал изменений"""
+        # Журнал читается первым: свертка пишет новый снимок до удаления журнала,
+        # поэтому при любом чередовании получается согласованная версия документа
+        journal = self._read_journal(file_path)
+        with open(file_path, "rb") as f:
+            character_data = codecs.decode_document(f.read())
+        # Документы, записанные до появления ID, используют его прежнее безопасное имя файла
+        character_data.setdefault("id", file_path.stem)
+        return patch.replay(character_data, journal)
+    
+    # Примитивы хранения: бэкенды переопределяют только их, кэш и отложенная запись общие
+    
+    def _read_document(self, user_id: int, character_id: str) -> Optional[Dict[str, Any]]:
+        """Прочитать документ персонажа или None, если его нет"""
+        try:
+            return self._decode_file(self._get_user_dir(user_id) / f"{character_id}.json")
+        except FileNotFoundError:
+            return None
+    
+    def _read_fields(self, user_id: int, character_id: str, fields: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """Прочитать только указанные поля персонажа: легкие поля берутся из заголовка файла"""
+        file_path = self._get_user_dir(user_id) / f"{character_id}.json"
+        try:
+            journal = self._read_journal(file_path)
+            with open(file_path, "rb") as f:
+                head = codecs.read_head(f) if not journal else None
+                if head is not None and all(field in head for field in fields):
+                    return {field: head[field] for field in fields}
+                f.seek(0)
+                character_data = patch.replay(codecs.decode_document(f.read()), journal)
+        except FileNotFoundError:
+            return None
+        character_data.setdefault("id", character_id)
+        return {field: character_data.get(field) for field in fields}
+    
+    def _read_documents(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Прочитать все документы пользователя: character_id -> данные"""
+        documents = {}
+        for file_path in self._get_user_dir(user_id).glob("*.json"):
+            documents[file_path.stem] = self._decode_file(file_path)
+        return documents
+    
+    def _read_summaries(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Прочитать краткие записи о персонажах пользователя"""
+        return self._read_manifest(user_id)
+    
+    def _write_documents(self, user_id: int, documents: Dict[str, Dict[str, Any]],
+                         events: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        """Записать снимки документов пользователя, их события в историю и обновить индекс"""
         user_dir = self._get_user_dir(user_id)
-        # Заменяем пробелы и специальные символы на подчеркивания
-        safe_name = "".join(c if c.isalnum() else "_" for c in character_name)
-        return user_dir / f"{safe_name}.json"
+        changes = {}
+        for character_id, character_data in documents.items():
+            character_path = user_dir / f"{character_id}.json"
+            self._write_atomic(character_path, codecs.encode_document(character_data, self.codec))
+            self._archive_journal(character_path, (events or {}).get(character_id, []))
+            changes[character_id] = self._summary(character_id, character_data)
+        self._update_manifest(user_id, changes)
     
-    def save_character(self, user_id: int, character_data: Dict[str, Any]) -> bool:
-        """Сохранить персонажа в файл"""
+    def _write_patch(self, user_id: int, character_id: str, event: Dict[str, Any], character_data: Dict[str, Any]):
+        """Дописать событие в журнал персонажа; character_data - документ после события"""
+        character_path = self._get_user_dir(user_id) / f"{character_id}.json"
+        journal_path = character_path.with_suffix(self.JOURNAL_SUFFIX)
+        # В общем режиме журнал дописывают и другие процессы: счетчик в памяти не годится
+        journal_length = None if self.shared else self._journal_lengths.get(journal_path)
+        if journal_length is None:
+            journal_length = len(self._read_journal(character_path))
+        with open(journal_path, "ab") as f:
+            f.write(patch.encode_event(event))
+        self._journal_lengths[journal_path] = journal_length + 1
+        
+        if journal_length + 1 >= self.SNAPSHOT_EVERY:
+            # Чтение не должно применять больше SNAPSHOT_EVERY событий: пишем снимок
+            self._write_documents(user_id, {character_id: character_data})
+        elif any(path.split(".", 1)[0] in SUMMARY_FIELDS for _, path, _ in event["ops"]):
+            self._update_manifest(user_id, {character_id: self._summary(character_id, character_data)})
+    
+    def _read_history(self, user_id: int, character_id: str) -> List[Dict[str, Any]]:
+        """Прочитать все сохраненные события персонажа по возрастанию версии"""
+        character_path = self._get_user_dir(user_id) / f"{character_id}.json"
+        # Журнал читается первым: если его успеют свернуть, события окажутся в истории
+        events = self._read_journal(character_path)
         try:
-            character_path = self._get_character_path(user_id, character_data["name"])
+            with open(character_path.with_suffix(self.HISTORY_SUFFIX), "rb") as f:
+                events = patch.decode_events(f.read()) + events
+        except FileNotFoundError:
+            pass
+        unique = {event["v"]: event for event in events}
+        return [unique[version] for version in sorted(unique)]
+    
+    def _delete_document(self, user_id: int, character_id: str) -> bool:
+        """Удалить документ и его запись в индексе"""
+        character_path = self._get_user_dir(user_id) / f"{character_id}.json"
+        if not character_path.exists():
+            return False
+        character_path.unlink()
+        character_path.with_suffix(self.JOURNAL_SUFFIX).unlink(missing_ok=True)
+        character_path.with_suffix(self.HISTORY_SUFFIX).unlink(missing_ok=True)
+        self._update_manifest(user_id, {character_id: None})
+        return True
+    
+    def _write_transaction(self, changes: List[Tuple[Tuple[int, str], Dict[str, Any], List[Dict[str, Any]]]]):
+        """Записать документы нескольких пользователей все или ничего: сначала журнал намерений, затем снимки"""
+        log_dir = self.base_dir / self.TRANSACTIONS_DIR
+        log_dir.mkdir(exist_ok=True)
+        log_path = log_dir / f"{uuid.uuid4().hex}.json"
+        temp_path = log_path.with_suffix(f".{os.getpid()}.tmp")
+        record = [
+            {"user_id": user_id, "id": character_id, "document": character_data, "events": events}
+            for (user_id, character_id), character_data, events in changes
+        ]
+        user_ids = {entry["user_id"] for entry in record}
+        with open(temp_path, "w", encoding="utf-8") as f:
+            # dumps, а не dump: запись в файл кусками идет мимо быстрого кодировщика на C
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        if self._coordinator is not None:
+            # Отметка ставится до точки фиксации: если процесс упадет после нее, остальные процессы
+            # увидят отметку и допишут транзакцию до того, как прочитают или изменят ее участников
+            self._coordinator.set_pending(user_ids, True)
+        # Точка фиксации: после переименования транзакция будет доведена до конца даже после падения процесса
+        os.replace(temp_path, log_path)
+        self._apply_transaction(record)
+        log_path.unlink()
+        if self._coordinator is not None:
+            self._coordinator.set_pending(user_ids, False)
+    
+    def _apply_transaction(self, record: List[Dict[str, Any]]):
+        """Записать снимки из журнала намерений. Документ, чья версия в хранилище не меньше записанной
+        в журнале, пропускается: повторное применение безопасно и не откатывает более новую версию"""
+        for entry in record:
+            stored = self._read_fields(entry["user_id"], entry["id"], ("version",))
+            if stored is not None and (stored["version"] or 0) >= entry["document"]["version"]:
+                continue
+            self._write_documents(
+                entry["user_id"], {entry["id"]: entry["document"]}, {entry["id"]: entry["events"]}
+            )
+    
+    def _transaction_logs(self, slot: Optional[int] = None) -> List[Tuple[Path, List[Dict[str, Any]]]]:
+        """Зафиксированные журналы транзакций: (путь, записи); со slot - только с участниками этого счетчика"""
+        log_dir = self.base_dir / self.TRANSACTIONS_DIR
+        if not log_dir.is_dir():
+            return []
+        logs = []
+        for log_path in sorted(log_dir.glob("*.json")):
+            try:
+                with open(log_path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                continue
+            if slot is None or any(self._coordinator.slot(entry["user_id"]) == slot for entry in record):
+                logs.append((log_path, record))
+        return logs
+    
+    def _recover_transactions(self, user_id: Optional[int] = None) -> int:
+        """Довести до конца зафиксированные транзакции и отбросить незафиксированные (при запуске).
+        С user_id (общий режим) - транзакции с отметкой в счетчике пользователя: их писатель упал
+        или еще пишет документы; в последнем случае довод просто дожидается его блокировок"""
+        log_dir = self.base_dir / self.TRANSACTIONS_DIR
+        if user_id is None and log_dir.is_dir():
+            for temp_path in log_dir.glob("*.tmp"):
+                # Журнал, который еще пишет другой живой процесс, не трогаем
+                pid = temp_path.suffixes[-2][1:] if len(temp_path.suffixes) > 1 else ""
+                if self._coordinator is None or not pid.isdigit() or not interprocess.process_alive(int(pid)):
+                    temp_path.unlink(missing_ok=True)
+        slot = None if user_id is None else self._coordinator.slot(user_id)
+        recovered = 0
+        while True:
+            for log_path, record in self._transaction_logs(slot):
+                user_ids = {entry["user_id"] for entry in record}
+                # Транзакцию может прямо сейчас дописывать другой процесс: ждем его блокировок
+                with self._user_locks(user_ids, recover=False):
+                    if not log_path.exists():
+                        continue
+                    self._apply_transaction(record)
+                    log_path.unlink()
+                    if self._coordinator is not None:
+                        self._coordinator.set_pending(user_ids, False)
+                recovered += 1
+            if user_id is None:
+                return recovered
+            with self._user_locks([user_id], changes=False, recover=False):
+                # Под блокировкой живой писатель отметку не держит. Без журнала она осталась от процесса,
+                # упавшего до точки фиксации (транзакции нет) или после записи документов (она записана)
+                if not self._coordinator.pending(user_id):
+                    return recovered
+                if not self._transaction_logs(slot):
+                    self._coordinator.set_pending([user_id], False)
+                    return recovered
+            # Журнал упавшего писателя появился, пока блокировка была отпущена: доводим и его
+    
+    def iter_documents(self) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """Перебрать все документы хранилища по одному: (user_id, character_id, данные)"""
+        for user_id, user_dir in self._iter_user_dirs():
+            for file_path in sorted(user_dir.glob("*.json")):
+                yield user_id, file_path.stem, self._decode_file(file_path)
+    
+    def compact_journals(self) -> int:
+        """Свернуть все журналы событий в снимки, вернуть число свернутых журналов"""
+        compacted = 0
+        for user_id, user_dir in self._iter_user_dirs():
+            for journal_path in sorted(user_dir.glob(f"*{self.JOURNAL_SUFFIX}")):
+                key = (user_id, journal_path.stem)
+                with self._stripes[self._stripe_index(key)], self._user_locks([user_id]):
+                    character_path = journal_path.with_suffix(".json")
+                    if not journal_path.exists() or not character_path.exists():
+                        continue
+                    self._write_documents(user_id, {key[1]: self._decode_file(character_path)})
+                compacted += 1
+        return compacted
+    
+    def trim_history(self) -> int:
+        """Удалить из историй события сверх HISTORY_LIMIT, вернуть число удаленных событий"""
+        trimmed = 0
+        for user_id, user_dir in self._iter_user_dirs():
+            for history_path in sorted(user_dir.glob(f"*{self.HISTORY_SUFFIX}")):
+                key = (user_id, history_path.stem)
+                with self._stripes[self._stripe_index(key)], self._flush_lock, self._user_locks([user_id]):
+                    with open(history_path, "rb") as f:
+                        lines = f.read().splitlines(keepends=True)
+                    if len(lines) <= self.HISTORY_LIMIT:
+                        continue
+                    temp_path = history_path.with_suffix(".tmp")
+                    with open(temp_path, "wb") as f:
+                        f.writelines(lines[-self.HISTORY_LIMIT:])
+                    os.replace(temp_path, history_path)
+                trimmed += len(lines) - self.HISTORY_LIMIT
+        return trimmed
+    
+    def _pending(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Копии еще не записанных на диск документов пользователя: character_id -> данные"""
+        with self._cache_lock:
+            return {
+                character_id: copy.deepcopy(character_data)
+                for (owner_id, character_id), character_data in self._dirty.items()
+                if owner_id == user_id
+            }
+    
+    def _mark_dirty(self, key: Tuple[int, str], character_data: Dict[str, Any], event: Optional[Dict[str, Any]] = None):
+        """Поставить документ в очередь отложенной записи, объединяя повторные сохранения"""
+        now = time.monotonic()
+        with self._cache_lock:
+            self._cache_epoch += 1
+            if key in self._dirty:
+                self.coalesced_writes += 1
+            elif not self._dirty:
+                self._dirty_since = now
+            self._dirty[key] = copy.deepcopy(character_data)
+            if event is not None:
+                self._dirty_events.setdefault(key, []).append(event)
+            dirty_count = len(self._dirty)
+            dirty_since = self._dirty_since
+        self._cache_put(key, character_data)
+        
+        if now - dirty_since >= self.MAX_FLUSH_DELAY:
+            # Фоновый сброс не успевает: не даем окну потери данных превысить предел
+            self.flush()
+        elif dirty_count >= self.max_dirty and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._flush_event.set)
+    
+    def flush(self) -> int:
+        """Записать на диск все отложенные изменения, вернуть число записанных документов"""
+        with self._flush_lock:
+            with self._cache_lock:
+                dirty, self._dirty = self._dirty, {}
+                dirty_events, self._dirty_events = self._dirty_events, {}
+                self._dirty_since = None
             
+            # Группируем по пользователям: индекс каждого обновляется один раз
+            by_user: Dict[int, Dict[str, Dict[str, Any]]] = {}
+            for (user_id, character_id), character_data in dirty.items():
+                by_user.setdefault(user_id, {})[character_id] = character_data
+            
+            failed = {}
+            for user_id, documents in by_user.items():
+                events = {
+                    character_id: dirty_events.get((user_id, character_id), [])
+                    for character_id in documents
+                }
+                try:
+                    self._write_documents(user_id, documents, events)
+                except Exception as e:
+                    print(f"Ошибка при сохранении персонажа: {e}")
+                    for character_id, character_data in documents.items():
+                        failed[(user_id, character_id)] = character_data
+            
+            if failed:
+                # Возвращаем несохраненное в очередь, если его не вытеснило более новое сохранение
+                with self._cache_lock:
+                    for key, character_data in failed.items():
+                        self._dirty.setdefault(key, character_data)
+                        self._dirty_events[key] = dirty_events.get(key, []) + self._dirty_events.get(key, [])
+                    self._dirty_since = self._dirty_since or time.monotonic()
+            return len(dirty) - len(failed)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Статистика попаданий в кэш"""
+        with self._cache_lock:
+            total = self.cache_hits + self.cache_misses
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "size": len(self._cache),
+                "hit_ratio": self.cache_hits / total if total else 0.0,
+                "dirty": len(self._dirty),
+                "coalesced_writes": self.coalesced_writes,
+                "version_conflicts": self.version_conflicts,
+                "transactions": self.transactions
+            }
+    
+    def save_character(self, user_id: int, character_data: Dict[str, Any]) -> bool:
+        """Сохранить персонажа"""
+        try:
             # Добавляем ID пользователя к данным персонажа
             character_data["user_id"] = user_id
-            
-            with open(character_path, "w", encoding="utf-8") as f:
-                json.dump(character_data, f, ensure_ascii=False, indent=2)
+            key = self._document_key(user_id, character_data)
+            with self._stripes[self._stripe_index(key)], self._user_locks([user_id]):
+                self._store(key, character_data)
             return True
         except Exception as e:
             print(f"Ошибка при сохранении персонажа: {e}")
             return False
     
-    def load_character(self, user_id: int, character_name: str) -> Dict[str, Any]:
-        """Загрузить персонажа из файла"""
+    def save_character_if_version(self, user_id: int, character_data: Dict[str, Any], expected_version: int,
+                                  kind: str = "save") -> bool:
+        """Сохранить персонажа, только если его версия в хранилище равна ожидаемой (compare-and-swap)"""
         try:
-            character_path = self._get_character_path(user_id, character_name)
-            if not character_path.exists():
-                return None
+            character_data["user_id"] = user_id
+            key = self._document_key(user_id, character_data)
+            with self._stripes[self._stripe_index(key)], self._user_locks([user_id]):
+                if self._stored_version(key) != expected_version:
+                    with self._cache_lock:
+                        self.version_conflicts += 1
+                    return False
+                self._store(key, character_data, kind)
+            return True
+        except Exception as e:
+            print(f"Ошибка при сохранении персонажа: {e}")
+            return False
+    
+    def patch_character(self, user_id: int, character_id: str, ops: Sequence[Sequence[Any]],
+                        kind: str = "patch") -> Dict[str, Any]:
+        """Применить к персонажу точечные изменения полей и записать в журнал только их как событие kind"""
+        try:
+            if any(path.split(".", 1)[0] in ("id", "name", "user_id", "version") for _, path, _ in ops):
+                raise ValueError("ID, имя, владелец и версия не меняются через patch")
+            key = (user_id, character_id)
+            with self._stripes[self._stripe_index(key)], self._user_locks([user_id]):
+                character_data = self.load_character(user_id, character_id)
+                if character_data is None:
+                    return None
+                undo = patch.apply_ops(character_data, ops)
+                character_data["version"] = (character_data.get("version") or 0) + 1
+                event = patch.make_event(character_data["version"], kind, ops, undo)
+                self._commit(key, character_data, event, snapshot=False)
+                return character_data
+        except Exception as e:
+            print(f"Ошибка при изменении персонажа: {e}")
+            return None
+    
+    def rename_character(self, user_id: int, character_id: str, new_name: str) -> bool:
+        """Переименовать персонажа событием в журнале: данные не переносятся, меняется только индекс имен.
+        False, если персонажа нет или имя занято другим персонажем"""
+        try:
+            key = (user_id, character_id)
+            # Блокировка индекса не дает двум персонажам одновременно занять одно имя
+            with self._stripes[self._stripe_index(key)], self._user_locks([user_id]), self._index_lock:
+                owner_id = self._names(user_id).get(new_name)
+                if owner_id is not None and owner_id != character_id:
+                    return False
+                character_data = self.load_character(user_id, character_id)
+                if character_data is None:
+                    return False
+                old_name = character_data["name"]
+                if old_name == new_name:
+                    return True
+                character_data["name"] = new_name
+                character_data["version"] = (character_data.get("version") or 0) + 1
+                event = patch.make_event(
+                    character_data["version"], "rename", [["set", "name", new_name]], [["set", "name", old_name]]
+                )
+                self._commit(key, character_data, event, snapshot=False)
+            return True
+        except Exception as e:
+            print(f"Ошибка при переименовании персонажа: {e}")
+            return False
+    
+    def transact_characters(self, refs: Sequence[Tuple[int, str]], mutate: Callable[[List[Dict[str, Any]]], Any],
+                            kind: str = "transaction") -> Optional[List[Dict[str, Any]]]:
+        """Изменить несколько персонажей (возможно, разных пользователей) атомарно.
+        mutate меняет документы на месте в порядке refs; если он вернул False, ничего не записывается.
+        Блокировки берутся по возрастанию номера полосы, поэтому встречные транзакции не взаимоблокируются.
+        Возвращает измененные документы или None, если персонажа нет, транзакция отменена или запись не удалась"""
+        try:
+            keys = [tuple(ref) for ref in refs]
+            if len(set(keys)) != len(keys):
+                raise ValueError("персонаж указан в транзакции дважды")
+            with ExitStack() as stack:
+                for index in sorted({self._stripe_index(key) for key in keys}):
+                    stack.enter_context(self._stripes[index])
+                if self._write_behind:
+                    # Транзакция пишется сразу, мимо очереди: фоновый сброс не должен разорвать ее
+                    # по пользователям или записать поверх нее прежнюю версию документа
+                    stack.enter_context(self._flush_lock)
+                stack.enter_context(self._user_locks(key[0] for key in keys))
+                previous = [self._current_document(key) for key in keys]
+                if any(character_data is None for character_data in previous):
+                    return None
+                documents = [copy.deepcopy(character_data) for character_data in previous]
+                if mutate(documents) is False:
+                    return None
+                
+                changes = []
+                for key, old, new in zip(keys, previous, documents):
+                    ops, undo = patch.diff(old, new)
+                    if any(path.split(".", 1)[0] == "name" for _, path, _ in ops):
+                        raise ValueError("имя персонажа не меняется в транзакции")
+                    if not ops:
+                        continue
+                    new["version"] = (old.get("version") or 0) + 1
+                    with self._cache_lock:
+                        # Отложенная версия документа входит в транзакцию вместе со своими событиями
+                        self._dirty.pop(key, None)
+                        events = self._dirty_events.pop(key, [])
+                    changes.append((key, new, events + [patch.make_event(new["version"], kind, ops, undo)]))
+                if changes:
+                    self._write_transaction(changes)
+                with self._cache_lock:
+                    self._cache_epoch += 1
+                    self.transactions += 1
+                for key, character_data, _ in changes:
+                    self._cache_put(key, character_data)
+                return documents
+        except Exception as e:
+            print(f"Ошибка при выполнении транзакции: {e}")
+            return None
+    
+    def load_character(self, user_id: int, character_id: str) -> Dict[str, Any]:
+        """Загрузить персонажа"""
+        try:
+            key = (user_id, character_id)
+            # Отложенные документы всегда новее файла и не вытесняются из кэша
+            with self._cache_lock:
+                pending = self._dirty.get(key)
+                if pending is not None:
+                    self.cache_hits += 1
+                    return copy.deepcopy(pending)
             
-            with open(character_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            character_data = self._cache_get(key)
+            if character_data is not None:
+                return character_data
+            
+            with self._cache_lock:
+                epoch = self._cache_epoch
+            character_data = self._read_document(user_id, key[1])
+            if character_data is None:
+                return None
+            self._cache_put(key, character_data, epoch)
+            return character_data
         except Exception as e:
             print(f"Ошибка при загрузке персонажа: {e}")
             return None
     
+    def load_character_fields(self, user_id: int, character_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """Загрузить только указанные поля персонажа, не разбирая весь документ"""
+        try:
+            key = (user_id, character_id)
+            fields = tuple(fields)
+            self._sync_user(user_id)
+            with self._cache_lock:
+                character_data = self._dirty.get(key)
+                if character_data is None:
+                    character_data = self._cache.get(key)
+                    if character_data is not None:
+                        self._cache.move_to_end(key)
+                if character_data is not None:
+                    self.cache_hits += 1
+                    return {field: copy.deepcopy(character_data.get(field)) for field in fields}
+            
+            # Проекция не кладется в кэш: в нем хранятся только полные документы
+            return self._read_fields(user_id, key[1], fields)
+        except Exception as e:
+            print(f"Ошибка при загрузке полей персонажа: {e}")
+            return None
+    
+    def _events(self, key: Tuple[int, str]) -> List[Dict[str, Any]]:
+        """Все события персонажа, включая еще не записанные в режиме отложенной записи"""
+        events = self._read_history(key[0], key[1])
+        with self._cache_lock:
+            pending = list(self._dirty_events.get(key, []))
+        known = {event["v"] for event in events}
+        return events + [event for event in pending if event["v"] not in known]
+    
+    def character_history(self, user_id: int, character_id: str, limit: int = 20) -> list:
+        """Последние события персонажа, новые первыми"""
+        try:
+            events = self._events((user_id, character_id))
+            return events[::-1][:limit]
+        except Exception as e:
+            print(f"Ошибка при чтении истории персонажа: {e}")
+            return []
+    
+    def load_character_at(self, user_id: int, character_id: str, timestamp: float) -> Dict[str, Any]:
+        """Восстановить персонажа на момент времени, откатив более поздние события (None, если его еще не было)"""
+        try:
+            character_data = self.load_character(user_id, character_id)
+            if character_data is None:
+                return None
+            for event in reversed(self._events((user_id, character_id))):
+                if event["v"] > (character_data.get("version") or 0):
+                    continue
+                if event["t"] <= timestamp:
+                    break
+                if event["undo"] is None:
+                    return None
+                patch.apply_ops(character_data, event["undo"])
+                character_data["version"] = event["v"] - 1
+            return character_data
+        except Exception as e:
+            print(f"Ошибка при восстановлении персонажа: {e}")
+            return None
+    
     def get_user_characters(self, user_id: int) -> list:
         """Получить список всех персонажей пользователя"""
         try:
-            user_dir = self._get_user_dir(user_id)
-            characters = []
-            
-            for file_path in user_dir.glob("*.json"):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    character_data = json.load(f)
-                    characters.append(character_data)
-            
-            return characters
+            characters = self._read_documents(user_id)
+            characters.update(self._pending(user_id))
+            return list(characters.values())
         except Exception as e:
             print(f"Ошибка при получении списка персонажей: {e}")
             return []
     
-    def delete_character(self, user_id: int, character_name: str) -> bool:
+    def _merged_summaries(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Краткие записи из индекса хранилища вместе с еще не записанными документами: ID -> запись"""
+        entries = self._read_summaries(user_id)
+        for character_id, character_data in self._pending(user_id).items():
+            entries[character_id] = self._summary(character_id, character_data)
+        return entries
+    
+    def _names(self, user_id: int) -> Dict[str, str]:
+        """Индекс имен пользователя: имя -> ID (вызывается под блокировкой индекса)"""
+        self._sync_user(user_id)
+        names = self._name_index.get(user_id)
+        if names is None:
+            names = {summary["name"]: character_id for character_id, summary in self._merged_summaries(user_id).items()}
+            self._name_index[user_id] = names
+        return names
+    
+    def _index_name(self, key: Tuple[int, str], character_name: Optional[str]):
+        """Обновить индекс имен после записи (None - персонаж удален); незагруженный индекс не трогается"""
+        with self._index_lock:
+            names = self._name_index.get(key[0])
+            if names is None or (character_name is not None and names.get(character_name) == key[1]):
+                return
+            for name, character_id in list(names.items()):
+                if character_id == key[1]:
+                    del names[name]
+            if character_name is not None:
+                names[character_name] = key[1]
+    
+    def find_character_id(self, user_id: int, character_name: str) -> Optional[str]:
+        """Найти ID персонажа по имени или None"""
+        try:
+            with self._index_lock:
+                return self._names(user_id).get(character_name)
+        except Exception as e:
+            print(f"Ошибка при поиске персонажа: {e}")
+            return None
+    
+    def get_character_summaries(self, user_id: int) -> list:
+        """Получить краткие записи (ID, имя, раса, класс, уровень, активность) из манифеста"""
+        try:
+            entries = self._merged_summaries(user_id)
+            # Флаг активности берется из указателя пользователя, а не из документов
+            active_id = self.get_active_character(user_id)
+            for character_id, summary in entries.items():
+                summary["id"] = character_id
+                summary["is_active"] = character_id == active_id
+            return list(entries.values())
+        except Exception as e:
+            print(f"Ошибка при чтении манифеста персонажей: {e}")
+            return []
+    
+    def delete_character(self, user_id: int, character_id: str) -> bool:
         """Удалить персонажа"""
         try:
-            character_path = self._get_character_path(user_id, character_name)
-            if character_path.exists():
-                character_path.unlink()
-                return True
-            return False
+            key = (user_id, character_id)
+            # Блокировка сброса не дает фоновой записи воскресить удаленный документ
+            with self._stripes[self._stripe_index(key)], self._flush_lock, self._user_locks([user_id]):
+                with self._cache_lock:
+                    was_pending = self._dirty.pop(key, None) is not None
+                    self._dirty_events.pop(key, None)
+                self._cache_invalidate(key)
+                deleted = self._delete_document(user_id, key[1]) or was_pending
+                self._index_name(key, None)
+                if deleted and self.get_active_character(user_id) == character_id:
+                    self.set_active_character(user_id, None)
+            return deleted
         except Exception as e:
             print(f"Ошибка при удалении персонажа: {e}")
-            return False 
\ No newline at end of file
+            return False
+    
+    def get_active_character(self, user_id: int) -> Optional[str]:
+        """ID активного персонажа пользователя или None; после первого чтения берется из памяти"""
+        try:
+            self._sync_user(user_id)
+            if user_id in self._active:
+                return self._active[user_id]
+            # Миграция указателя пишет метаданные: под блокировкой пользователя, но без сдвига счетчика,
+            # так как результат у всех процессов одинаков
+            with self._user_locks([user_id], changes=False), self._active_lock:
+                if user_id not in self._active:
+                    meta = self._read_meta(user_id)
+                    active_id = self._resolve_active(meta, self._merged_summaries(user_id))
+                    if meta is None or meta.get("active") != active_id:
+                        # Прозрачная миграция: указатель по старым флагам is_active или по имени заменяется на ID
+                        self._write_meta(user_id, {"active": active_id})
+                    self._active[user_id] = active_id
+                return self._active[user_id]
+        except Exception as e:
+            print(f"Ошибка при чтении активного персонажа: {e}")
+            return None
+    
+    def set_active_character(self, user_id: int, character_id: Optional[str]) -> bool:
+        """Сделать персонажа активным по ID (None - сбросить выбор): одна запись метаданных пользователя"""
+        try:
+            with self._user_locks([user_id]), self._active_lock:
+                self._write_meta(user_id, {"active": character_id})
+                self._active[user_id] = character_id
+            return True
+        except Exception as e:
+            print(f"Ошибка при сохранении активного персонажа: {e}")
+            return False
+    
+    def iter_active(self) -> Iterator[Tuple[int, str]]:
+        """Перебрать указатели на активных персонажей: (user_id, ID). Только чтение: в отличие
+        от get_active_character, указатели старого вида не переписываются (миграция не меняет источник)"""
+        for user_id, _ in self._iter_user_dirs():
+            active = self._resolve_active(self._read_meta(user_id), self._scan_summaries(user_id))
+            if active:
+                yield user_id, active
+    
+    # Асинхронный API: файловые операции выполняются в пуле потоков хранилища
+    
+    async def _run(self, func, *args):
+        """Выполнить синхронную операцию хранилища вне event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    async def load(self, user_id: int, character_id: str) -> Dict[str, Any]:
+        """Асинхронно загрузить персонажа"""
+        return await self._run(self.load_character, user_id, character_id)
+    
+    async def load_fields(self, user_id: int, character_id: str, fields: Iterable[str]) -> Dict[str, Any]:
+        """Асинхронно загрузить только указанные поля персонажа"""
+        return await self._run(self.load_character_fields, user_id, character_id, fields)
+    
+    async def save(self, user_id: int, character_data: Dict[str, Any]) -> bool:
+        """Асинхронно сохранить персонажа"""
+        return await self._run(self.save_character, user_id, character_data)
+    
+    async def patch(self, user_id: int, character_id: str, ops: Sequence[Sequence[Any]],
+                    kind: str = "patch") -> Dict[str, Any]:
+        """Асинхронно применить к персонажу точечные изменения полей"""
+        return await self._run(self.patch_character, user_id, character_id, ops, kind)
+    
+    async def history(self, user_id: int, character_id: str, limit: int = 20) -> list:
+        """Асинхронно получить последние события персонажа"""
+        return await self._run(self.character_history, user_id, character_id, limit)
+    
+    async def load_at(self, user_id: int, character_id: str, timestamp: float) -> Dict[str, Any]:
+        """Асинхронно восстановить персонажа на момент времени"""
+        return await self._run(self.load_character_at, user_id, character_id, timestamp)
+    
+    async def save_if_version(self, user_id: int, character_data: Dict[str, Any], expected_version: int,
+                              kind: str = "save") -> bool:
+        """Асинхронно сохранить персонажа, если его версия не изменилась с момента загрузки"""
+        return await self._run(self.save_character_if_version, user_id, character_data, expected_version, kind)
+    
+    def lock(self, user_id: int, character_id: str) -> asyncio.Lock:
+        """Асинхронная блокировка персонажа для цепочки загрузка -> изменение -> сохранение"""
+        return self._async_stripes[self._stripe_index((user_id, character_id))]
+    
+    async def update(
+        self,
+        user_id: int,
+        character_id: str,
+        mutate: Callable[[Dict[str, Any]], Any],
+        retries: int = 5
+    ) -> Optional[Dict[str, Any]]:
+        """Загрузить, изменить (mutate меняет документ на месте) и сохранить персонажа,
+        повторяя попытку при конфликте версий; None, если персонажа нет или запись не удалась"""
+        async with self.lock(user_id, character_id):
+            for _ in range(retries):
+                character = await self.load(user_id, character_id)
+                if character is None:
+                    return None
+                expected_version = character.get("version") or 0
+                mutate(character)
+                if await self.save_if_version(user_id, character, expected_version):
+                    return character
+        return None
+    
+    async def open_session(self, user_id: int, character_id: str) -> Optional[Dict[str, Any]]:
+        """Загрузить персонажа, выбранного в диалоге, и запомнить снимок для следующих шагов"""
+        character = await self.load(user_id, character_id)
+        if character is not None:
+            self.sessions.put(user_id, character)
+        return character
+    
+    async def session(self, user_id: int, character_id: str) -> Optional[Dict[str, Any]]:
+        """Снимок персонажа из диалога (только для чтения); без снимка персонаж загружается заново"""
+        character = self.sessions.get(user_id, character_id)
+        if character is None:
+            character = await self.open_session(user_id, character_id)
+        return character
+    
+    def close_session(self, user_id: int):
+        """Забыть снимок диалога, завершенного без записи"""
+        self.sessions.pop(user_id)
+    
+    async def commit_session(
+        self,
+        user_id: int,
+        character_id: str,
+        mutate: Callable[[Dict[str, Any]], Any],
+        kind: str = "save",
+        retries: int = 5
+    ) -> Optional[Dict[str, Any]]:
+        """Завершить диалог: изменить копию снимка (mutate меняет документ на месте, False - отмена)
+        и записать одним событием kind с проверкой версии снимка. Если персонажа изменили после
+        загрузки снимка, mutate повторяется на свежем документе. None, если персонажа нет,
+        изменение отменено или запись не удалась"""
+        async with self.lock(user_id, character_id):
+            snapshot = self.sessions.pop(user_id, character_id)
+            for _ in range(retries):
+                if snapshot is None:
+                    snapshot = await self.load(user_id, character_id)
+                    if snapshot is None:
+                        return None
+                character = copy.deepcopy(snapshot)
+                if mutate(character) is False:
+                    return None
+                if not patch.diff(snapshot, character)[0]:
+                    return character
+                if await self.save_if_version(user_id, character, snapshot.get("version") or 0, kind):
+                    return character
+                snapshot = None
+        return None
+    
+    async def transaction(self, refs: Sequence[Tuple[int, str]], mutate: Callable[[List[Dict[str, Any]]], Any],
+                          kind: str = "transaction") -> Optional[List[Dict[str, Any]]]:
+        """Асинхронно изменить несколько персонажей атомарно; блокировки персонажей берутся по возрастанию полосы"""
+        async with AsyncExitStack() as stack:
+            for index in sorted({self._stripe_index(tuple(ref)) for ref in refs}):
+                await stack.enter_async_context(self._async_stripes[index])
+            return await self._run(self.transact_characters, refs, mutate, kind)
+    
+    async def get_characters(self, user_id: int) -> list:
+        """Асинхронно получить список всех персонажей пользователя"""
+        return await self._run(self.get_user_characters, user_id)
+    
+    async def summaries(self, user_id: int) -> list:
+        """Асинхронно получить краткие записи о персонажах пользователя"""
+        return await self._run(self.get_character_summaries, user_id)
+    
+    async def delete(self, user_id: int, character_id: str) -> bool:
+        """Асинхронно удалить персонажа"""
+        return await self._run(self.delete_character, user_id, character_id)
+    
+    async def rename(self, user_id: int, character_id: str, new_name: str) -> bool:
+        """Асинхронно переименовать персонажа"""
+        return await self._run(self.rename_character, user_id, character_id, new_name)
+    
+    async def find(self, user_id: int, character_name: str) -> Optional[str]:
+        """Асинхронно найти ID персонажа по имени"""
+        # Загруженный индекс читается без блокировки и пула потоков, как указатели активных персонажей;
+        # в общем режиме его сначала нужно сверить со счетчиком изменений
+        names = None if self.shared else self._name_index.get(user_id)
+        if names is not None:
+            return names.get(character_name)
+        return await self._run(self.find_character_id, user_id, character_name)
+    
+    async def get_active(self, user_id: int) -> Optional[str]:
+        """Асинхронно получить ID активного персонажа"""
+        # Указатели из памяти не удаляются (кроме общего режима), поэтому читать их можно без пула потоков
+        if not self.shared and user_id in self._active:
+            return self._active[user_id]
+        return await self._run(self.get_active_character, user_id)
+    
+    async def set_active(self, user_id: int, character_id: Optional[str]) -> bool:
+        """Асинхронно сделать персонажа активным"""
+        return await self._run(self.set_active_character, user_id, character_id)
+    
+    def start_write_behind(self, flush_interval: float = 5.0, max_dirty: int = 100):
+        """Включить отложенную запись с фоновым сбросом по интервалу или числу грязных документов"""
+        if self.shared:
+            # Отложенные документы не видны другим процессам
+            print("Отложенная запись недоступна в общем режиме хранилища, запись остается сквозной")
+            return
+        self.flush_interval = min(flush_interval, self.MAX_FLUSH_DELAY)
+        self.max_dirty = max_dirty
+        self._loop = asyncio.get_running_loop()
+        self._flush_event = asyncio.Event()
+        self._write_behind = True
+        self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """Фоновый сброс грязных документов"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self._run(self.flush)
+            except Exception as e:
+                print(f"Ошибка при сбросе отложенных изменений: {e}")
+    
+    def start_compaction(self, interval: float = 300.0):
+        """Включить фоновое сворачивание журналов в снимки и обрезку истории"""
+        self._compaction_task = asyncio.create_task(self._compaction_loop(interval))
+    
+    async def _compaction_loop(self, interval: float):
+        """Фоновое сворачивание журналов событий"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._run(self.compact_journals)
+                await self._run(self.trim_history)
+            except Exception as e:
+                print(f"Ошибка при сворачивании журналов персонажей: {e}")
+    
+    async def shutdown(self):
+        """Остановить фоновые задачи, записать отложенные изменения и остановить пул потоков"""
+        for task in (self._flush_task, self._compaction_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        self._compaction_task = None
+        self._write_behind = False
+        await self._run(self.flush)
+        await self._run(self.compact_journals)
+        self.close()
+    
+    def close(self):
+        """Дождаться завершения операций и остановить пул потоков"""
+        self._executor.shutdown(wait=True)
+        if self._coordinator is not None:
+            self._coordinator.close()
+
+def create_storage(backend: str = "files", **kwargs) -> CharacterStorage:
+    """Создать хранилище персонажей: файлы JSON (files) или база SQLite (sqlite)"""
+    if backend == "sqlite":
+        from storage.sqlite_storage import SQLiteCharacterStorage
+        return SQLiteCharacterStorage(kwargs.pop("db_path", STORAGE_SQLITE_PATH), **kwargs)
+    if backend != "files":
+        raise ValueError(f"Неизвестный тип хранилища: {backend}")
+    return CharacterStorage(**kwargs)
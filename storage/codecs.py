@@ -0,0 +1,98 @@
+"""
+Кодеки сериализации документов персонажей.
+
+Каждый файл начинается со строки-заголовка "%CMB <кодек>\n", поэтому в одном дереве
+могут лежать документы в разных форматах. Файлы без заголовка читаются как обычный JSON.
+Следом идет строка "%HEAD {...}" с легкими полями (schema.HEADER_FIELDS) в компактном
+JSON: их можно прочитать, не разбирая тело документа.
+Если установлен orjson, он используется вместо стандартного json.
+"""
+import json
+import zlib
+from typing import BinaryIO, Dict, Any, Optional, Union
+
+from storage import schema
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HEADER_PREFIX = b"%CMB "
+HEAD_PREFIX = b"%HEAD "
+
+if orjson is not None:
+    def _dumps(value: Any, pretty: bool = False) -> bytes:
+        """Сериализовать значение в JSON (orjson)"""
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if pretty else 0)
+    
+    _loads = orjson.loads
+else:
+    def _dumps(value: Any, pretty: bool = False) -> bytes:
+        """Сериализовать значение в JSON (стандартная библиотека)"""
+        if pretty:
+            return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    
+    _loads = json.loads
+
+class Codec:
+    """Формат тела документа: сериализация в байты и обратно"""
+    
+    def __init__(self, name: str, pretty: bool = False, compress: bool = False):
+        self.name = name
+        self.pretty = pretty
+        self.compress = compress
+        self.header = HEADER_PREFIX + name.encode("ascii") + b"\n"
+    
+    def encode(self, value: Dict[str, Any]) -> bytes:
+        """Сериализовать документ без заголовка"""
+        body = _dumps(value, self.pretty)
+        return zlib.compress(body) if self.compress else body
+    
+    def decode(self, body: bytes) -> Dict[str, Any]:
+        """Разобрать тело документа без заголовка"""
+        return _loads(zlib.decompress(body) if self.compress else body)
+
+CODECS = {
+    codec.name: codec
+    for codec in (
+        Codec("json-pretty", pretty=True),
+        Codec("json"),
+        Codec("json-zlib", compress=True),
+    )
+}
+
+def get_codec(name: str) -> Codec:
+    """Найти кодек по имени"""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный кодек: {name}") from None
+
+def encode_document(character: Dict[str, Any], codec: Codec) -> bytes:
+    """Сериализовать персонажа в нормализованной схеме с заголовком формата и легких полей"""
+    head = _dumps({field: character.get(field) for field in schema.HEADER_FIELDS})
+    return codec.header + HEAD_PREFIX + head + b"\n" + codec.encode(schema.normalize(character))
+
+def decode_document(data: Union[bytes, str]) -> Dict[str, Any]:
+    """Разобрать документ персонажа в любом формате: по заголовку или как обычный JSON"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data.startswith(HEADER_PREFIX):
+        header_end = data.index(b"\n")
+        codec = get_codec(data[len(HEADER_PREFIX):header_end].decode("ascii"))
+        body_start = header_end + 1
+        if data.startswith(HEAD_PREFIX, body_start):
+            body_start = data.index(b"\n", body_start) + 1
+        return schema.denormalize(codec.decode(data[body_start:]))
+    return schema.denormalize(_loads(data))
+
+def read_head(f: BinaryIO) -> Optional[Dict[str, Any]]:
+    """Прочитать из начала файла только легкие поля; None, если заголовка нет (старый формат)"""
+    if not f.readline().startswith(HEADER_PREFIX):
+        return None
+    line = f.readline()
+    if not line.startswith(HEAD_PREFIX):
+        return None
+    return _loads(line[len(HEAD_PREFIX):])
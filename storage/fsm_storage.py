@@ -0,0 +1,235 @@
+"""
+Состояния диалогов (FSM aiogram) в SQLite с ограниченным сроком жизни.
+
+Запись - состояние и данные диалога одного ключа (бот, чат, пользователь) и момент истечения.
+Срок отсчитывается от последней записи: общий ttl или свой для состояния (state_ttls), поэтому
+брошенный на середине диалог живет не дольше своего срока. Просроченная запись перестает
+читаться сразу, а из базы ее удаляет фоновый уборщик. Запись без состояния и данных
+(диалог завершен через state.clear()) удаляется немедленно.
+
+Перед базой - LRU-кэш ограниченного размера, в том числе для отсутствующих записей:
+у большинства пользователей диалога нет, и проверка их состояния на каждом обновлении
+не ходит в базу. Память процесса не растет вместе с числом пользователей.
+Кэш рассчитан на то, что пользователя обслуживает один процесс (один бот или режим шардирования).
+
+Кэш - источник истины: изменения сразу попадают в него, а в базу уходят пачкой одной
+транзакцией на итерацию event loop (set_state и update_data одного шага диалога - одна запись).
+Операции с базой выполняются в отдельном потоке по порядку поступления, поэтому пачка,
+ушедшая раньше, не перезапишет более позднюю, а чтение не обгонит запись.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_SQLITE_PATH, FSM_TTL, FSM_CACHE_SIZE, FSM_SWEEP_INTERVAL
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_states_expires ON fsm_states (expires);
+"""
+
+SELECT_ENTRY = "SELECT state, data, expires FROM fsm_states WHERE key = ?"
+UPSERT_ENTRY = (
+    "INSERT INTO fsm_states (key, state, data, expires) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, expires = excluded.expires"
+)
+DELETE_ENTRY = "DELETE FROM fsm_states WHERE key = ?"
+DELETE_EXPIRED = "DELETE FROM fsm_states WHERE expires <= ?"
+
+# Запись кэша: состояние, данные, момент истечения
+Entry = Tuple[Optional[str], Dict[str, Any], float]
+EMPTY: Entry = (None, {}, float("inf"))
+
+class SQLiteFSMStorage(BaseStorage):
+    """Хранилище FSM в SQLite со сроком жизни записей, фоновым уборщиком и LRU-кэшем"""
+    
+    def __init__(self, db_path: str = "fsm.db", ttl: float = 86400.0, state_ttls: Optional[Mapping[str, float]] = None,
+                 cache_size: int = 1024, key_builder: Optional[KeyBuilder] = None):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.state_ttls = dict(state_ttls or {})
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._cache: "OrderedDict[str, Entry]" = OrderedDict()
+        # Один поток и одно соединение: операции с базой идут строго по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+        self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        # Изменения, еще не отправленные в базу
+        self._pending: Dict[str, Entry] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.swept = 0
+    
+    def _expires(self, state: Optional[str]) -> float:
+        """Момент истечения записи с указанным состоянием"""
+        return time.time() + self.state_ttls.get(state, self.ttl)
+    
+    async def _run(self, func, *args):
+        """Выполнить операцию с базой в потоке хранилища"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    def _read(self, key: str) -> Entry:
+        """Прочитать запись из базы"""
+        row = self._connection.execute(SELECT_ENTRY, (key,)).fetchone()
+        if row is None:
+            return EMPTY
+        return row[0], json.loads(row[1]), row[2]
+    
+    def _write(self, entries: Dict[str, Entry]):
+        """Записать пачку изменений одной транзакцией; пустые записи удаляются"""
+        deleted = [(key,) for key, (state, data, _) in entries.items() if state is None and not data]
+        stored = [
+            (key, state, json.dumps(data, ensure_ascii=False), expires)
+            for key, (state, data, expires) in entries.items()
+            if state is not None or data
+        ]
+        with self._connection:
+            self._connection.executemany(DELETE_ENTRY, deleted)
+            self._connection.executemany(UPSERT_ENTRY, stored)
+    
+    async def _flush(self):
+        """Отправить в базу изменения, накопленные за итерацию event loop"""
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        try:
+            await self._run(self._write, pending)
+        except Exception as e:
+            print(f"Ошибка при записи состояний FSM: {e}")
+    
+    def _remember(self, key: str, entry: Entry):
+        """Положить запись в кэш, вытеснив самые давние сверх размера"""
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    async def _entry(self, key: str) -> Entry:
+        """Действующая запись ключа: из кэша или из базы; просроченная считается пустой"""
+        entry = self._cache.get(key)
+        if entry is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+        elif key in self._pending:
+            # Вытеснена из кэша, но еще не записана в базу
+            self.cache_hits += 1
+            entry = self._pending[key]
+            self._remember(key, entry)
+        else:
+            self.cache_misses += 1
+            entry = await self._run(self._read, key)
+            # Пока шло чтение, запись могла появиться в кэше: она новее прочитанной
+            entry = self._cache.get(key, entry)
+            self._remember(key, entry)
+        if entry[2] <= time.time():
+            self._remember(key, EMPTY)
+            return EMPTY
+        return entry
+    
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        """Обновить запись в кэше сразу, в базе - со следующей пачкой"""
+        entry = (state, data, self._expires(state)) if state is not None or data else EMPTY
+        self._remember(key, entry)
+        self._pending[key] = entry
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data, _ = await self._entry(storage_key)
+        self._store(storage_key, state.state if isinstance(state, State) else state, data)
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(self.key_builder.build(key)))[0]
+    
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Данные FSM должны быть словарем, получено {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        state, _, _ = await self._entry(storage_key)
+        self._store(storage_key, state, data.copy())
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(self.key_builder.build(key)))[1].copy()
+    
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удалить записи, просроченные к моменту now (по умолчанию - сейчас); вернуть их число"""
+        with self._connection:
+            removed = self._connection.execute(DELETE_EXPIRED, (time.time() if now is None else now,)).rowcount
+        self.swept += removed
+        return removed
+    
+    def start_sweeper(self, interval: float = 600.0):
+        """Включить фоновое удаление просроченных записей"""
+        self._sweep_task = asyncio.create_task(self._sweep_loop(interval))
+    
+    async def _sweep_loop(self, interval: float):
+        """Фоновое удаление просроченных записей из базы и кэша"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._run(self.sweep)
+                now = time.time()
+                for key in [key for key, entry in self._cache.items() if entry[2] <= now]:
+                    del self._cache[key]
+            except Exception as e:
+                print(f"Ошибка при удалении просроченных состояний FSM: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша и уборщика"""
+        total = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self._cache),
+            "hit_ratio": self.cache_hits / total if total else 0.0,
+            "swept": self.swept
+        }
+    
+    async def close(self) -> None:
+        """Остановить уборщика, записать накопленные изменения и закрыть соединение"""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._pending:
+            await self._run(self._write, self._pending)
+            self._pending = {}
+        await self._run(self._connection.close)
+        self._executor.shutdown(wait=True)
+
+def create_fsm_storage(backend: str = "memory") -> BaseStorage:
+    """Создать хранилище FSM: в памяти (memory) или в SQLite (sqlite).
+    Вызывается внутри event loop: для SQLite сразу запускается уборщик просроченных записей"""
+    if backend == "memory":
+        return MemoryStorage()
+    if backend != "sqlite":
+        raise ValueError(f"Неизвестный тип хранилища FSM: {backend}")
+    storage = SQLiteFSMStorage(FSM_SQLITE_PATH, ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE)
+    storage.start_sweeper(FSM_SWEEP_INTERVAL)
+    return storage
@@ -0,0 +1,128 @@
+"""
+Координация нескольких процессов бота над одним хранилищем.
+
+Блокировки - flock на файлах полос в каталоге блокировок: пользователь попадает в полосу
+user_id % LOCK_STRIPES, полосы берутся по возрастанию номера, поэтому процессы не взаимоблокируются.
+flock привязан к открытому файлу, а не к процессу, и исключает также потоки одного процесса;
+повторный захват уже взятой полосы тем же потоком не блокирует.
+
+Поколения - счетчики изменений пользователей в общем файле, отображенном в память каждого
+процесса (mmap). Писатель увеличивает счетчик пользователя перед снятием блокировки, читатель
+сравнивает его со своим последним значением и при расхождении сбрасывает кэши пользователя.
+Проверка - чтение разделяемой памяти, без системных вызовов.
+
+Старший бит счетчика - отметка незаписанной транзакции: писатель ставит ее пользователям
+транзакции до точки фиксации и снимает, когда все документы записаны. Если писатель упал
+между этими моментами, отметка остается, и процесс, который первым обратится к пользователю,
+доводит транзакцию до конца по журналу, не дожидаясь перезапуска.
+"""
+import mmap
+import os
+import struct
+import threading
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, Set
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_STRIPES = 64
+# Кратно LOCK_STRIPES: пользователи одного слота всегда попадают в одну полосу блокировок,
+# поэтому увеличение счетчика слота защищено блокировкой
+GENERATION_SLOTS = 4096
+GENERATIONS_NAME = "generations"
+SLOT = struct.Struct("<Q")
+# Отметка незаписанной транзакции в счетчике пользователя; увеличение счетчика ее не затрагивает
+PENDING = 1 << 63
+
+def process_alive(pid: int) -> bool:
+    """Жив ли процесс с указанным PID"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ProcessCoordinator:
+    """Межпроцессные блокировки пользователей и счетчики их изменений"""
+    
+    def __init__(self, lock_dir: Path):
+        if fcntl is None:
+            raise RuntimeError("Межпроцессный режим хранилища требует fcntl (Linux, macOS)")
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        fd = os.open(self.lock_dir / GENERATIONS_NAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Файл счетчиков создает первый процесс; остальные ждут, пока он получит нужный размер
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size < GENERATION_SLOTS * SLOT.size:
+                os.ftruncate(fd, GENERATION_SLOTS * SLOT.size)
+            self._generations = mmap.mmap(fd, GENERATION_SLOTS * SLOT.size)
+            # mmap держит копию дескриптора: без явного снятия блокировка жила бы вместе с отображением
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    
+    def _held(self) -> Set[int]:
+        """Полосы, которые держит текущий поток"""
+        held = getattr(self._local, "held", None)
+        if held is None:
+            held = self._local.held = set()
+        return held
+    
+    @contextmanager
+    def lock(self, user_ids: Iterable[int]) -> Iterator[bool]:
+        """Захватить полосы пользователей по возрастанию номера. Возвращает True, если захват внешний
+        (полосы не были взяты этим потоком раньше)"""
+        held = self._held()
+        stripes = sorted({user_id % LOCK_STRIPES for user_id in user_ids} - held)
+        with ExitStack() as stack:
+            for index in stripes:
+                fd = os.open(self.lock_dir / f"{index}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+                # Закрытие дескриптора снимает flock
+                stack.callback(os.close, fd)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                held.add(index)
+                stack.callback(held.discard, index)
+            yield bool(stripes)
+    
+    def holds(self, user_id: int) -> bool:
+        """Держит ли текущий поток полосу пользователя"""
+        return user_id % LOCK_STRIPES in self._held()
+    
+    @staticmethod
+    def slot(user_id: int) -> int:
+        """Номер счетчика пользователя (общий у пользователей с одинаковым остатком, они же в одной полосе)"""
+        return user_id % GENERATION_SLOTS
+    
+    def generation(self, user_id: int) -> int:
+        """Текущее значение счетчика изменений пользователя"""
+        return SLOT.unpack_from(self._generations, user_id % GENERATION_SLOTS * SLOT.size)[0]
+    
+    def bump(self, user_id: int) -> int:
+        """Увеличить счетчик изменений пользователя (вызывается под его блокировкой), вернуть новое значение"""
+        offset = user_id % GENERATION_SLOTS * SLOT.size
+        generation = SLOT.unpack_from(self._generations, offset)[0] + 1
+        SLOT.pack_into(self._generations, offset, generation)
+        return generation
+    
+    def pending(self, user_id: int) -> bool:
+        """Есть ли у пользователя (его счетчика) зафиксированная, но, возможно, не записанная транзакция"""
+        return bool(self.generation(user_id) & PENDING)
+    
+    def set_pending(self, user_ids: Iterable[int], pending: bool):
+        """Поставить или снять отметку незаписанной транзакции (вызывается под блокировкой пользователей)"""
+        for slot in {self.slot(user_id) for user_id in user_ids}:
+            offset = slot * SLOT.size
+            value = SLOT.unpack_from(self._generations, offset)[0]
+            SLOT.pack_into(self._generations, offset, value | PENDING if pending else value & ~PENDING)
+    
+    def close(self):
+        """Освободить отображение файла счетчиков"""
+        self._generations.close()
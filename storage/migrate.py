@@ -0,0 +1,68 @@
+"""
+Миграции хранилища персонажей.
+
+Перенос дерева JSON-файлов в базу SQLite (файлы читаются потоково, по одному) вместе с историей
+событий и указателями активных персонажей; исходные файлы не изменяются:
+    python -m storage.migrate sqlite --source characters --db characters.db
+
+Перенос каталогов пользователей в шардированную раскладку characters/ab/cd/<user_id>
+(пока каталог не перенесен, он читается по старому пути):
+    python -m storage.migrate shard --source characters
+Каталог переносится под межпроцессной блокировкой пользователя, поэтому боты могут продолжать
+работу, только если они запущены в общем режиме хранилища (STORAGE_SHARED=true или BOT_WORKERS > 1):
+только такие процессы берут эту блокировку при записи. Бот в обычном режиме на время миграции
+нужно остановить - иначе запись в переносимый каталог может потеряться.
+"""
+import argparse
+import time
+
+from storage.character_storage import CharacterStorage
+from storage.sqlite_storage import SQLiteCharacterStorage
+
+def migrate_to_sqlite(source_dir: str, db_path: str, batch_size: int = 500) -> int:
+    """Перенести всех персонажей из дерева файлов в базу SQLite вместе с их событиями, вернуть их число"""
+    source = CharacterStorage(source_dir, max_workers=1, cache_size=0)
+    target = SQLiteCharacterStorage(db_path, max_workers=1, cache_size=0)
+    try:
+        # История и журнал персонажа переносятся вместе с документом: history() и load_character_at
+        # после миграции видят события, записанные до нее
+        migrated = target.import_documents(source.iter_documents(), batch_size=batch_size, history=source._read_history)
+        for user_id, character_id in source.iter_active():
+            target.set_active_character(user_id, character_id)
+        return migrated
+    finally:
+        source.close()
+        target.close()
+
+def migrate_to_shards(source_dir: str) -> int:
+    """Перенести каталоги пользователей в шардированную раскладку, вернуть их число.
+    Хранилище открывается в общем режиме: перенос ждет записи ботов, работающих в общем режиме"""
+    storage = CharacterStorage(source_dir, max_workers=1, cache_size=0, shared=True)
+    try:
+        return storage.migrate_layout()
+    finally:
+        storage.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    sqlite_parser = commands.add_parser("sqlite", help="перенести JSON-файлы в SQLite")
+    sqlite_parser.add_argument("--source", default="characters", help="каталог с персонажами")
+    sqlite_parser.add_argument("--db", default="characters.db", help="путь к базе SQLite")
+    sqlite_parser.add_argument("--batch-size", type=int, default=500, help="строк в одной транзакции")
+    
+    shard_parser = commands.add_parser("shard", help="перенести каталоги пользователей в шарды")
+    shard_parser.add_argument("--source", default="characters", help="каталог с персонажами")
+    
+    args = parser.parse_args()
+    started = time.perf_counter()
+    if args.command == "sqlite":
+        migrated = migrate_to_sqlite(args.source, args.db, args.batch_size)
+        print(f"Перенесено персонажей: {migrated} за {time.perf_counter() - started:.1f} с")
+    elif args.command == "shard":
+        migrated = migrate_to_shards(args.source)
+        print(f"Перенесено каталогов пользователей: {migrated} за {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
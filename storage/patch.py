@@ -0,0 +1,126 @@
+"""
+Точечные изменения и события персонажей.
+
+Операция - кортеж (операция, путь, значение), путь - ключи через точку:
+    ("set", "description", "Текст")
+    ("delete", "description", None)
+    ("inc", "equipment.money.gold", -5)
+    ("append", "equipment.weapons.items", "Кинжал")
+    ("insert", "magic.spells_known.spells", [2, "Полет (3 уровень)"])
+    ("remove", "magic.spells_known.cantrips", "Свет")
+    ("pop", "equipment.weapons.items", 2)
+
+remove удаляет первый равный элемент, pop - элемент по индексу. Обратные операции
+к append и insert - pop по индексу, куда элемент попал: при повторяющихся элементах
+(два одинаковых предмета) удаляется именно добавленный.
+
+Событие - одна строка журнала или истории персонажа:
+    {"v": версия, "t": время, "e": вид, "ops": [...], "undo": [...]}
+где undo - обратные операции, по которым из нового состояния получается прежнее.
+"""
+import json
+import time
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+OPERATIONS = ("set", "delete", "inc", "append", "insert", "remove", "pop")
+
+# Служебные поля документа не попадают в события
+SERVICE_FIELDS = ("id", "user_id", "version")
+
+_MISSING = object()
+
+def _parent(document: Dict[str, Any], path: str):
+    """Найти словарь, в котором лежит последний ключ пути"""
+    keys = path.split(".")
+    parent = document
+    for key in keys[:-1]:
+        parent = parent[key]
+    if not isinstance(parent, dict):
+        raise ValueError(f"Путь {path} не ведет к полю документа")
+    return parent, keys[-1]
+
+def apply_ops(document: Dict[str, Any], ops: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    """Применить операции к документу на месте, вернуть обратные операции"""
+    undo = []
+    for operation, path, value in ops:
+        if operation not in OPERATIONS:
+            raise ValueError(f"Неизвестная операция: {operation}")
+        parent, key = _parent(document, path)
+        if operation == "set":
+            previous = parent.get(key, _MISSING)
+            undo.append(["delete", path, None] if previous is _MISSING else ["set", path, previous])
+            parent[key] = value
+        elif operation == "delete":
+            if key in parent:
+                undo.append(["set", path, parent.pop(key)])
+        elif operation == "inc":
+            parent[key] += value
+            undo.append(["inc", path, -value])
+        elif operation == "append":
+            parent[key].append(value)
+            undo.append(["pop", path, len(parent[key]) - 1])
+        elif operation == "insert":
+            index, item = value
+            items = parent[key]
+            # Индекс, куда элемент попадет на самом деле (insert ограничивает индекс границами списка)
+            position = min(index if index >= 0 else max(0, len(items) + index), len(items))
+            items.insert(position, item)
+            undo.append(["pop", path, position])
+        elif operation == "pop":
+            undo.append(["insert", path, [value, parent[key].pop(value)]])
+        else:
+            index = parent[key].index(value)
+            del parent[key][index]
+            undo.append(["insert", path, [index, value]])
+    # Обратные операции применяются в обратном порядке
+    undo.reverse()
+    return undo
+
+def diff(old: Dict[str, Any], new: Dict[str, Any], prefix: str = "") -> Tuple[List[List[Any]], List[List[Any]]]:
+    """Операции, переводящие old в new, и обратные к ним (списки сравниваются целиком)"""
+    ops, undo = [], []
+    for key in new.keys() | old.keys():
+        if not prefix and key in SERVICE_FIELDS:
+            continue
+        path = f"{prefix}{key}"
+        old_value = old.get(key, _MISSING)
+        new_value = new.get(key, _MISSING)
+        if old_value == new_value:
+            continue
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            nested_ops, nested_undo = diff(old_value, new_value, f"{path}.")
+            ops.extend(nested_ops)
+            undo.extend(nested_undo)
+        elif new_value is _MISSING:
+            ops.append(["delete", path, None])
+            undo.append(["set", path, old_value])
+        else:
+            ops.append(["set", path, new_value])
+            undo.append(["delete", path, None] if old_value is _MISSING else ["set", path, old_value])
+    return ops, undo
+
+def make_event(version: int, kind: str, ops: Sequence[Sequence[Any]], undo: Optional[List[List[Any]]]) -> Dict[str, Any]:
+    """Событие изменения персонажа"""
+    return {"v": version, "t": int(time.time()), "e": kind, "ops": [list(op) for op in ops], "undo": undo}
+
+def replay(document: Dict[str, Any], events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Применить к снимку события журнала, которых в нем еще нет (по номеру версии)"""
+    for event in events:
+        if event["v"] > (document.get("version") or 0):
+            apply_ops(document, event["ops"])
+            document["version"] = event["v"]
+    return document
+
+def encode_event(event: Dict[str, Any]) -> bytes:
+    """Строка журнала для одного события"""
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+def decode_events(data: bytes) -> List[Dict[str, Any]]:
+    """Разобрать журнал событий; недописанные строки (обрыв записи) пропускаются"""
+    events = []
+    for line in data.splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events
@@ -0,0 +1,68 @@
+"""
+Нормализованная схема хранения персонажей.
+
+На диск попадают только значения: статические подписи разделов (name, description,
+skills) из CHARACTER_STATS удаляются при записи и восстанавливаются при загрузке.
+Документы старого формата (без поля schema) читаются как есть и переписываются
+в новом формате при следующем сохранении.
+"""
+from typing import Dict, Any
+
+from character_stats import CHARACTER_STATS
+
+SCHEMA_VERSION = 2
+
+# Поля шаблона, одинаковые у всех персонажей
+STATIC_KEYS = ("name", "description", "skills")
+
+# Легкие поля персонажа: пишутся в заголовок документа и читаются без разбора тела
+HEADER_FIELDS = ("name", "race", "class_name", "level", "is_active", "version")
+
+# Раздел -> запись -> статические поля, например abilities -> strength -> {"name": "Сила", ...}
+STATIC_METADATA = {
+    section: {
+        entry_key: {key: entry[key] for key in STATIC_KEYS if key in entry}
+        for entry_key, entry in entries.items()
+    }
+    for section, entries in CHARACTER_STATS.items()
+}
+
+_MISSING = object()
+
+def normalize(character: Dict[str, Any]) -> Dict[str, Any]:
+    """Убрать из документа статические поля, совпадающие с шаблоном"""
+    stored = {"schema": SCHEMA_VERSION}
+    for key, value in character.items():
+        static_section = STATIC_METADATA.get(key)
+        if static_section is None or not isinstance(value, dict):
+            stored[key] = value
+            continue
+        
+        section = {}
+        for entry_key, entry in value.items():
+            static = static_section.get(entry_key)
+            if static and isinstance(entry, dict):
+                # Измененные пользователем подписи сохраняются как есть
+                entry = {k: v for k, v in entry.items() if static.get(k, _MISSING) != v}
+            section[entry_key] = entry
+        stored[key] = section
+    return stored
+
+def denormalize(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """Восстановить полный документ персонажа из нормализованного"""
+    if stored.get("schema") != SCHEMA_VERSION:
+        return stored
+    
+    character = {}
+    for key, value in stored.items():
+        if key == "schema":
+            continue
+        static_section = STATIC_METADATA.get(key)
+        if static_section is not None and isinstance(value, dict):
+            value = {
+                entry_key: {**static_section[entry_key], **entry}
+                if entry_key in static_section and isinstance(entry, dict) else entry
+                for entry_key, entry in value.items()
+            }
+        character[key] = value
+    return character
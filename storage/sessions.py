@@ -0,0 +1,68 @@
+"""
+Снимки персонажей на время многошагового диалога.
+
+Персонаж загружается один раз - когда его выбирают в диалоге; следующие шаги читают снимок,
+а не хранилище. Завершающий шаг записывает изменения снимка одним событием с проверкой версии
+(CharacterStorage.commit_session): если персонажа за время диалога изменили, изменение повторяется
+на свежем документе.
+
+Снимки живут в памяти процесса, по одному на пользователя (у пользователя один диалог),
+в LRU ограниченного размера. Снимок брошенного диалога вытесняется новыми; если снимка
+нет (вытеснен или бот перезапущен, а состояние диалога сохранилось в SQLite), персонаж
+загружается заново. Снимок только для чтения: изменения делаются на копии при записи.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from config import FLOW_SESSION_SIZE
+
+class FlowSessions:
+    """LRU снимков персонажей: user_id -> документ персонажа текущего диалога"""
+    
+    def __init__(self, size: int = FLOW_SESSION_SIZE):
+        self.size = size
+        self._snapshots: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def put(self, user_id: int, character_data: Dict[str, Any]):
+        """Запомнить снимок диалога пользователя, заменив прежний"""
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._snapshots[user_id] = character_data
+            self._snapshots.move_to_end(user_id)
+            while len(self._snapshots) > self.size:
+                self._snapshots.popitem(last=False)
+    
+    def get(self, user_id: int, character_id: str) -> Optional[Dict[str, Any]]:
+        """Снимок персонажа из диалога пользователя или None"""
+        with self._lock:
+            character_data = self._snapshots.get(user_id)
+            if character_data is None or character_data.get("id") != character_id:
+                self.misses += 1
+                return None
+            self._snapshots.move_to_end(user_id)
+            self.hits += 1
+            return character_data
+    
+    def pop(self, user_id: int, character_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Закрыть диалог пользователя; вернуть снимок, если он относится к character_id (или любой при None)"""
+        with self._lock:
+            character_data = self._snapshots.pop(user_id, None)
+        if character_data is not None and character_id is not None and character_data.get("id") != character_id:
+            return None
+        return character_data
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика снимков"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._snapshots),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
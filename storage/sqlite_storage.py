@@ -0,0 +1,305 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from storage import codecs, schema
+from storage.character_storage import CharacterStorage, SUMMARY_FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    user_id INTEGER NOT NULL,
+    character_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    race TEXT,
+    class_name TEXT,
+    level INTEGER,
+    is_active INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, character_id)
+);
+CREATE INDEX IF NOT EXISTS idx_characters_user_name ON characters (user_id, name);
+CREATE INDEX IF NOT EXISTS idx_characters_user_active ON characters (user_id, is_active);
+CREATE TABLE IF NOT EXISTS character_events (
+    user_id INTEGER NOT NULL,
+    character_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_character_events ON character_events (user_id, character_id, version);
+CREATE TABLE IF NOT EXISTS user_meta (
+    user_id INTEGER PRIMARY KEY,
+    active TEXT
+);
+"""
+
+# Базы, созданные до появления версий документов
+ADD_VERSION_COLUMN = "ALTER TABLE characters ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+# Базы, где персонажи хранились под безопасным именем: оно становится ID персонажа
+RENAME_KEY_COLUMN = "ALTER TABLE {table} RENAME COLUMN safe_name TO character_id"
+
+# Запросы с параметрами: sqlite3 кэширует подготовленные выражения на каждом соединении
+SELECT_DOCUMENT = "SELECT data FROM characters WHERE user_id = ? AND character_id = ?"
+SELECT_HEADER = (
+    "SELECT name, race, class_name, level, is_active, version "
+    "FROM characters WHERE user_id = ? AND character_id = ?"
+)
+SELECT_DOCUMENTS = "SELECT character_id, data FROM characters WHERE user_id = ?"
+SELECT_SUMMARIES = (
+    "SELECT character_id, name, race, class_name, level, is_active "
+    "FROM characters WHERE user_id = ? ORDER BY rowid"
+)
+SELECT_ALL = "SELECT user_id, character_id, data FROM characters ORDER BY user_id"
+UPSERT_DOCUMENT = (
+    "INSERT INTO characters (user_id, character_id, name, race, class_name, level, is_active, version, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id, character_id) DO UPDATE SET "
+    "name = excluded.name, race = excluded.race, class_name = excluded.class_name, "
+    "level = excluded.level, is_active = excluded.is_active, version = excluded.version, data = excluded.data"
+)
+DELETE_DOCUMENT = "DELETE FROM characters WHERE user_id = ? AND character_id = ?"
+INSERT_EVENT = "INSERT INTO character_events (user_id, character_id, version, time, event) VALUES (?, ?, ?, ?, ?)"
+SELECT_EVENTS = "SELECT event FROM character_events WHERE user_id = ? AND character_id = ? ORDER BY version"
+DELETE_EVENTS = "DELETE FROM character_events WHERE user_id = ? AND character_id = ?"
+SELECT_META = "SELECT active FROM user_meta WHERE user_id = ?"
+SELECT_ACTIVE = "SELECT user_id, active FROM user_meta WHERE active IS NOT NULL ORDER BY user_id"
+UPSERT_META = (
+    "INSERT INTO user_meta (user_id, active) VALUES (?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET active = excluded.active"
+)
+TRIM_EVENTS = (
+    "DELETE FROM character_events WHERE rowid IN ("
+    "SELECT rowid FROM (SELECT rowid, ROW_NUMBER() OVER ("
+    "PARTITION BY user_id, character_id ORDER BY version DESC) AS position FROM character_events) "
+    "WHERE position > ?)"
+)
+
+class SQLiteCharacterStorage(CharacterStorage):
+    """Хранилище персонажей в одной базе SQLite (WAL) с тем же интерфейсом, что и CharacterStorage"""
+    
+    def __init__(self, db_path: str = "characters.db", max_workers: int = 8, cache_size: int = 256, codec: str = "json",
+                 shared: bool = False):
+        self.db_path = Path(db_path)
+        super().__init__(
+            str(self.db_path.parent), max_workers=max_workers, cache_size=cache_size, codec=codec, shared=shared
+        )
+        # Одно соединение на рабочий поток
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(characters)")}
+        if "version" not in columns:
+            connection.execute(ADD_VERSION_COLUMN)
+        for table in ("characters", "character_events"):
+            columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            if "safe_name" in columns:
+                connection.execute(RENAME_KEY_COLUMN.format(table=table))
+    
+    def _lock_dir(self) -> Path:
+        """Каталог межпроцессных блокировок рядом с базой"""
+        return self.db_path.with_name(self.db_path.name + ".locks")
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Получить соединение текущего потока"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # check_same_thread отключен только ради close(): соединением пользуется один поток
+            connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, cached_statements=64)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+    
+    def _row(self, user_id: int, character_id: str, character_data: Dict[str, Any]) -> Tuple:
+        """Строка таблицы для документа персонажа"""
+        return (
+            user_id,
+            character_id,
+            character_data["name"],
+            character_data.get("race"),
+            character_data.get("class_name"),
+            character_data.get("level"),
+            int(bool(character_data.get("is_active"))),
+            character_data.get("version") or 0,
+            codecs.encode_document(character_data, self.codec)
+        )
+    
+    def _summary(self, character_id: str, character_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Краткая запись о персонаже (без имени файла)"""
+        summary = {field: character_data.get(field) for field in SUMMARY_FIELDS}
+        summary["is_active"] = bool(summary["is_active"])
+        return summary
+    
+    def _read_document(self, user_id: int, character_id: str) -> Optional[Dict[str, Any]]:
+        """Прочитать документ персонажа или None, если его нет"""
+        row = self._connection().execute(SELECT_DOCUMENT, (user_id, character_id)).fetchone()
+        if row is None:
+            return None
+        character_data = codecs.decode_document(row[0])
+        # Документы, записанные до появления ID, используют его прежнее безопасное имя
+        character_data.setdefault("id", character_id)
+        return character_data
+    
+    def _read_fields(self, user_id: int, character_id: str, fields: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """Прочитать только указанные поля: легкие поля берутся из колонок, без разбора документа"""
+        if not set(fields) <= set(schema.HEADER_FIELDS):
+            character_data = self._read_document(user_id, character_id)
+            return {field: character_data.get(field) for field in fields} if character_data else None
+        row = self._connection().execute(SELECT_HEADER, (user_id, character_id)).fetchone()
+        if row is None:
+            return None
+        header = dict(zip(schema.HEADER_FIELDS, row))
+        header["is_active"] = bool(header["is_active"])
+        return {field: header[field] for field in fields}
+    
+    def _read_documents(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Прочитать все документы пользователя: character_id -> данные"""
+        rows = self._connection().execute(SELECT_DOCUMENTS, (user_id,)).fetchall()
+        documents = {}
+        for character_id, data in rows:
+            documents[character_id] = codecs.decode_document(data)
+            documents[character_id].setdefault("id", character_id)
+        return documents
+    
+    def _read_summaries(self, user_id: int) -> Dict[str, Dict[str, Any]]:
+        """Прочитать краткие записи по индексированным колонкам, не разбирая документы"""
+        rows = self._connection().execute(SELECT_SUMMARIES, (user_id,)).fetchall()
+        return {
+            row[0]: {
+                "name": row[1],
+                "race": row[2],
+                "class_name": row[3],
+                "level": row[4],
+                "is_active": bool(row[5])
+            }
+            for row in rows
+        }
+    
+    def _write_documents(self, user_id: int, documents: Dict[str, Dict[str, Any]],
+                         events: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        """Записать документы пользователя и их события одной транзакцией"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(UPSERT_DOCUMENT, [
+                self._row(user_id, character_id, character_data)
+                for character_id, character_data in documents.items()
+            ])
+            connection.executemany(INSERT_EVENT, [
+                (user_id, character_id, event["v"], event["t"], json.dumps(event, ensure_ascii=False))
+                for character_id, character_events in (events or {}).items()
+                for event in character_events
+            ])
+    
+    def _write_transaction(self, changes: List[Tuple[Tuple[int, str], Dict[str, Any], List[Dict[str, Any]]]]):
+        """Записать документы нескольких пользователей и их события одной транзакцией SQLite"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(UPSERT_DOCUMENT, [
+                self._row(user_id, character_id, character_data)
+                for (user_id, character_id), character_data, _ in changes
+            ])
+            connection.executemany(INSERT_EVENT, [
+                (user_id, character_id, event["v"], event["t"], json.dumps(event, ensure_ascii=False))
+                for (user_id, character_id), _, events in changes
+                for event in events
+            ])
+    
+    def _recover_transactions(self, user_id: Optional[int] = None) -> int:
+        """Журнал намерений не нужен: транзакции атомарны в самой SQLite"""
+        return 0
+    
+    def _write_patch(self, user_id: int, character_id: str, event: Dict[str, Any], character_data: Dict[str, Any]):
+        """Записать измененную строку вместе с событием: снимок в SQLite всегда актуален"""
+        self._write_documents(user_id, {character_id: character_data}, {character_id: [event]})
+    
+    def _read_history(self, user_id: int, character_id: str) -> List[Dict[str, Any]]:
+        """Прочитать все сохраненные события персонажа по возрастанию версии"""
+        rows = self._connection().execute(SELECT_EVENTS, (user_id, character_id)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def _delete_document(self, user_id: int, character_id: str) -> bool:
+        """Удалить документ персонажа и его историю"""
+        connection = self._connection()
+        with connection:
+            connection.execute(DELETE_EVENTS, (user_id, character_id))
+            return connection.execute(DELETE_DOCUMENT, (user_id, character_id)).rowcount > 0
+    
+    def _read_meta(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Прочитать метаданные пользователя или None, если строки еще нет"""
+        row = self._connection().execute(SELECT_META, (user_id,)).fetchone()
+        return {"active": row[0]} if row else None
+    
+    def _write_meta(self, user_id: int, meta: Dict[str, Any]):
+        """Записать метаданные пользователя"""
+        connection = self._connection()
+        with connection:
+            connection.execute(UPSERT_META, (user_id, meta.get("active")))
+    
+    def iter_active(self) -> Iterator[Tuple[int, str]]:
+        """Перебрать указатели на активных персонажей: (user_id, имя)"""
+        yield from self._connection().execute(SELECT_ACTIVE)
+    
+    def compact_journals(self) -> int:
+        """Строки SQLite всегда актуальны: сворачивать нечего"""
+        return 0
+    
+    def trim_history(self) -> int:
+        """Удалить из истории события сверх HISTORY_LIMIT, вернуть число удаленных событий"""
+        connection = self._connection()
+        with connection:
+            return connection.execute(TRIM_EVENTS, (self.HISTORY_LIMIT,)).rowcount
+    
+    def iter_documents(self) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """Перебрать все документы базы: (user_id, character_id, данные)"""
+        for user_id, character_id, data in self._connection().execute(SELECT_ALL):
+            character_data = codecs.decode_document(data)
+            character_data.setdefault("id", character_id)
+            yield user_id, character_id, character_data
+    
+    def import_documents(self, documents: Iterable[Tuple[int, str, Dict[str, Any]]], batch_size: int = 500,
+                         history: Optional[Callable[[int, str], List[Dict[str, Any]]]] = None) -> int:
+        """Потоково загрузить документы пачками по batch_size строк в транзакции.
+        history(user_id, character_id) - события персонажа: они заменяют его события в базе"""
+        connection = self._connection()
+        imported = 0
+        batch = []
+        events = []
+        
+        def write_batch():
+            with connection:
+                if history is not None:
+                    connection.executemany(DELETE_EVENTS, [row[:2] for row in batch])
+                    connection.executemany(INSERT_EVENT, events)
+                connection.executemany(UPSERT_DOCUMENT, batch)
+        
+        for user_id, character_id, character_data in documents:
+            batch.append(self._row(user_id, character_id, character_data))
+            if history is not None:
+                events.extend(
+                    (user_id, character_id, event["v"], event["t"], json.dumps(event, ensure_ascii=False))
+                    for event in history(user_id, character_id)
+                )
+            if len(batch) >= batch_size:
+                write_batch()
+                imported += len(batch)
+                batch = []
+                events = []
+        if batch:
+            write_batch()
+            imported += len(batch)
+        return imported
+    
+    def close(self):
+        """Остановить пул потоков и закрыть соединения с базой"""
+        super().close()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
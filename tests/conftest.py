@@ -0,0 +1,21 @@
+"""Общие фикстуры тестов: персонажи и управляемое время событий"""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.corpus import make_character
+from storage import patch
+
+@pytest.fixture
+def new_character():
+    """Фабрика персонажей со случайным, но воспроизводимым наполнением"""
+    rng = random.Random(0)
+    return lambda name: make_character(name, rng)
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Время событий персонажей, которое тест сдвигает сам (clock.now)"""
+    clock = SimpleNamespace(now=1_700_000_000)
+    monkeypatch.setattr(patch, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
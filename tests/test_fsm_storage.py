@@ -0,0 +1,93 @@
+"""Состояния диалогов в SQLite: сохранение между запусками и срок жизни записей"""
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import fsm_storage
+from storage.fsm_storage import SQLiteFSMStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+def rows(db_path):
+    """Записи, дошедшие до базы: (ключ, состояние)"""
+    with sqlite3.connect(db_path) as connection:
+        return connection.execute("SELECT key, state FROM fsm_states ORDER BY key").fetchall()
+
+async def flushed(storage):
+    """Дождаться записи накопленной пачки изменений в базу"""
+    if storage._flush_task is not None:
+        await storage._flush_task
+
+def test_state_survives_restart(tmp_path):
+    db_path = str(tmp_path / "fsm.db")
+    
+    async def write():
+        storage = SQLiteFSMStorage(db_path)
+        await storage.set_state(KEY, "Dialog:waiting_for_name")
+        await storage.update_data(KEY, {"character_id": "abc"})
+        await storage.close()
+    
+    async def read():
+        storage = SQLiteFSMStorage(db_path)
+        try:
+            return await storage.get_state(KEY), await storage.get_data(KEY), await storage.get_state(OTHER)
+        finally:
+            await storage.close()
+    
+    asyncio.run(write())
+    assert asyncio.run(read()) == ("Dialog:waiting_for_name", {"character_id": "abc"}, None)
+
+def test_entries_expire_and_are_swept(tmp_path, monkeypatch):
+    clock = SimpleNamespace(now=1_700_000_000.0)
+    monkeypatch.setattr(fsm_storage, "time", SimpleNamespace(time=lambda: clock.now))
+    db_path = str(tmp_path / "fsm.db")
+    
+    async def scenario():
+        storage = SQLiteFSMStorage(db_path, ttl=3600, state_ttls={"Dialog:short": 60})
+        try:
+            await storage.set_state(KEY, "Dialog:long")
+            await storage.set_state(OTHER, "Dialog:short")
+            await flushed(storage)
+            
+            clock.now += 120
+            # Короткий срок своего состояния истек, общий - нет
+            assert await storage.get_state(OTHER) is None
+            assert await storage.get_data(OTHER) == {}
+            assert await storage.get_state(KEY) == "Dialog:long"
+            assert storage.sweep() == 1
+            assert rows(db_path) == [(storage.key_builder.build(KEY), "Dialog:long")]
+            
+            # Запись продлевает срок от момента последнего изменения
+            clock.now += 3000
+            await storage.update_data(KEY, {"step": 2})
+            clock.now += 3000
+            assert await storage.get_data(KEY) == {"step": 2}
+        finally:
+            await storage.close()
+    
+    asyncio.run(scenario())
+
+def test_cleared_dialog_is_deleted_and_evicted_entries_are_read_back(tmp_path):
+    db_path = str(tmp_path / "fsm.db")
+    
+    async def scenario():
+        storage = SQLiteFSMStorage(db_path, cache_size=1)
+        try:
+            await storage.set_state(KEY, "Dialog:first")
+            # Вторая запись вытесняет первую из кэша до того, как пачка ушла в базу
+            await storage.set_state(OTHER, "Dialog:second")
+            assert await storage.get_state(KEY) == "Dialog:first"
+            await flushed(storage)
+            
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+            await flushed(storage)
+            assert rows(db_path) == [(storage.key_builder.build(OTHER), "Dialog:second")]
+            assert await storage.get_state(OTHER) == "Dialog:second"
+        finally:
+            await storage.close()
+    
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+"""История персонажа: события, восстановление на момент времени и свертка журналов в снимки"""
+import pytest
+
+from storage.character_storage import create_storage
+
+GOLD = "equipment.money.gold"
+
+@pytest.fixture(params=["files", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        storage = create_storage("sqlite", db_path=str(tmp_path / "characters.db"), cache_size=0)
+    else:
+        storage = create_storage("files", base_dir=str(tmp_path / "characters"), cache_size=0)
+    # Маленький порог: журналы сворачиваются в снимки уже в коротком тесте
+    storage.SNAPSHOT_EVERY = 4
+    yield storage
+    storage.close()
+
+def test_load_at_every_step_across_snapshots(storage, new_character, clock):
+    hero = new_character("Арагорн")
+    storage.save_character(1, hero)
+    states = {clock.now: storage.load_character(1, hero["id"])}
+    for step in range(10):
+        clock.now += 60
+        storage.patch_character(1, hero["id"], [["inc", GOLD, step + 1]], kind="money")
+        states[clock.now] = storage.load_character(1, hero["id"])
+    
+    history = storage.character_history(1, hero["id"], limit=100)
+    assert [event["v"] for event in history] == list(range(11, 0, -1))
+    assert [event["e"] for event in history[:-1]] == ["money"] * 10
+    for moment, state in states.items():
+        assert storage.load_character_at(1, hero["id"], moment) == state
+        assert storage.load_character_at(1, hero["id"], moment + 30) == state
+    # До создания персонажа его не было
+    assert storage.load_character_at(1, hero["id"], min(states) - 1) is None
+
+def test_undo_of_append_and_insert_removes_the_added_copy(storage, new_character, clock):
+    hero = new_character("Гимли")
+    hero["equipment"]["weapons"]["items"] = ["Кинжал", "Топор"]
+    storage.save_character(1, hero)
+    original = storage.load_character(1, hero["id"])
+    
+    clock.now += 60
+    storage.patch_character(1, hero["id"], [["append", "equipment.weapons.items", "Кинжал"]])
+    clock.now += 60
+    storage.patch_character(1, hero["id"], [["insert", "equipment.weapons.items", [0, "Топор"]]])
+    assert storage.load_character(1, hero["id"])["equipment"]["weapons"]["items"] == [
+        "Топор", "Кинжал", "Топор", "Кинжал"
+    ]
+    
+    after_append = storage.load_character_at(1, hero["id"], clock.now - 30)
+    assert after_append["equipment"]["weapons"]["items"] == ["Кинжал", "Топор", "Кинжал"]
+    assert storage.load_character_at(1, hero["id"], clock.now - 90) == original
+
+def test_trim_history_keeps_newest_events(storage, new_character, clock):
+    storage.HISTORY_LIMIT = 5
+    hero = new_character("Леголас")
+    storage.save_character(1, hero)
+    for _ in range(8):
+        clock.now += 60
+        storage.patch_character(1, hero["id"], [["inc", GOLD, 1]])
+    
+    assert storage.trim_history() == 4
+    assert [event["v"] for event in storage.character_history(1, hero["id"], limit=100)] == [9, 8, 7, 6, 5]
+    # Последние события по-прежнему откатываются
+    assert storage.load_character_at(1, hero["id"], clock.now - 90)["version"] == 7
+
+def test_compact_journals_keeps_documents(tmp_path, new_character, clock):
+    storage = create_storage("files", base_dir=str(tmp_path), cache_size=0)
+    hero = new_character("Боромир")
+    storage.save_character(1, hero)
+    for _ in range(3):
+        clock.now += 60
+        storage.patch_character(1, hero["id"], [["inc", GOLD, 1]])
+    current = storage.load_character(1, hero["id"])
+    user_dir = storage._get_user_dir(1)
+    assert list(user_dir.glob(f"*{storage.JOURNAL_SUFFIX}"))
+    
+    assert storage.compact_journals() == 1
+    assert not list(user_dir.glob(f"*{storage.JOURNAL_SUFFIX}"))
+    assert storage.load_character(1, hero["id"]) == current
+    assert storage.load_character_at(1, hero["id"], clock.now - 90)["version"] == 2
+    storage.close()
@@ -0,0 +1,50 @@
+"""Перенос каталогов пользователей из раскладки characters/<user_id> в characters/ab/cd/<user_id>"""
+import hashlib
+import os
+
+from storage.character_storage import CharacterStorage
+
+def to_legacy(storage, user_id):
+    """Переложить файлы пользователя в каталог старой раскладки"""
+    shard_dir = storage._get_shard_dir(user_id)
+    legacy_dir = storage.base_dir / str(user_id)
+    legacy_dir.mkdir(exist_ok=True)
+    for path in shard_dir.iterdir():
+        os.replace(path, legacy_dir / path.name)
+    shard_dir.rmdir()
+
+def test_migrate_layout_keeps_characters(tmp_path, new_character):
+    # Пользователь, чей каталог шарда называется так же, как старый каталог пользователя 12
+    neighbour = next(user_id for user_id in range(100, 100_000)
+                     if hashlib.md5(str(user_id).encode()).hexdigest().startswith("12"))
+    storage = CharacterStorage(str(tmp_path), cache_size=0)
+    characters = {}
+    for user_id in (neighbour, 1, 12, 4096):
+        character = new_character(f"Игрок {user_id}")
+        storage.save_character(user_id, character)
+        storage.set_active_character(user_id, character["id"])
+        characters[user_id] = storage.load_character(user_id, character["id"])
+    for user_id in (1, 12, 4096):
+        to_legacy(storage, user_id)
+    storage.close()
+    
+    storage = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        # До миграции старые каталоги читаются как есть
+        for user_id, character in characters.items():
+            assert storage.load_character(user_id, character["id"]) == character
+        
+        assert storage.migrate_layout() == 3
+        assert storage.migrate_layout() == 0
+        
+        assert not (tmp_path / "1").exists() and not (tmp_path / "4096").exists()
+        # В каталоге 12 остались только каталоги шардов
+        assert all(path.is_dir() for path in (tmp_path / "12").iterdir())
+        assert sorted(user_id for user_id, _ in storage._iter_user_dirs()) == sorted(characters)
+        for user_id, character in characters.items():
+            assert storage._get_user_dir(user_id) == storage._get_shard_dir(user_id)
+            assert storage.load_character(user_id, character["id"]) == character
+            assert storage.get_active_character(user_id) == character["id"]
+            assert storage.find_character_id(user_id, character["name"]) == character["id"]
+    finally:
+        storage.close()
@@ -0,0 +1,71 @@
+"""Миграции хранилища: перенос дерева файлов в SQLite"""
+import json
+
+from storage.character_storage import CharacterStorage
+from storage.migrate import migrate_to_sqlite
+from storage.sqlite_storage import SQLiteCharacterStorage
+
+def tree_state(base_dir):
+    """Содержимое всех файлов каталога: путь -> байты"""
+    return {path: path.read_bytes() for path in sorted(base_dir.rglob("*")) if path.is_file()}
+
+def test_sqlite_migration_keeps_history_and_active(tmp_path, new_character, clock):
+    source_dir = tmp_path / "characters"
+    source = CharacterStorage(str(source_dir), cache_size=0)
+    source.SNAPSHOT_EVERY = 8
+    hero = new_character("Арагорн")
+    source.save_character(1, hero)
+    # Больше SNAPSHOT_EVERY изменений: часть событий свернута в историю, часть лежит в журнале
+    for step in range(12):
+        clock.now += 60
+        source.patch_character(1, hero["id"], [["inc", "equipment.money.gold", 1]], kind="money")
+    source.set_active_character(1, hero["id"])
+    # Данные старого вида: без указателя (флаг is_active в документе) и с указателем-именем
+    legacy = new_character("Гимли")
+    legacy["is_active"] = True
+    source.save_character(2, legacy)
+    named = new_character("Леголас")
+    source.save_character(3, named)
+    (source._get_user_dir(3) / source.META_NAME).write_text(json.dumps({"active": "Леголас"}), encoding="utf-8")
+    expected = {(user_id, character["id"]): source.load_character(user_id, character["id"])
+                for user_id, character in ((1, hero), (2, legacy), (3, named))}
+    history = source.character_history(1, hero["id"], limit=100)
+    middle = source.load_character_at(1, hero["id"], clock.now - 6 * 60)
+    source.close()
+    before = tree_state(source_dir)
+    
+    assert migrate_to_sqlite(str(source_dir), str(tmp_path / "characters.db")) == 3
+    
+    # Миграция только читает исходное дерево
+    assert tree_state(source_dir) == before
+    target = SQLiteCharacterStorage(str(tmp_path / "characters.db"), cache_size=0)
+    try:
+        for (user_id, character_id), character in expected.items():
+            assert target.load_character(user_id, character_id) == character
+        assert target.character_history(1, hero["id"], limit=100) == history
+        assert len(history) == 13
+        assert target.load_character_at(1, hero["id"], clock.now - 6 * 60) == middle
+        assert middle["equipment"]["money"]["gold"] == hero["equipment"]["money"]["gold"] + 6
+        assert target.get_active_character(1) == hero["id"]
+        assert target.get_active_character(2) == legacy["id"]
+        assert target.get_active_character(3) == named["id"]
+    finally:
+        target.close()
+
+def test_sqlite_migration_is_repeatable(tmp_path, new_character):
+    source_dir = tmp_path / "characters"
+    source = CharacterStorage(str(source_dir), cache_size=0)
+    hero = new_character("Арагорн")
+    source.save_character(1, hero)
+    source.patch_character(1, hero["id"], [["set", "description", "Следопыт"]])
+    source.close()
+    
+    for _ in range(2):
+        migrate_to_sqlite(str(source_dir), str(tmp_path / "characters.db"))
+    
+    target = SQLiteCharacterStorage(str(tmp_path / "characters.db"), cache_size=0)
+    try:
+        # Повторный перенос заменяет события персонажа, а не дублирует их
+        assert [event["v"] for event in target.character_history(1, hero["id"])] == [2, 1]
+    finally:
+        target.close()
@@ -0,0 +1,40 @@
+"""Трата денег из диалога, когда персонажа изменили после выбора"""
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from handlers.money_management import process_money_amount
+from storage.character_storage import CharacterStorage
+
+def test_spend_after_concurrent_write_reports_shortage(tmp_path, new_character):
+    async def scenario():
+        storage = CharacterStorage(str(tmp_path), cache_size=0)
+        character = new_character("Арагорн")
+        character["equipment"]["money"]["gold"] = 100
+        storage.save_character(1, character)
+        
+        # Снимок диалога взят при выборе персонажа, затем другой запрос тратит почти все золото
+        await storage.session(1, character["id"])
+        spent = storage.load_character(1, character["id"])
+        spent["equipment"]["money"]["gold"] = 10
+        storage.save_character(1, spent)
+        
+        state = FSMContext(MemoryStorage(), StorageKey(bot_id=0, chat_id=1, user_id=1))
+        await state.set_data({"character_id": character["id"], "money_operation": "Потратить"})
+        replies = []
+        
+        async def answer(text, **kwargs):
+            replies.append(text)
+        
+        message = SimpleNamespace(text="0 60 0 0", from_user=SimpleNamespace(id=1), answer=answer)
+        await process_money_amount(message, state, storage)
+        
+        assert replies == ["Недостаточно денег для совершения операции."]
+        assert storage.load_character(1, character["id"])["equipment"]["money"]["gold"] == 10
+        assert await state.get_data() == {}
+        storage.close()
+    
+    asyncio.run(scenario())
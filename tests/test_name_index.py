@@ -0,0 +1,85 @@
+"""Индекс имен персонажей и манифест пользователя"""
+import pytest
+
+from storage.character_storage import CharacterStorage
+
+def crash(*args, **kwargs):
+    raise OSError("сбой процесса")
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = CharacterStorage(str(tmp_path), cache_size=0)
+    yield storage
+    storage.close()
+
+def test_rename_and_delete_update_index(storage, new_character):
+    hero = new_character("Арагорн")
+    storage.save_character(1, hero)
+    assert storage.find_character_id(1, "Арагорн") == hero["id"]
+    
+    assert storage.rename_character(1, hero["id"], "Странник")
+    assert storage.find_character_id(1, "Арагорн") is None
+    assert storage.find_character_id(1, "Странник") == hero["id"]
+    
+    # Имя занято другим персонажем: переименование отклоняется
+    other = new_character("Боромир")
+    storage.save_character(1, other)
+    assert not storage.rename_character(1, other["id"], "Странник")
+    
+    assert storage.delete_character(1, hero["id"])
+    assert storage.find_character_id(1, "Странник") is None
+    assert [summary["name"] for summary in storage.get_character_summaries(1)] == ["Боромир"]
+
+def test_index_survives_reopen(tmp_path, storage, new_character):
+    hero = new_character("Арагорн")
+    storage.save_character(1, hero)
+    storage.rename_character(1, hero["id"], "Странник")
+    
+    reopened = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        assert reopened.find_character_id(1, "Странник") == hero["id"]
+        assert reopened.find_character_id(1, "Арагорн") is None
+    finally:
+        reopened.close()
+
+def test_crash_before_manifest_update_on_create(tmp_path, storage, new_character, monkeypatch):
+    storage.save_character(1, new_character("Боромир"))
+    hero = new_character("Арагорн")
+    monkeypatch.setattr(storage, "_update_manifest", crash)
+    # Снимок записан, манифест - нет
+    assert not storage.save_character(1, hero)
+    
+    reopened = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        assert reopened.find_character_id(1, "Арагорн") == hero["id"]
+        assert {summary["name"] for summary in reopened.get_character_summaries(1)} == {"Арагорн", "Боромир"}
+    finally:
+        reopened.close()
+
+def test_crash_before_manifest_update_on_delete(tmp_path, storage, new_character, monkeypatch):
+    hero = new_character("Арагорн")
+    storage.save_character(1, hero)
+    storage.save_character(1, new_character("Боромир"))
+    monkeypatch.setattr(storage, "_update_manifest", crash)
+    storage.delete_character(1, hero["id"])
+    
+    reopened = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        assert reopened.find_character_id(1, "Арагорн") is None
+        assert [summary["name"] for summary in reopened.get_character_summaries(1)] == ["Боромир"]
+    finally:
+        reopened.close()
+
+def test_shared_index_sees_other_process_changes(tmp_path, new_character):
+    first = CharacterStorage(str(tmp_path), cache_size=0, shared=True)
+    second = CharacterStorage(str(tmp_path), cache_size=0, shared=True)
+    try:
+        hero = new_character("Арагорн")
+        first.save_character(1, hero)
+        assert second.find_character_id(1, "Арагорн") == hero["id"]
+        first.rename_character(1, hero["id"], "Странник")
+        assert second.find_character_id(1, "Арагорн") is None
+        assert second.find_character_id(1, "Странник") == hero["id"]
+    finally:
+        first.close()
+        second.close()
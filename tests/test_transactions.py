@@ -0,0 +1,178 @@
+"""Транзакции над несколькими персонажами и их довод по журналу намерений после сбоя"""
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from storage.character_storage import CharacterStorage
+
+GOLD = "equipment.money.gold"
+
+def gold(character):
+    return character["equipment"]["money"]["gold"]
+
+def transfer(amount):
+    """Перевод золота от первого персонажа транзакции второму"""
+    def mutate(documents):
+        documents[0]["equipment"]["money"]["gold"] -= amount
+        documents[1]["equipment"]["money"]["gold"] += amount
+    return mutate
+
+def crash_after_commit(*args, **kwargs):
+    """Процесс умирает сразу после точки фиксации, не записав ни одного документа"""
+    os._exit(1)
+
+def failed_write(*args, **kwargs):
+    raise OSError("сбой записи")
+
+def seed(base_dir, new_character, shared=False):
+    """Два персонажа разных пользователей по 100 золотых"""
+    storage = CharacterStorage(str(base_dir), cache_size=0, shared=shared)
+    refs = []
+    for user_id, name in ((1, "Арагорн"), (2, "Гимли")):
+        character = new_character(name)
+        character["equipment"]["money"]["gold"] = 100
+        storage.save_character(user_id, character)
+        refs.append((user_id, character["id"]))
+    storage.close()
+    return refs
+
+def pending_logs(base_dir):
+    return list((base_dir / CharacterStorage.TRANSACTIONS_DIR).glob("*.json"))
+
+def test_transaction_is_atomic(tmp_path, new_character):
+    refs = seed(tmp_path, new_character)
+    storage = CharacterStorage(str(tmp_path))
+    try:
+        documents = storage.transact_characters(refs, transfer(30))
+        assert [gold(document) for document in documents] == [70, 130]
+        assert [gold(storage.load_character(*ref)) for ref in refs] == [70, 130]
+        # Отмененная транзакция ничего не пишет
+        assert storage.transact_characters(refs, lambda documents: False) is None
+        assert [storage.load_character(*ref)["version"] for ref in refs] == [2, 2]
+    finally:
+        storage.close()
+
+def test_startup_completes_committed_transaction(tmp_path, new_character, monkeypatch):
+    refs = seed(tmp_path, new_character)
+    storage = CharacterStorage(str(tmp_path), cache_size=0)
+    monkeypatch.setattr(storage, "_apply_transaction", failed_write)
+    assert storage.transact_characters(refs, transfer(30)) is None
+    storage.close()
+    assert len(pending_logs(tmp_path)) == 1
+    
+    reopened = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        assert [gold(reopened.load_character(*ref)) for ref in refs] == [70, 130]
+        assert not pending_logs(tmp_path)
+        assert [event["e"] for event in reopened.character_history(*refs[0])][:1] == ["transaction"]
+    finally:
+        reopened.close()
+
+def test_startup_drops_uncommitted_transaction(tmp_path, new_character):
+    refs = seed(tmp_path, new_character)
+    log_dir = tmp_path / CharacterStorage.TRANSACTIONS_DIR
+    log_dir.mkdir()
+    # Журнал, который процесс не успел переименовать (PID заведомо не существует)
+    (log_dir / "abc.4194305.tmp").write_text("[", encoding="utf-8")
+    
+    reopened = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        assert not list(log_dir.iterdir())
+        assert [gold(reopened.load_character(*ref)) for ref in refs] == [100, 100]
+    finally:
+        reopened.close()
+
+def test_recovery_keeps_newer_versions(tmp_path, new_character, monkeypatch):
+    refs = seed(tmp_path, new_character)
+    storage = CharacterStorage(str(tmp_path), cache_size=0)
+    records = []
+    apply = storage._apply_transaction
+    monkeypatch.setattr(storage, "_apply_transaction", lambda record: (records.append(record), apply(record)))
+    storage.transact_characters(refs, transfer(30))
+    storage.patch_character(*refs[0], [["inc", GOLD, 5]])
+    storage.close()
+    # Журнал уже примененной транзакции остался на диске, а первого персонажа после нее изменили
+    (tmp_path / CharacterStorage.TRANSACTIONS_DIR / "stale.json").write_text(json.dumps(records[0]), encoding="utf-8")
+    
+    reopened = CharacterStorage(str(tmp_path), cache_size=0)
+    try:
+        first, second = (reopened.load_character(*ref) for ref in refs)
+        assert (gold(first), first["version"]) == (75, 3)
+        assert (gold(second), second["version"]) == (130, 2)
+        assert not pending_logs(tmp_path)
+    finally:
+        reopened.close()
+
+def crashing_transaction(base_dir, refs, started):
+    storage = CharacterStorage(str(base_dir), cache_size=0, shared=True)
+    started.wait()
+    storage._apply_transaction = crash_after_commit
+    storage.transact_characters(refs, transfer(30))
+    os._exit(2)
+
+def patching_writer(base_dir, ref, count, started):
+    storage = CharacterStorage(str(base_dir), shared=True)
+    for step in range(count):
+        assert storage.patch_character(*ref, [["inc", GOLD, 1]]) is not None
+        if step == count // 2:
+            started.set()
+    storage.close()
+
+@pytest.fixture
+def fork():
+    return multiprocessing.get_context("fork")
+
+def test_live_process_sees_transaction_of_crashed_writer(tmp_path, new_character, fork):
+    refs = seed(tmp_path, new_character, shared=True)
+    live = CharacterStorage(str(tmp_path), shared=True)
+    try:
+        # Персонажи уже в кэше живого процесса
+        assert [gold(live.load_character(*ref)) for ref in refs] == [100, 100]
+        started = fork.Event()
+        started.set()
+        writer = fork.Process(target=crashing_transaction, args=(tmp_path, refs, started))
+        writer.start()
+        writer.join()
+        assert writer.exitcode == 1
+        assert len(pending_logs(tmp_path)) == 1
+        
+        # Живой процесс не ждет перезапуска: первое же чтение доводит транзакцию
+        assert [gold(live.load_character(*ref)) for ref in refs] == [70, 130]
+        assert not pending_logs(tmp_path)
+        assert live.patch_character(*refs[0], [["inc", GOLD, 1]])["version"] == 3
+    finally:
+        live.close()
+    
+    respawned = CharacterStorage(str(tmp_path), shared=True)
+    try:
+        first = respawned.load_character(*refs[0])
+        assert (gold(first), first["version"]) == (71, 3)
+    finally:
+        respawned.close()
+
+def test_crash_after_commit_while_other_process_writes(tmp_path, new_character, fork):
+    refs = seed(tmp_path, new_character, shared=True)
+    writes = 40
+    started = fork.Event()
+    crashing = fork.Process(target=crashing_transaction, args=(tmp_path, refs, started))
+    writer = fork.Process(target=patching_writer, args=(tmp_path, refs[0], writes, started))
+    crashing.start()
+    writer.start()
+    crashing.join()
+    writer.join()
+    assert (crashing.exitcode, writer.exitcode) == (1, 0)
+    
+    # Перезапуск упавшего работника: довод при запуске не откатывает записанное после сбоя
+    respawned = CharacterStorage(str(tmp_path), shared=True)
+    try:
+        first, second = (respawned.load_character(*ref) for ref in refs)
+        assert gold(first) == 100 - 30 + writes
+        assert gold(second) == 130
+        # Ни одна версия не потеряна и не повторилась: создание, изменения и транзакция
+        versions = [event["v"] for event in respawned.character_history(*refs[0], limit=100)]
+        assert versions == list(range(writes + 2, 0, -1))
+        assert first["version"] == writes + 2
+    finally:
+        respawned.close()
@@ -0,0 +1,73 @@
+"""Версии документов и запись с проверкой версии (compare-and-swap)"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from storage.character_storage import create_storage
+
+@pytest.fixture(params=["files", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        storage = create_storage("sqlite", db_path=str(tmp_path / "characters.db"))
+    else:
+        storage = create_storage("files", base_dir=str(tmp_path / "characters"))
+    yield storage
+    storage.close()
+
+def gold(character):
+    return character["equipment"]["money"]["gold"]
+
+def test_stale_version_is_rejected(storage, new_character):
+    hero = new_character("Арагорн")
+    storage.save_character(1, hero)
+    first = storage.load_character(1, hero["id"])
+    second = storage.load_character(1, hero["id"])
+    
+    first["equipment"]["money"]["gold"] += 10
+    assert storage.save_character_if_version(1, first, second["version"])
+    # Второй писатель загрузил ту же версию: его запись затерла бы первую
+    second["equipment"]["money"]["gold"] += 5
+    assert not storage.save_character_if_version(1, second, second["version"])
+    assert storage.version_conflicts == 1
+    
+    stored = storage.load_character(1, hero["id"])
+    assert gold(stored) == gold(hero) + 10
+    assert stored["version"] == second["version"] + 1
+
+def test_concurrent_writers_lose_no_updates(storage, new_character):
+    hero = new_character("Гимли")
+    storage.save_character(1, hero)
+    
+    def add_gold():
+        while True:
+            character = storage.load_character(1, hero["id"])
+            version = character["version"]
+            character["equipment"]["money"]["gold"] += 1
+            if storage.save_character_if_version(1, character, version):
+                return
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(add_gold) for _ in range(40)]:
+            future.result()
+    stored = storage.load_character(1, hero["id"])
+    assert gold(stored) == gold(hero) + 40
+    assert stored["version"] == 41
+
+def test_commit_session_reapplies_change_to_fresh_document(storage, new_character):
+    hero = new_character("Леголас")
+    storage.save_character(1, hero)
+    
+    async def scenario():
+        await storage.session(1, hero["id"])
+        # Персонажа изменили после того, как диалог взял снимок
+        storage.patch_character(1, hero["id"], [["inc", "equipment.money.gold", 7]])
+        
+        def add_gold(character):
+            character["equipment"]["money"]["gold"] += 3
+        
+        return await storage.commit_session(1, hero["id"], add_gold, "money_add")
+    
+    committed = asyncio.run(scenario())
+    assert gold(committed) == gold(hero) + 10
+    assert storage.load_character(1, hero["id"]) == committed
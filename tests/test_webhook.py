@@ -0,0 +1,37 @@
+"""Прием обновлений webhook: проверка секрета и формата запроса"""
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, WebhookReceiver
+
+SECRET = "s3cret"
+UPDATE = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}}
+
+def post(headers, json=UPDATE):
+    """Отправить обновление приемнику; вернуть код ответа и принятые обновления"""
+    consumed = []
+    
+    async def consume(update):
+        consumed.append(update)
+    
+    async def scenario():
+        receiver = WebhookReceiver(consume, SECRET)
+        async with TestClient(TestServer(receiver.application())) as client:
+            response = await client.post(receiver.path, json=json, headers=headers)
+            return response.status
+    
+    return asyncio.run(scenario()), consumed
+
+def test_valid_secret_is_accepted():
+    assert post({SECRET_HEADER: SECRET}) == (200, [UPDATE])
+
+def test_missing_or_wrong_secret_is_rejected():
+    assert post({}) == (401, [])
+    assert post({SECRET_HEADER: "wrong"}) == (401, [])
+
+def test_non_ascii_secret_is_rejected():
+    assert post({SECRET_HEADER: "секрет"}) == (401, [])
+
+def test_malformed_update_is_rejected():
+    assert post({SECRET_HEADER: SECRET}, json=[1, 2]) == (400, [])
@@ -0,0 +1,98 @@
+"""
+Режим webhook: обновления принимает встроенный сервер aiohttp, а не длинный опрос getUpdates.
+
+Telegram присылает каждое обновление POST-запросом на WEBHOOK_PATH с заголовком
+X-Telegram-Bot-Api-Secret-Token; запрос без него или с другим секретом отклоняется (401),
+тело не в формате JSON - 400. Ответ 200 уходит сразу после приема, обновление обрабатывается
+в фоне: Telegram не ждет обработчиков и не повторяет доставку из-за медленной команды.
+Экземпляры в этом режиме не держат соединений с API и могут стоять за балансировщиком.
+
+При заданном WEBHOOK_URL при запуске вызывается setWebhook с секретом; без него адрес
+регистрировать не нужно - обновления можно присылать вручную:
+    curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -H "Content-Type: application/json" -d @update.json http://localhost:8080/webhook
+
+Принятое обновление ставится в планировщик (scheduler.py); если его очереди заполнены,
+ответ задерживается до освобождения места. Остановка по SIGINT/SIGTERM: сервер перестает
+принимать запросы, принятые обновления дообрабатываются, затем диспетчер закрывает
+хранилище состояний диалогов.
+"""
+import asyncio
+import logging
+import secrets
+from typing import Awaitable, Callable, Dict, Any, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from scheduler import UpdateScheduler, run_scheduled
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookReceiver:
+    """Прием обновлений по HTTP: проверка секрета и передача JSON обновления дальше (consume)"""
+    
+    def __init__(self, consume: Callable[[Dict[str, Any]], Awaitable[Any]], secret: str, path: str = "/webhook"):
+        if not secret:
+            raise ValueError("Не задан секрет webhook (WEBHOOK_SECRET)")
+        self.consume = consume
+        self.secret = secret
+        self.path = path
+        self.received = 0
+        self.rejected = 0
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        # Сравниваются байты: строки с не-ASCII символами compare_digest не принимает
+        header = request.headers.get(SECRET_HEADER, "").encode("utf-8", "surrogateescape")
+        if not secrets.compare_digest(header, self.secret.encode()):
+            self.rejected += 1
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400, text="Bad Request")
+        if not isinstance(update, dict) or "update_id" not in update:
+            self.rejected += 1
+            return web.Response(status=400, text="Bad Request")
+        self.received += 1
+        await self.consume(update)
+        return web.Response()
+    
+    def application(self) -> web.Application:
+        """Приложение aiohttp с единственным маршрутом webhook"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+async def serve(receiver: WebhookReceiver, host: str, port: int):
+    """Принимать обновления до отмены задачи; при отмене сервер закрывает порт и дожидается текущих запросов"""
+    runner = web.AppRunner(receiver.application(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Webhook принимает обновления на %s:%s%s", host, port, receiver.path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        logging.info("Webhook остановлен: принято обновлений %s, отклонено запросов %s",
+                     receiver.received, receiver.rejected)
+
+async def register_webhook(bot: Bot, url: Optional[str], path: str, secret: str, allowed_updates: Optional[list] = None):
+    """Сообщить Telegram адрес webhook и секрет (если адрес задан)"""
+    if not url:
+        logging.info("WEBHOOK_URL не задан: setWebhook не вызывается")
+        return
+    await bot.set_webhook(url.rstrip("/") + path, secret_token=secret, allowed_updates=allowed_updates)
+
+async def run_webhook(bot: Bot, dp: Dispatcher, scheduler: UpdateScheduler, host: str, port: int, path: str,
+                      secret: str, url: Optional[str] = None, stats_interval: float = 0.0):
+    """Запустить бота в режиме webhook в одном процессе и работать до SIGINT/SIGTERM"""
+    receiver = WebhookReceiver(scheduler.submit, secret, path)
+    
+    async def receiving():
+        await register_webhook(bot, url, path, secret, dp.resolve_used_update_types())
+        await serve(receiver, host, port)
+    
+    await run_scheduled(bot, dp, scheduler, receiving(), stats_interval)